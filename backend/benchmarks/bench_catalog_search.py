@@ -0,0 +1,71 @@
+"""Benchmark the IVF index behind /image-search on a synthetic catalog.
+
+Run from the backend directory:
+
+    python -m benchmarks.bench_catalog_search --items 1000000
+"""
+import argparse
+import time
+
+import numpy as np
+
+from utils.ann_index import IVFIndex
+from utils.similarity import FEATURE_DIM
+
+
+def synthetic_features(count: int, dim: int, clusters: int, rng: np.random.Generator) -> np.ndarray:
+    """Clustered unit vectors, closer to real product features than uniform noise"""
+    centers = rng.standard_normal((clusters, dim), dtype=np.float32)
+    vectors = np.empty((count, dim), dtype=np.float32)
+    for start in range(0, count, 100_000):
+        stop = min(start + 100_000, count)
+        chunk = centers[rng.integers(0, clusters, stop - start)]
+        chunk += rng.standard_normal(chunk.shape, dtype=np.float32) * 0.6
+        vectors[start:stop] = chunk / np.linalg.norm(chunk, axis=1, keepdims=True)
+    return vectors
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--items", type=int, default=1_000_000)
+    parser.add_argument("--queries", type=int, default=500)
+    parser.add_argument("--recall-queries", type=int, default=50)
+    parser.add_argument("--nprobe", type=int, default=16)
+    parser.add_argument("--k", type=int, default=10)
+    args = parser.parse_args()
+
+    rng = np.random.default_rng(0)
+    vectors = synthetic_features(args.items, FEATURE_DIM, clusters=max(args.items // 500, 1), rng=rng)
+
+    started = time.perf_counter()
+    index = IVFIndex(vectors, nprobe=args.nprobe)
+    build_s = time.perf_counter() - started
+
+    queries = vectors[rng.integers(0, args.items, args.queries)].copy()
+    queries += rng.standard_normal(queries.shape, dtype=np.float32) * 0.1
+    queries /= np.linalg.norm(queries, axis=1, keepdims=True)
+
+    latencies = []
+    for query in queries:
+        started = time.perf_counter()
+        index.search(query, args.k)
+        latencies.append((time.perf_counter() - started) * 1000)
+    p50, p95, p99 = np.percentile(latencies, [50, 95, 99])
+
+    hits = 0
+    for query in queries[:args.recall_queries]:
+        exact = np.argpartition(-(vectors @ query), args.k - 1)[:args.k]
+        found, _ = index.search(query, args.k)
+        hits += len(np.intersect1d(exact, found))
+    recall = hits / (args.k * min(args.recall_queries, len(queries)))
+
+    print(f"items:          {args.items:,} x {FEATURE_DIM} dims")
+    print(f"index build:    {build_s:8.2f} s")
+    print(f"query p50:      {p50:8.3f} ms")
+    print(f"query p95:      {p95:8.3f} ms")
+    print(f"query p99:      {p99:8.3f} ms")
+    print(f"recall@{args.k}:      {recall:8.3f} (nprobe={args.nprobe})")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,90 @@
+"""Compare the old per-router image handling with utils/image_pipeline.py.
+
+The old path decoded the upload, re-encoded it as JPEG, base64-encoded it,
+decoded the string again and base64-decoded it for ``Part.from_bytes``. The
+new path decodes at most once and encodes at most once to raw bytes.
+
+Run from the backend directory:
+
+    python -m benchmarks.bench_image_pipeline
+"""
+import argparse
+import base64
+import io
+import time
+
+import numpy as np
+from PIL import Image
+
+from utils.image_pipeline import prepare_image
+
+
+def legacy_path(raw: bytes) -> tuple[bytes, int]:
+    """The old router code; returns upstream bytes and bytes materialised on the way"""
+    image = Image.open(io.BytesIO(raw))
+    buffered = io.BytesIO()
+    image.save(buffered, format="JPEG")
+    jpeg = buffered.getvalue()
+    img_base64 = base64.b64encode(jpeg).decode()
+    upstream = base64.b64decode(img_base64)
+    pixels = image.width * image.height * len(image.getbands())
+    return upstream, pixels + len(jpeg) + 2 * len(img_base64) + len(upstream)
+
+
+def new_path(raw: bytes) -> tuple[bytes, int]:
+    prepared = prepare_image(raw)
+    if prepared.data is raw:
+        # Forwarded untouched: nothing was decoded or encoded
+        return prepared.data, 0
+    pixels = prepared.image.width * prepared.image.height * len(prepared.image.getbands())
+    return prepared.data, pixels + len(prepared.data)
+
+
+def sample_images(rng: np.random.Generator) -> dict[str, bytes]:
+    def smooth(size, mode="RGB"):
+        channels = len(mode)
+        small = rng.integers(0, 256, (16, 12, channels), dtype=np.uint8)
+        return Image.fromarray(small, mode).resize(size, Image.Resampling.BICUBIC)
+
+    samples = {}
+    buffered = io.BytesIO()
+    exif = Image.Exif()
+    exif[0x0112] = 6  # rotated phone photo
+    smooth((4032, 3024)).save(buffered, format="JPEG", quality=92, exif=exif)
+    samples["12MP phone JPEG (rotated)"] = buffered.getvalue()
+
+    buffered = io.BytesIO()
+    smooth((1080, 1350)).save(buffered, format="JPEG", quality=90)
+    samples["1080px JPEG"] = buffered.getvalue()
+
+    buffered = io.BytesIO()
+    smooth((2000, 2000), "RGBA").save(buffered, format="PNG")
+    samples["2000px RGBA PNG"] = buffered.getvalue()
+    return samples
+
+
+def measure(fn, raw, repeat):
+    started = time.process_time()
+    for _ in range(repeat):
+        result = fn(raw)
+    return result, (time.process_time() - started) * 1000 / repeat
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--repeat", type=int, default=5)
+    args = parser.parse_args()
+
+    print(f"{'input':28} {'path':7} {'upload':>9} {'upstream':>9} {'in memory':>10} {'CPU ms':>8}")
+    for name, raw in sample_images(np.random.default_rng(0)).items():
+        for label, fn in (("old", legacy_path), ("new", new_path)):
+            try:
+                (upstream, materialised), cpu_ms = measure(fn, raw, args.repeat)
+                row = f"{len(upstream) / 1024:8.0f}K {materialised / 1024:9.0f}K {cpu_ms:8.1f}"
+            except OSError as e:
+                row = f"failed: {e}"
+            print(f"{name:28} {label:7} {len(raw) / 1024:8.0f}K {row}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,128 @@
+"""Benchmark near-duplicate upload detection: hit rate, false matches and cost.
+
+Each original photo is inserted into a fresh index, then looked up again as
+the variants a phone produces (JPEG re-compression, resizing, PNG
+conversion, EXIF stripped by re-encoding). Those should map to the
+original's id. Two kinds of look-alikes should not:
+
+- different photos;
+- the same photo recoloured (channels swapped or hue-rotated), like one
+  garment shot in several colours;
+- the same scene with a different garment over the middle of the frame.
+
+Uploads go through prepare_image() as in the API. Run from the backend
+directory:
+
+    python -m benchmarks.bench_near_duplicates --originals 100
+"""
+import argparse
+import io
+import time
+
+import numpy as np
+from PIL import Image, ImageDraw
+
+from utils.image_pipeline import prepare_image
+from utils.near_duplicates import NearDuplicateIndex, exact_id, fingerprint
+
+
+def synthetic_photo(rng: np.random.Generator, size=(768, 1024)) -> Image.Image:
+    """A smooth backdrop with a garment-like block, roughly a product photo"""
+    backdrop = rng.integers(120, 256, (6, 5, 3), dtype=np.uint8)
+    image = Image.fromarray(backdrop).resize(size, Image.Resampling.BICUBIC)
+    draw = ImageDraw.Draw(image)
+    colour = tuple(int(c) for c in rng.integers(0, 256, 3))
+    x0, y0 = int(rng.integers(80, 300)), int(rng.integers(80, 300))
+    draw.rectangle([x0, y0, x0 + int(rng.integers(250, 420)), y0 + int(rng.integers(350, 650))], fill=colour)
+    for _ in range(3):
+        x, y = int(rng.integers(0, size[0])), int(rng.integers(0, size[1]))
+        draw.ellipse([x, y, x + 60, y + 60], fill=tuple(int(c) for c in rng.integers(0, 256, 3)))
+    return image
+
+
+def encode(image: Image.Image, fmt: str = "JPEG", **params) -> bytes:
+    buffered = io.BytesIO()
+    image.save(buffered, format=fmt, **params)
+    return buffered.getvalue()
+
+
+def variants(image: Image.Image, rng: np.random.Generator) -> dict[str, bytes]:
+    """Re-uploads of the same photo, by kind"""
+    scale = rng.uniform(0.4, 0.85)
+    return {
+        "recompressed": encode(image, quality=int(rng.integers(55, 80))),
+        "resized": encode(image.resize((int(image.width * scale), int(image.height * scale))), quality=85),
+        "png": encode(image, "PNG"),
+        "reencoded_exif_stripped": encode(image, quality=92, optimize=True),
+    }
+
+
+def lookalikes(image: Image.Image, rng: np.random.Generator) -> dict[str, bytes]:
+    """Different images that share the photo's layout"""
+    r, g, b = image.split()
+    hsv = np.asarray(image.convert("HSV")).copy()
+    hsv[..., 0] += 85  # about 120 degrees round the hue circle
+    other_garment = image.copy()
+    w, h = image.size
+    ImageDraw.Draw(other_garment).rectangle(
+        [w * 0.3, h * 0.35, w * 0.7, h * 0.7], fill=tuple(int(c) for c in rng.integers(0, 256, 3))
+    )
+    return {
+        "channels_swapped": encode(Image.merge("RGB", (b, r, g)), quality=90),
+        "hue_rotated": encode(Image.fromarray(hsv, "HSV").convert("RGB"), quality=90),
+        "other_garment": encode(other_garment, quality=90),
+    }
+
+
+def lookup(index: NearDuplicateIndex, raw: bytes, timings: list[float]) -> str:
+    prepared = prepare_image(raw)
+    start = time.perf_counter()
+    result = index.resolve(exact_id(raw), fingerprint(prepared.image))
+    timings.append(time.perf_counter() - start)
+    return result
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--originals", type=int, default=100)
+    parser.add_argument("--filler", type=int, default=5000, help="extra unrelated entries in the index")
+    args = parser.parse_args()
+
+    rng = np.random.default_rng(0)
+    index = NearDuplicateIndex(max_entries=args.filler + args.originals * 10)
+
+    # Unrelated entries, so candidate lookups run against a realistically full index
+    for i in range(args.filler):
+        filler = fingerprint(Image.fromarray(rng.integers(0, 256, (8, 6, 3), dtype=np.uint8)).resize((96, 128)))
+        index.resolve(f"filler-{i}", filler)
+
+    timings = []
+    originals = []
+    for _ in range(args.originals):
+        image = synthetic_photo(rng)
+        raw = encode(image, quality=90)
+        originals.append((image, lookup(index, raw, timings)))
+
+    hits, misses, false_matches, negatives = {}, {}, {}, {}
+    for image, original_id in originals:
+        for kind, raw in variants(image, rng).items():
+            matched = lookup(index, raw, timings) == original_id
+            hits[kind] = hits.get(kind, 0) + matched
+            misses[kind] = misses.get(kind, 0) + (not matched)
+        for kind, raw in lookalikes(image, rng).items():
+            negatives[kind] = negatives.get(kind, 0) + 1
+            false_matches[kind] = false_matches.get(kind, 0) + (lookup(index, raw, timings) == original_id)
+
+    print(f"originals:            {args.originals}  (index size {index.stats()['entries']})")
+    for kind in hits:
+        print(f"hit rate {kind + ':':24} {hits[kind] / (hits[kind] + misses[kind]):7.1%}")
+    for kind in negatives:
+        print(f"false matches {kind + ':':19} {false_matches[kind] / negatives[kind]:7.1%}")
+    # Different originals should never have matched each other either
+    distinct_false = args.originals - len({original_id for _, original_id in originals})
+    print(f"false matches {'distinct photos:':19} {distinct_false / args.originals:7.1%}")
+    print(f"fingerprint + lookup: {np.median(timings) * 1000:8.3f} ms median")
+
+
+if __name__ == "__main__":
+    main()
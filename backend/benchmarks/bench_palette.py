@@ -0,0 +1,52 @@
+"""Benchmark palette extraction and batched colour-harmony scoring used by /smart-pairing.
+
+Run from the backend directory:
+
+    python -m benchmarks.bench_palette --candidates 100
+"""
+import argparse
+import io
+import time
+
+import numpy as np
+from PIL import Image
+
+from utils import palette
+from benchmarks.bench_similarity import synthetic_jpeg
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--candidates", type=int, default=100)
+    parser.add_argument("--repeat", type=int, default=50)
+    args = parser.parse_args()
+
+    rng = np.random.default_rng(0)
+    item = synthetic_jpeg(rng)
+    # Candidate palettes come from the pairing cache, so only scoring is per request
+    candidates = palette.stack([
+        palette.Palette(
+            palette.srgb_to_lab(rng.integers(0, 256, (palette.PALETTE_SIZE, 3))),
+            np.full(palette.PALETTE_SIZE, 1 / palette.PALETTE_SIZE, dtype=np.float32),
+        )
+        for _ in range(args.candidates)
+    ])
+
+    start = time.perf_counter()
+    for _ in range(args.repeat):
+        item_palette = palette.extract_palette(Image.open(io.BytesIO(item)))
+    extract_ms = (time.perf_counter() - start) * 1000 / args.repeat
+
+    start = time.perf_counter()
+    for _ in range(args.repeat):
+        palette.harmony_scores(item_palette, candidates)
+    score_ms = (time.perf_counter() - start) * 1000 / args.repeat
+
+    print(f"candidates:           {args.candidates}")
+    print(f"decode + extract:     {extract_ms:8.2f} ms")
+    print(f"batched scoring:      {score_ms:8.3f} ms")
+    print(f"total per request:    {extract_ms + score_ms:8.2f} ms")
+
+
+if __name__ == "__main__":
+    main()
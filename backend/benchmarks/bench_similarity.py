@@ -0,0 +1,56 @@
+"""Benchmark the local visual similarity engine used by /visual-similarity.
+
+Run from the backend directory:
+
+    python -m benchmarks.bench_similarity --targets 50
+"""
+import argparse
+import io
+import time
+
+import numpy as np
+from PIL import Image
+
+from utils import similarity
+
+
+def synthetic_jpeg(rng: np.random.Generator, size=(768, 1024)) -> bytes:
+    """A smooth random JPEG roughly the size of a phone product photo"""
+    small = rng.integers(0, 256, (12, 9, 3), dtype=np.uint8)
+    image = Image.fromarray(small).resize(size, Image.Resampling.BICUBIC)
+    buffered = io.BytesIO()
+    image.save(buffered, format="JPEG", quality=90)
+    return buffered.getvalue()
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--targets", type=int, default=50)
+    parser.add_argument("--repeat", type=int, default=20)
+    args = parser.parse_args()
+
+    rng = np.random.default_rng(0)
+    reference = synthetic_jpeg(rng)
+    targets = [synthetic_jpeg(rng) for _ in range(args.targets)]
+
+    start = time.perf_counter()
+    for _ in range(args.repeat):
+        ref_descriptors = similarity.describe(Image.open(io.BytesIO(reference)))
+        target_descriptors = similarity.stack(
+            [similarity.describe(Image.open(io.BytesIO(data))) for data in targets]
+        )
+    describe_ms = (time.perf_counter() - start) * 1000 / args.repeat
+
+    start = time.perf_counter()
+    for _ in range(args.repeat):
+        similarity.similarity_scores(ref_descriptors, target_descriptors)
+    score_ms = (time.perf_counter() - start) * 1000 / args.repeat
+
+    print(f"targets:              {args.targets}")
+    print(f"decode + describe:    {describe_ms:8.2f} ms")
+    print(f"batched scoring:      {score_ms:8.3f} ms")
+    print(f"total per request:    {describe_ms + score_ms:8.2f} ms")
+
+
+if __name__ == "__main__":
+    main()
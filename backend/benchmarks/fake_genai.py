@@ -0,0 +1,107 @@
+"""Offline stand-in for the ``google.genai`` client used by utils/gemini_client.py.
+
+It answers ``client.aio.models.generate_content`` and
+``generate_content_stream`` with real ``types`` objects. Latency is
+lognormal around a per-model-kind median, a configurable share of calls
+fails with a 503 ``ServerError``, and image models return an image of
+roughly the requested byte size. No network access is needed.
+
+    from benchmarks.fake_genai import FakeGenAIClient, install
+    install(FakeGenAIClient(text_latency_ms=800, image_latency_ms=6000, error_rate=0.02))
+"""
+import asyncio
+import io
+import math
+import random
+
+import numpy as np
+from google.genai import errors, types
+from PIL import Image
+
+
+def noise_png(approx_bytes: int, seed: int = 0) -> bytes:
+    """A PNG of random pixels, which compresses to about ``approx_bytes``"""
+    side = max(8, int(math.sqrt(approx_bytes / 3)))
+    pixels = np.random.default_rng(seed).integers(0, 256, (side, side, 3), dtype=np.uint8)
+    buffered = io.BytesIO()
+    Image.fromarray(pixels).save(buffered, format="PNG", compress_level=1)
+    return buffered.getvalue()
+
+
+class FakeModels:
+    def __init__(self, owner: "FakeGenAIClient"):
+        self._owner = owner
+
+    async def generate_content(self, model, contents, config=None):
+        owner = self._owner
+        await asyncio.sleep(owner.latency_s(model))
+        owner.complete_call()
+        parts = [types.Part(text=owner.text)]
+        if owner.is_image_model(model):
+            parts.append(types.Part.from_bytes(data=owner.image, mime_type="image/png"))
+        return types.GenerateContentResponse(
+            candidates=[types.Candidate(content=types.Content(parts=parts, role="model"))]
+        )
+
+    async def generate_content_stream(self, model, contents, config=None):
+        owner = self._owner
+
+        async def chunks():
+            words = owner.text.split(" ")
+            per_chunk = max(1, len(words) // owner.stream_chunks)
+            for start in range(0, len(words), per_chunk):
+                # Spread the latency over the chunks like a streaming model
+                await asyncio.sleep(owner.latency_s(model) / owner.stream_chunks)
+                if start == 0:
+                    owner.complete_call()
+                text = " ".join(words[start:start + per_chunk]) + " "
+                yield types.GenerateContentResponse(
+                    candidates=[types.Candidate(content=types.Content(parts=[types.Part(text=text)], role="model"))]
+                )
+
+        return chunks()
+
+
+class _FakeAio:
+    def __init__(self, owner: "FakeGenAIClient"):
+        self.models = FakeModels(owner)
+
+
+class FakeGenAIClient:
+    def __init__(self, text_latency_ms: float = 800, image_latency_ms: float = 6000,
+                 latency_sigma: float = 0.5, error_rate: float = 0.0, image_bytes: int = 400_000,
+                 text_words: int = 250, stream_chunks: int = 8, seed: int | None = None):
+        self.text_latency_ms = text_latency_ms
+        self.image_latency_ms = image_latency_ms
+        self.latency_sigma = latency_sigma
+        self.error_rate = error_rate
+        self.stream_chunks = stream_chunks
+        self.image = noise_png(image_bytes)
+        self.text = " ".join(["lorem"] * (text_words - 1) + ["87"])
+        self._random = random.Random(seed)
+        self.calls = 0
+        self.errors = 0
+        self.aio = _FakeAio(self)
+
+    @staticmethod
+    def is_image_model(model: str) -> bool:
+        return "image" in model
+
+    def latency_s(self, model: str) -> float:
+        """Lognormal latency whose median is the configured value for the model kind"""
+        median_ms = self.image_latency_ms if self.is_image_model(model) else self.text_latency_ms
+        return median_ms / 1000 * self._random.lognormvariate(0, self.latency_sigma)
+
+    def complete_call(self):
+        """Count a call and fail it with the configured probability"""
+        self.calls += 1
+        if self._random.random() < self.error_rate:
+            self.errors += 1
+            raise errors.ServerError(503, {"error": {"code": 503, "message": "fake overload", "status": "UNAVAILABLE"}})
+
+
+def install(fake: FakeGenAIClient):
+    """Route every upstream call of the app through ``fake``"""
+    from utils import gemini_client
+
+    gemini_client.client = fake
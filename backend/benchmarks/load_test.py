@@ -0,0 +1,227 @@
+"""Load-test every API route in-process against the offline Gemini stand-in.
+
+Boots ``main.app`` (lifespan included) behind httpx's ASGI transport with
+``benchmarks.fake_genai`` in place of the Gemini client. It then drives each
+route with a closed loop of concurrent clients at each concurrency level.
+For every route and level it reports throughput, p50/p95/p99 latency, error
+count, event-loop lag and peak RSS. Lag is measured by a ticker that
+should wake every few milliseconds, so any blocking work on the loop shows
+up as lag.
+
+Nothing leaves the machine. Run from the backend directory:
+
+    python -m benchmarks.load_test --concurrency 1,8,32 --duration 5
+    python -m benchmarks.load_test --routes try-on,smart-pairing --image-latency-ms 6000 --error-rate 0.05
+    python -m benchmarks.load_test --routes tryon-outfit --slow-callback-ms 20
+"""
+import argparse
+import asyncio
+import io
+import logging
+import os
+import resource
+import sys
+import tempfile
+import time
+
+import numpy as np
+from PIL import Image
+
+LAG_INTERVAL_S = 0.005
+
+
+def sample_images(count: int, size: tuple[int, int], rng: np.random.Generator) -> list[bytes]:
+    """Distinct smooth JPEGs, so caches and call coalescing see different inputs"""
+    images = []
+    for _ in range(count):
+        small = rng.integers(0, 256, (12, 10, 3), dtype=np.uint8)
+        buffered = io.BytesIO()
+        Image.fromarray(small).resize(size, Image.Resampling.BICUBIC).save(buffered, format="JPEG", quality=90)
+        images.append(buffered.getvalue())
+    return images
+
+
+def jpeg(name: str, data: bytes):
+    return (name, data, "image/jpeg")
+
+
+# Each route builds the n-th request from the image pool: (method, url, httpx kwargs)
+ROUTES = {
+    "try-on": lambda n, img: ("POST", "/api/try-on", {
+        "files": {"person_image": jpeg("person.jpg", img(n)), "cloth_image": jpeg("cloth.jpg", img(n + 1))},
+        "data": {"gender": "female", "style": "casual"},
+    }),
+    "try-on/batch": lambda n, img: ("POST", "/api/try-on/batch", {
+        "files": [("person_image", jpeg("person.jpg", img(n)))]
+        + [("cloth_images", jpeg(f"cloth{i}.jpg", img(n + 1 + i))) for i in range(3)],
+    }),
+    "smart-pairing": lambda n, img: ("POST", "/api/smart-pairing", {
+        "files": {"item_image": jpeg("item.jpg", img(n))},
+        "data": {"item_type": "top", "find_type": "bottom", "style": "casual"},
+    }),
+    "image-search": lambda n, img: ("POST", "/api/image-search", {
+        "files": {"search_image": jpeg("search.jpg", img(n))},
+    }),
+    "visual-similarity": lambda n, img: ("POST", "/api/visual-similarity", {
+        "files": [("reference_image", jpeg("ref.jpg", img(n)))]
+        + [("target_images", jpeg(f"target{i}.jpg", img(n + 1 + i))) for i in range(4)],
+    }),
+    "occasion-styling": lambda n, img: ("POST", "/api/occasion-styling", {
+        "json": {"occasion": "wedding", "user_preferences": {"style": "classic", "budget": str(n)}},
+    }),
+    "style-personality": lambda n, img: ("POST", "/api/style-personality", {
+        "json": {"quiz_answers": {"favourite_colour": "navy", "request": n}},
+    }),
+    "tryon-outfit": lambda n, img: ("POST", "/api/tryon-outfit", {
+        "files": {"person_image": jpeg("person.jpg", img(n)), "top_clothing": jpeg("top.jpg", img(n + 1))},
+        "data": {"clothing_type": "top"},
+    }),
+    "wishlist-pairing": lambda n, img: ("POST", "/api/wishlist-pairing", {
+        "json": {"selected_item": f"Linen shirt {n}", "user_preferences": {"style": "casual"}},
+    }),
+}
+
+
+class LoopLagMonitor:
+    """Ticker that records how late each wake-up is"""
+
+    def __init__(self, interval_s: float = LAG_INTERVAL_S):
+        self.interval_s = interval_s
+        self.samples: list[float] = []
+        self._task = None
+
+    async def _tick(self):
+        loop = asyncio.get_running_loop()
+        while True:
+            expected = loop.time() + self.interval_s
+            await asyncio.sleep(self.interval_s)
+            self.samples.append(max(0.0, loop.time() - expected))
+
+    def start(self):
+        self.samples = []
+        self._task = asyncio.create_task(self._tick())
+
+    async def stop(self) -> np.ndarray:
+        self._task.cancel()
+        await asyncio.gather(self._task, return_exceptions=True)
+        return np.array(self.samples or [0.0]) * 1000
+
+
+def peak_rss_mb() -> float:
+    # ru_maxrss is in kilobytes on Linux and bytes on macOS
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return peak / (1024 * 1024) if sys.platform == "darwin" else peak / 1024
+
+
+async def run_level(client, route: str, concurrency: int, duration_s: float, images: list[bytes], reuse: bool):
+    build = ROUTES[route]
+    image = (lambda n: images[0]) if reuse else (lambda n: images[n % len(images)])
+    counter = iter(range(sys.maxsize))
+    latencies = []
+    errors = 0
+    deadline = time.perf_counter() + duration_s
+
+    async def worker():
+        nonlocal errors
+        while time.perf_counter() < deadline:
+            n = 0 if reuse else next(counter)
+            method, url, kwargs = build(n, image)
+            started = time.perf_counter()
+            try:
+                response = await client.request(method, url, **kwargs)
+                failed = response.status_code >= 500 or b'"error"' in response.content[:4096]
+            except Exception:
+                failed = True
+            latencies.append(time.perf_counter() - started)
+            errors += failed
+
+    monitor = LoopLagMonitor()
+    monitor.start()
+    started = time.perf_counter()
+    await asyncio.gather(*[worker() for _ in range(concurrency)])
+    elapsed = time.perf_counter() - started
+    lag_ms = await monitor.stop()
+
+    latency_ms = np.array(latencies) * 1000
+    p50, p95, p99 = np.percentile(latency_ms, [50, 95, 99])
+    print(
+        f"{route:18} {concurrency:5} {len(latencies):7} {errors:6} {len(latencies) / elapsed:8.1f} "
+        f"{p50:8.0f} {p95:8.0f} {p99:8.0f} {np.percentile(lag_ms, 99):8.1f} {lag_ms.max():8.1f} "
+        f"{peak_rss_mb():8.0f}"
+    )
+
+
+async def run(args):
+    from benchmarks.fake_genai import FakeGenAIClient, install
+    import httpx
+    import main
+
+    fake = FakeGenAIClient(
+        text_latency_ms=args.text_latency_ms,
+        image_latency_ms=args.image_latency_ms,
+        latency_sigma=args.latency_sigma,
+        error_rate=args.error_rate,
+        image_bytes=args.image_bytes,
+        seed=0,
+    )
+    install(fake)
+    if args.slow_callback_ms:
+        # asyncio's debug mode logs every callback that holds the loop longer than this
+        loop = asyncio.get_running_loop()
+        loop.set_debug(True)
+        loop.slow_callback_duration = args.slow_callback_ms / 1000
+    images = sample_images(args.input_pool, (args.input_size, int(args.input_size * 1.25)), np.random.default_rng(0))
+    routes = args.routes.split(",") if args.routes else list(ROUTES)
+    levels = [int(level) for level in args.concurrency.split(",")]
+
+    async with main.lifespan(main.app):
+        transport = httpx.ASGITransport(app=main.app)
+        async with httpx.AsyncClient(transport=transport, base_url="http://bench", timeout=None) as client:
+            print(f"{'route':18} {'conc':>5} {'reqs':>7} {'errors':>6} {'req/s':>8} "
+                  f"{'p50 ms':>8} {'p95 ms':>8} {'p99 ms':>8} {'lag p99':>8} {'lag max':>8} {'RSS MB':>8}")
+            for route in routes:
+                for concurrency in levels:
+                    await run_level(client, route, concurrency, args.duration, images, args.reuse_inputs)
+    print(f"fake upstream: {fake.calls} calls, {fake.errors} injected errors")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--routes", default="", help=f"comma-separated subset of: {', '.join(ROUTES)}")
+    parser.add_argument("--concurrency", default="1,8,32", help="comma-separated concurrency levels")
+    parser.add_argument("--duration", type=float, default=5.0, help="seconds per route and level")
+    parser.add_argument("--text-latency-ms", type=float, default=300)
+    parser.add_argument("--image-latency-ms", type=float, default=1500)
+    parser.add_argument("--latency-sigma", type=float, default=0.5, help="lognormal spread of upstream latency")
+    parser.add_argument("--error-rate", type=float, default=0.0, help="share of upstream calls failing with 503")
+    parser.add_argument("--image-bytes", type=int, default=400_000, help="size of generated images")
+    parser.add_argument("--input-pool", type=int, default=64, help="distinct upload images to cycle through")
+    parser.add_argument("--input-size", type=int, default=1024, help="upload width in pixels")
+    parser.add_argument("--reuse-inputs", action="store_true",
+                        help="send identical requests, exercising caches and call coalescing")
+    parser.add_argument("--slow-callback-ms", type=float, default=0,
+                        help="log each loop callback slower than this, to find what blocks the loop")
+    args = parser.parse_args()
+
+    # Keep benchmark state out of the working tree. Without --reuse-inputs
+    # every cache tier and the near-duplicate shortcut are off, so each
+    # request does the full work; with it they run in the scratch directory.
+    scratch = tempfile.mkdtemp(prefix="load_test_")
+    os.environ.setdefault("GEMINI_API_KEY", "offline")
+    os.environ.setdefault("ARTIFACT_DIR", os.path.join(scratch, "artifacts"))
+    os.environ.setdefault("JOB_STORE", "memory")
+    os.environ.setdefault("RESULT_STORE", "disk")
+    os.environ.setdefault("RESULT_DB_PATH", os.path.join(scratch, "results.sqlite3"))
+    for cache in ("TRYON", "PAIRING", "ANALYSIS"):
+        os.environ.setdefault(f"{cache}_CACHE_DIR", os.path.join(scratch, cache.lower()) if args.reuse_inputs else "")
+        if not args.reuse_inputs:
+            os.environ.setdefault(f"{cache}_CACHE_MEMORY_MB", "0")
+    if not args.reuse_inputs:
+        os.environ.setdefault("TEXT_CACHE_MAX_ENTRIES", "0")
+        os.environ.setdefault("NEAR_DUP_ENABLED", "false")
+    logging.basicConfig(level=logging.WARNING)
+    asyncio.run(run(args))
+
+
+if __name__ == "__main__":
+    main()
@@ -17,16 +17,72 @@
 
 
 
+import time
+
+# Startup is timed from here: imports, then the lifespan's loading steps
+IMPORT_STARTED = time.perf_counter()
+
 from fastapi import FastAPI
+from fastapi.responses import JSONResponse, Response
 from fastapi.middleware.cors import CORSMiddleware
-from routers import tryon, styling, image_search, smart_pairing, occasion_styling
+from routers import tryon, styling, image_search, smart_pairing, occasion_styling, artifacts
+from utils import artifact_store, catalog, theme_catalog
+from utils import gemini_client
+from utils.gemini_client import scheduler, upstream_calls
+from utils.near_duplicates import uploads as upload_index
+from utils.resilience import BREAKERS
+from utils.metrics import CONTENT_TYPE as METRICS_CONTENT_TYPE, REGISTRY, MetricsMiddleware
+from utils.result_cache import CACHES
+from utils.result_store import RESULT_STORE, shared_store
+from utils.timing import ServerTimingMiddleware
+from utils.uploads import BodySizeLimitMiddleware
+from contextlib import asynccontextmanager
+import asyncio
 import os
 from dotenv import load_dotenv
 
 # Load environment variables
 load_dotenv()
 
-app = FastAPI(title="AI Virtual Try-On API", version="1.0.0")
+# Seconds spent in each startup step, reported by /ready
+startup_timings: dict[str, float] = {}
+
+async def startup_step(name, step):
+    """Run one startup step, timing it; a failure is logged and reported by /ready, not raised"""
+    started = time.perf_counter()
+    try:
+        await step()
+        return True
+    except Exception as e:
+        print(f"Startup step {name} failed: {e!r}")
+        return False
+    finally:
+        startup_timings[name] = round(time.perf_counter() - started, 3)
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    startup_timings["imports"] = round(time.perf_counter() - IMPORT_STARTED, 3)
+    # Load the product catalog and build its search index before serving
+    await startup_step("product_catalog", lambda: asyncio.to_thread(catalog.load_catalog))
+    await startup_step("theme_catalog", lambda: asyncio.to_thread(theme_catalog.load_theme_catalog))
+    await startup_step("jobs", tryon.tryon_jobs.start)
+    artifact_sweeper = asyncio.create_task(artifact_store.sweeper())
+    startup_timings["total"] = round(time.perf_counter() - IMPORT_STARTED, 3)
+    print(f"Startup complete in {startup_timings['total']:.2f}s: {startup_timings}")
+    if not gemini_client.is_configured():
+        print("WARNING: GEMINI_API_KEY is not set; AI features will answer 503 until it is")
+    yield
+    artifact_sweeper.cancel()
+    await tryon.tryon_jobs.stop()
+
+app = FastAPI(title="AI Virtual Try-On API", version="1.0.0", lifespan=lifespan)
+
+# Reject oversize bodies before the multipart parser spools them; added
+# first so CORS headers still wrap its 413 responses
+app.add_middleware(BodySizeLimitMiddleware)
+# Outside the body limit so rejected requests are counted too
+app.add_middleware(MetricsMiddleware)
+app.add_middleware(ServerTimingMiddleware)
 
 # CORS middleware - MUST be added before including routers
 app.add_middleware(
@@ -42,6 +98,8 @@ app.add_middleware(
     allow_credentials=True,
     allow_methods=["GET", "POST", "PUT", "DELETE", "OPTIONS"],
     allow_headers=["*"],
+    # Let the frontend read stage timings from cross-origin responses
+    expose_headers=["Server-Timing"],
 )
 
 # Include routers with proper prefixes
@@ -50,6 +108,7 @@ app.include_router(styling.router, prefix="/api")
 app.include_router(image_search.router, prefix="/api")
 app.include_router(smart_pairing.router, prefix="/api")
 app.include_router(occasion_styling.router, prefix="/api")
+app.include_router(artifacts.router, prefix="/api")
 
 @app.get("/")
 async def root():
@@ -57,8 +116,80 @@ async def root():
 
 @app.get("/health")
 async def health_check():
+    """Liveness: the process is up and serving; never depends on configuration"""
     return {"status": "healthy", "message": "Server is running"}
 
+@app.get("/ready")
+async def readiness_check():
+    """Readiness: configuration and startup state; 503 until the instance can serve AI requests"""
+    checks = {
+        "upstream_configured": gemini_client.is_configured(),
+        "theme_catalog": theme_catalog.is_loaded(),
+        "jobs": tryon.tryon_jobs.running,
+    }
+    ready = all(checks.values())
+    return JSONResponse(status_code=200 if ready else 503, content={
+        "status": "ready" if ready else "not_ready",
+        "checks": checks,
+        # Informational: search works without a catalog, and an open circuit
+        # is an upstream problem that another instance would share
+        "product_catalog": len(catalog.catalog) if catalog.catalog else 0,
+        "job_store": type(tryon.tryon_jobs.store).__name__,
+        "circuits": {name: breaker.state for name, breaker in BREAKERS.items()},
+        "startup_s": startup_timings,
+    })
+
+@app.get("/stats")
+async def stats():
+    store = shared_store()
+    if store:
+        # The store's lock and connection may block, so never on the event loop
+        await asyncio.to_thread(store.refresh_usage)
+    return {
+        "caches": {name: cache.stats() for name, cache in CACHES.items()},
+        "result_store": store.stats() if store else {"kind": RESULT_STORE},
+        "near_duplicates": upload_index.stats(),
+        "coalescing": {upstream_calls.name: upstream_calls.stats()},
+        "jobs": {tryon.tryon_jobs.name: tryon.tryon_jobs.stats()},
+        "circuits": {name: breaker.stats() for name, breaker in BREAKERS.items()},
+        "scheduler": scheduler.stats(),
+    }
+
+CACHE_LOOKUPS = REGISTRY.gauge("cache_lookups", "Cache lookups since start by result", ("cache", "result"))
+CACHE_HIT_RATIO = REGISTRY.gauge("cache_hit_ratio", "Share of cache lookups served from the cache", ("cache",))
+COALESCED_CALLS = REGISTRY.gauge("upstream_coalesced_calls", "Calls that joined an identical in-flight call")
+JOBS = REGISTRY.gauge("jobs", "Background jobs by state", ("queue", "state"))
+RESULT_STORE_BYTES = REGISTRY.gauge("result_store_bytes", "Payload bytes in the shared result store")
+UPSTREAM_QUEUED = REGISTRY.gauge("upstream_queued_calls", "Gemini calls waiting for a scheduler slot", ("model",))
+
+def collect_component_stats():
+    """Copy the caches', coalescer's, job queue's and scheduler's own counters into gauges at scrape time"""
+    for name, cache in CACHES.items():
+        cache_stats = cache.stats()
+        CACHE_HIT_RATIO.set(name, value=cache_stats["hit_ratio"])
+        for result in ("hits", "stale_hits", "shared_hits", "store_hits", "misses"):
+            if result in cache_stats:
+                CACHE_LOOKUPS.set(name, result, value=cache_stats[result])
+    COALESCED_CALLS.set(value=upstream_calls.collapsed)
+    job_stats = tryon.tryon_jobs.stats()
+    for state in ("queued", "running", "succeeded", "failed", "cancelled", "rejected"):
+        JOBS.set(tryon.tryon_jobs.name, state, value=job_stats[state])
+    for model, queue in scheduler.queues.items():
+        UPSTREAM_QUEUED.set(model, value=queue.queued())
+    store = shared_store()
+    if store:
+        # Refreshed by the handler before rendering; reading it does no I/O
+        RESULT_STORE_BYTES.set(value=store.stats().get("bytes", 0))
+
+REGISTRY.add_collector(collect_component_stats)
+
+@app.get("/metrics")
+async def metrics():
+    store = shared_store()
+    if store:
+        await asyncio.to_thread(store.refresh_usage)
+    return Response(REGISTRY.render(), media_type=METRICS_CONTENT_TYPE)
+
 if __name__ == "__main__":
     import uvicorn
     uvicorn.run(app, host="0.0.0.0", port=8000)
\ No newline at end of file
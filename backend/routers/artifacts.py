@@ -0,0 +1,23 @@
+from fastapi import APIRouter, HTTPException, Request
+from fastapi.responses import FileResponse, Response
+from utils.artifact_store import MIME_TYPES, artifact_path
+
+router = APIRouter(tags=["Artifacts"])
+
+# Artifact names are content hashes, so a given URL never changes
+CACHE_CONTROL = "public, max-age=31536000, immutable"
+
+@router.get("/artifacts/{name}", name="get_artifact")
+async def get_artifact(name: str, request: Request):
+    """Serve a generated image with ETag, long-lived caching and Range support"""
+    path = artifact_path(name)
+    if path is None or not path.is_file():
+        raise HTTPException(status_code=404, detail="Artifact not found")
+    
+    etag = f'"{name.split(".")[0]}"'
+    headers = {"ETag": etag, "Cache-Control": CACHE_CONTROL}
+    if etag in request.headers.get("if-none-match", ""):
+        return Response(status_code=304, headers=headers)
+    
+    # FileResponse streams the file and answers Range requests itself
+    return FileResponse(path, media_type=MIME_TYPES[name.rsplit(".", 1)[1]], headers=headers)
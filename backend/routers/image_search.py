@@ -1,32 +1,40 @@
 from fastapi import APIRouter, File, UploadFile, Form, HTTPException
 from fastapi.responses import JSONResponse
-import google.genai as genai
 from google.genai import types
+from utils.gemini_client import TEXT_MODEL, generate_content
+from utils import catalog as catalog_module
+from utils import similarity
+from utils.image_pipeline import InvalidImageError, load_image, prepare_upload
+from utils.metrics import FALLBACKS
+from utils.near_duplicates import image_id
+from utils.resilience import UPSTREAM_ERRORS, request_deadline, upstream_http_error
+from utils.result_cache import analysis_cache, cached_text, content_key
+from utils.timing import stage, timed
+from utils.uploads import UploadBudget
+from PIL import UnidentifiedImageError
+import asyncio
 import os
-import base64
-import io
-from PIL import Image
-import random
-
-# Configure Gemini
-client = genai.Client(api_key=os.getenv("GOOGLE_API_KEY"))
+import re
 
 router = APIRouter(tags=["Image Search"])
 
+# Latency budget for the upstream calls of one search or re-rank
+IMAGE_SEARCH_BUDGET_S = float(os.getenv("IMAGE_SEARCH_BUDGET_S", "30"))
+# Most catalog matches one search may ask for
+MAX_TOP_K = 50
+# Most local matches one /visual-similarity request may re-score, one LLM call each
+MAX_RERANK_TOP_K = 10
+
 @router.post("/image-search")
 async def image_search(
     search_image: UploadFile = File(...),
-    search_type: str = Form("image_matching")
+    search_type: str = Form("image_matching"),
+    top_k: int = Form(6, ge=1, le=MAX_TOP_K)
 ):
     try:
-        # Process the uploaded image
-        image_data = await search_image.read()
-        image = Image.open(io.BytesIO(image_data))
-        
-        # Convert to base64 for Gemini
-        buffered = io.BytesIO()
-        image.save(buffered, format="JPEG")
-        img_base64 = base64.b64encode(buffered.getvalue()).decode()
+        # Process the uploaded image: one decode, at most one encode
+        upload = await UploadBudget().read(search_image, "search_image")
+        prepared = await prepare_upload(upload.data, upload.mime_type)
         
         # Prepare the prompt for AI analysis
         prompt = """
@@ -40,126 +48,201 @@ async def image_search(
         Based on this analysis, I need to find similar items in a fashion database.
         """
         
-        # Create Gemini request using google.genai
-        response = client.models.generate_content(
-            model="gemini-2.0-flash-exp",
-            contents=[
-                types.Content(
-                    parts=[
-                        types.Part.from_text(prompt),
-                        types.Part.from_bytes(
-                            data=base64.b64decode(img_base64),
-                            mime_type="image/jpeg"
-                        )
-                    ]
+        async def analyse():
+            response = await generate_content(
+                model=TEXT_MODEL,
+                contents=[
+                    types.Content(
+                        parts=[
+                            types.Part.from_text(text=prompt),
+                            types.Part.from_bytes(
+                                data=prepared.data,
+                                mime_type=prepared.mime_type
+                            )
+                        ]
+                    )
+                ],
+                config=types.GenerateContentConfig(
+                    response_modalities=['TEXT']
                 )
-            ],
-            config=types.GenerateContentConfig(
-                response_modalities=['TEXT']
             )
-        )
+            return response.text
+        
+        # Create Gemini request using google.genai (or reuse the stored
+        # analysis of this photo, even re-compressed), and search the
+        # product catalog meanwhile
+        search_id = await timed("near_duplicates", image_id(upload.data, prepared))
         
-        # Generate mock similar items based on AI analysis
-        # In a real implementation, you would search your product database
-        similar_items = []
-        base_similarity = random.randint(85, 98)
+        async def analysis_or_fallback():
+            # The catalog matches do not need the upstream, so its failure
+            # degrades the answer instead of failing the request
+            try:
+                return await cached_text(analysis_cache, content_key(TEXT_MODEL, prompt, search_id), analyse), False
+            except Exception as e:
+                print(f"Image search analysis failed: {e!r}")
+                FALLBACKS.inc("image_search_analysis")
+                return "AI analysis is unavailable right now; showing visually similar catalog items", True
         
-        for i in range(6):
-            similarity = base_similarity - (i * 2)
-            similar_items.append({
-                "image": f"https://via.placeholder.com/200x250/FF6B6B/white?text=Similar+Item+{i+1}",
-                "similarity": similarity,
-                "name": f"Similar Fashion Item {i+1}",
-                "price": f"${random.randint(25, 150)}",
-                "brand": f"Brand {chr(65 + i)}"
-            })
+        with request_deadline(IMAGE_SEARCH_BUDGET_S):
+            (analysis, degraded), similar_items = await asyncio.gather(
+                timed("analysis", analysis_or_fallback()),
+                timed("catalog_search", asyncio.to_thread(search_catalog, prepared.image, top_k))
+            )
         
         return JSONResponse(content={
             "matches": similar_items,
-            "ai_analysis": response.text,
-            "search_type": search_type
+            "ai_analysis": analysis,
+            "degraded": degraded,
+            "search_type": search_type,
+            "catalog_size": len(catalog_module.catalog) if catalog_module.catalog else 0
         })
         
+    except HTTPException:
+        raise
+    except InvalidImageError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    except UPSTREAM_ERRORS as e:
+        raise upstream_http_error(e)
     except Exception as e:
         print(f"Error in image search: {str(e)}")
         raise HTTPException(status_code=500, detail=f"Image search failed: {str(e)}")
 
+def search_catalog(image, top_k):
+    """Find the catalog products that look most like the image"""
+    if catalog_module.catalog is None or image is None:
+        return []
+    
+    vector = similarity.feature_vectors(similarity.describe(image))
+    return [
+        {
+            **product,
+            "similarity": int(round(max(score, 0.0) * 100))
+        }
+        for product, score in catalog_module.catalog.search(vector, top_k)
+    ]
+
 @router.post("/visual-similarity")
 async def visual_similarity(
     reference_image: UploadFile = File(...),
-    target_images: list[UploadFile] = File(...)
+    target_images: list[UploadFile] = File(...),
+    rerank_top_k: int = Form(0, ge=0, le=MAX_RERANK_TOP_K)  # re-score the best k local matches with the LLM; 0 disables
 ):
     """Compare visual similarity between reference image and multiple target images"""
     try:
-        # Process reference image
-        ref_data = await reference_image.read()
-        ref_image = Image.open(io.BytesIO(ref_data))
-        
-        # Convert to base64
-        buffered = io.BytesIO()
-        ref_image.save(buffered, format="JPEG")
-        ref_base64 = base64.b64encode(buffered.getvalue()).decode()
+        # Count every file before reading any of them
+        budget = UploadBudget()
+        budget.check_count(1 + len(target_images))
+        ref_data = (await budget.read(reference_image, "reference_image")).data
+        target_datas = [(await budget.read(target_img, "target_images")).data for target_img in target_images]
         
-        similarities = []
+        # Decode and describe every image off the event loop, then score all
+        # targets against the reference in one vectorised pass
+        ref_descriptors, target_descriptors = await timed(
+            "describe", asyncio.to_thread(describe_images, ref_data, target_datas)
+        )
+        with stage("score"):
+            scores = similarity.similarity_scores(ref_descriptors, target_descriptors)
         
-        for idx, target_img in enumerate(target_images):
-            target_data = await target_img.read()
-            target_image = Image.open(io.BytesIO(target_data))
-            
-            # Convert target to base64
-            target_buffered = io.BytesIO()
-            target_image.save(target_buffered, format="JPEG")
-            target_base64 = base64.b64encode(target_buffered.getvalue()).decode()
-            
-            # AI comparison prompt
-            comparison_prompt = """
-            Compare these two clothing items and rate their visual similarity from 0-100%.
-            Consider: color, style, pattern, type, and overall aesthetic.
-            Return only the similarity percentage as a number.
-            """
-            
-            response = client.models.generate_content(
-                model="gemini-2.0-flash-exp",
-                contents=[
-                    types.Content(
-                        parts=[
-                            types.Part.from_text(comparison_prompt),
-                            types.Part.from_bytes(
-                                data=base64.b64decode(ref_base64),
-                                mime_type="image/jpeg"
-                            ),
-                            types.Part.from_bytes(
-                                data=base64.b64decode(target_base64),
-                                mime_type="image/jpeg"
-                            )
-                        ]
-                    )
-                ],
-                config=types.GenerateContentConfig(
-                    response_modalities=['TEXT']
-                )
-            )
-            
-            # Extract similarity percentage
-            try:
-                similarity = int(''.join(filter(str.isdigit, response.text))[:2])
-            except:
-                similarity = random.randint(70, 95)
-            
-            similarities.append({
+        similarities = [
+            {
                 "index": idx,
-                "similarity": similarity,
+                "similarity": int(scores[idx]),
                 "filename": target_img.filename
-            })
+            }
+            for idx, target_img in enumerate(target_images)
+        ]
         
         # Sort by similarity
         similarities.sort(key=lambda x: x['similarity'], reverse=True)
         
+        method = "local"
+        if rerank_top_k > 0 and similarities:
+            top = similarities[:rerank_top_k]
+            # The reference goes into every comparison, so it is prepared once
+            ref = await prepare_upload(ref_data)
+            # Items the LLM could not score in time keep their local score
+            with request_deadline(IMAGE_SEARCH_BUDGET_S):
+                llm_scores = await timed("llm_rerank", asyncio.gather(
+                    *[llm_similarity(ref, target_datas[item["index"]]) for item in top]
+                ))
+            for item, llm_score in zip(top, llm_scores):
+                item["local_similarity"] = item["similarity"]
+                if llm_score is not None:
+                    item["similarity"] = llm_score
+            top.sort(key=lambda x: x['similarity'], reverse=True)
+            similarities[:len(top)] = top
+            method = "local+llm"
+        
         return JSONResponse(content={
             "similarities": similarities,
-            "reference_analysis": "Visual similarity analysis completed"
+            "reference_analysis": "Visual similarity analysis completed",
+            "method": method
         })
         
+    except HTTPException:
+        raise
+    except InvalidImageError as e:
+        raise HTTPException(status_code=400, detail=str(e))
     except Exception as e:
         print(f"Error in visual similarity: {str(e)}")
-        raise HTTPException(status_code=500, detail=f"Visual similarity failed: {str(e)}")
\ No newline at end of file
+        raise HTTPException(status_code=500, detail=f"Visual similarity failed: {str(e)}")
+
+def describe_images(ref_data, target_datas):
+    """Decode the reference and targets and compute their similarity descriptors"""
+    # Descriptors only need a tiny view, so JPEGs are decoded at reduced size
+    size = (similarity.PHASH_SIZE * 2, similarity.PHASH_SIZE * 2)
+    ref_descriptors = describe_upload(ref_data, size, "reference_image")
+    target_descriptors = similarity.stack(
+        [describe_upload(data, size, f"target_images[{i}]") for i, data in enumerate(target_datas)]
+    )
+    return ref_descriptors, target_descriptors
+
+def describe_upload(data, size, field):
+    """Descriptors of one uploaded image; InvalidImageError if Pillow cannot decode it"""
+    try:
+        return similarity.describe(load_image(data, size))
+    except (UnidentifiedImageError, OSError) as e:
+        raise InvalidImageError(f"{field}: unsupported or corrupt image file") from e
+
+async def llm_similarity(ref, target_data):
+    """Ask the LLM for a 0-100 similarity score against the prepared reference; None if it gives no usable answer"""
+    # AI comparison prompt
+    comparison_prompt = """
+    Compare these two clothing items and rate their visual similarity from 0-100%.
+    Consider: color, style, pattern, type, and overall aesthetic.
+    Return only the similarity percentage as a number.
+    """
+    
+    try:
+        target = await prepare_upload(target_data)
+        response = await generate_content(
+            model=TEXT_MODEL,
+            contents=[
+                types.Content(
+                    parts=[
+                        types.Part.from_text(text=comparison_prompt),
+                        types.Part.from_bytes(
+                            data=ref.data,
+                            mime_type=ref.mime_type
+                        ),
+                        types.Part.from_bytes(
+                            data=target.data,
+                            mime_type=target.mime_type
+                        )
+                    ]
+                )
+            ],
+            config=types.GenerateContentConfig(
+                response_modalities=['TEXT']
+            )
+        )
+    except Exception as e:
+        print(f"LLM re-rank failed: {str(e)}")
+        return None
+    
+    # The answer must be a single percentage; replies such as "7/10" or
+    # "85 out of 100" are ambiguous and keep the local score instead
+    numbers = re.findall(r"\d+", response.text or "")
+    if len(numbers) != 1 or int(numbers[0]) > 100:
+        return None
+    return int(numbers[0])
@@ -1,23 +1,34 @@
-from fastapi import APIRouter, HTTPException
+from fastapi import APIRouter, HTTPException, Request
 from fastapi.responses import JSONResponse
 from pydantic import BaseModel
-import google.genai as genai
 from google.genai import types
-import os
+from utils.gemini_client import TEXT_MODEL, generate_content, generate_content_stream
+from utils.resilience import UPSTREAM_ERRORS, request_deadline, upstream_http_error
+from utils.streaming import stream_events
+from utils.timing import timed
+from utils.swr_cache import StaleWhileRevalidateCache, request_key
+from utils.theme_catalog import get_theme_catalog
 import random
 import json
-
-# Configure Gemini
-client = genai.Client(api_key=os.getenv("GOOGLE_API_KEY"))
+import os
 
 router = APIRouter(tags=["Occasion Styling"])
 
+# Latency budget for one styling answer, retries included
+OCCASION_BUDGET_S = float(os.getenv("OCCASION_BUDGET_S", "30"))
+
+# Model answers depend only on these small inputs, so popular combinations
+# are served from cache and refreshed in the background once stale
+styling_cache = StaleWhileRevalidateCache("occasion_styling")
+personality_cache = StaleWhileRevalidateCache("style_personality")
+
 class OccasionRequest(BaseModel):
     occasion: str
     user_preferences: dict
+    stream: bool = False  # stream ai_styling_advice as NDJSON/SSE while it is generated
 
 @router.post("/occasion-styling")
-async def occasion_styling(request: OccasionRequest):
+async def occasion_styling(request: OccasionRequest, http_request: Request):
     try:
         occasion = request.occasion
         preferences = request.user_preferences
@@ -54,202 +65,90 @@ async def occasion_styling(request: OccasionRequest):
         Consider the {style} aesthetic while ensuring appropriateness for {occasion}.
         """
         
-        # Generate AI styling suggestions using google.genai
-        response = client.models.generate_content(
-            model="gemini-2.0-flash-exp",
-            contents=[prompt],
-            config=types.GenerateContentConfig(
-                response_modalities=['TEXT']
-            )
+        config = types.GenerateContentConfig(
+            response_modalities=['TEXT']
         )
+        details = occasion_details(occasion, style, gender, budget)
+        cache_key = request_key(occasion, gender, style, budget)
         
-        # Create outfit suggestions based on occasion and preferences
-        outfit_themes = get_outfit_themes(occasion, style, gender)
+        if request.stream:
+            return stream_events(http_request, stream_styling(prompt, config, details, cache_key))
         
-        outfits = []
-        for i, theme in enumerate(outfit_themes[:6]):
-            outfit = {
-                "title": theme["title"],
-                "description": theme["description"],
-                "image": theme["image"],
-                "pieces": theme["pieces"],
-                "styling_tips": theme["tips"],
-                "confidence_boost": theme["confidence"],
-                "occasion_score": random.randint(90, 100),
-                "style_match": random.randint(85, 98),
-                "versatility": theme["versatility"]
-            }
-            outfits.append(outfit)
+        # Generate AI styling suggestions using google.genai
+        advice = await timed("advice", styling_cache.get_or_compute(cache_key, lambda: generate_text(prompt, config)))
         
         return JSONResponse(content={
-            "outfits": outfits,
-            "ai_styling_advice": response.text,
-            "occasion": occasion,
-            "style_analysis": {
-                "occasion": occasion,
-                "user_style": style,
-                "gender": gender,
-                "budget": budget,
-                "total_outfits": len(outfits)
-            },
-            "general_tips": get_occasion_tips(occasion)
+            **details,
+            "ai_styling_advice": advice
         })
         
+    except UPSTREAM_ERRORS as e:
+        raise upstream_http_error(e)
     except Exception as e:
         print(f"Error in occasion styling: {str(e)}")
         raise HTTPException(status_code=500, detail=f"Occasion styling failed: {str(e)}")
 
-def get_outfit_themes(occasion, style, gender):
-    """Generate outfit themes based on occasion, style, and gender"""
+def occasion_details(occasion, style, gender, budget):
+    """Build the part of the response that does not depend on the model"""
+    # Outfit suggestions come pre-ranked from the theme catalog
+    themes = get_theme_catalog()
+    outfits = [
+        {
+            **outfit,
+            "occasion_score": random.randint(90, 100),
+            "style_match": random.randint(85, 98),
+        }
+        for outfit in themes.themes_for(occasion, style, gender)
+    ]
     
-    base_themes = {
-        "wedding": [
-            {
-                "title": "Elegant Guest",
-                "description": "Sophisticated and respectful wedding guest attire",
-                "image": "https://via.placeholder.com/200x300/FF6B6B/white?text=Elegant+Guest",
-                "pieces": ["Midi dress", "Block heels", "Clutch bag", "Statement earrings"],
-                "tips": ["Avoid white/cream", "Opt for jewel tones", "Choose comfortable shoes"],
-                "confidence": "You'll look elegant without upstaging the bride",
-                "versatility": "Perfect for other formal events too"
-            },
-            {
-                "title": "Modern Classic",
-                "description": "Contemporary take on classic wedding guest style",
-                "image": "https://via.placeholder.com/200x300/4ECDC4/white?text=Modern+Classic",
-                "pieces": ["Wrap dress", "Nude heels", "Delicate jewelry", "Light cardigan"],
-                "tips": ["Layer for temperature changes", "Choose breathable fabrics"],
-                "confidence": "Timeless style that photographs beautifully",
-                "versatility": "Works for business events and dinners"
-            }
-        ],
-        "business": [
-            {
-                "title": "Power Professional",
-                "description": "Confident and authoritative business attire",
-                "image": "https://via.placeholder.com/200x300/45B7D1/white?text=Power+Pro",
-                "pieces": ["Blazer", "Tailored trousers", "Button-down shirt", "Leather shoes"],
-                "tips": ["Ensure perfect fit", "Choose quality fabrics", "Keep accessories minimal"],
-                "confidence": "Command respect while feeling comfortable",
-                "versatility": "Mix and match pieces for multiple looks"
-            },
-            {
-                "title": "Smart Casual",
-                "description": "Professional yet approachable business casual",
-                "image": "https://via.placeholder.com/200x300/96CEB4/white?text=Smart+Casual",
-                "pieces": ["Knit sweater", "Dark jeans", "Loafers", "Structured bag"],
-                "tips": ["Focus on fit and quality", "Add one polished element"],
-                "confidence": "Professional without being intimidating",
-                "versatility": "Perfect for client meetings and office days"
-            }
-        ],
-        "date": [
-            {
-                "title": "Romantic Chic",
-                "description": "Romantic and feminine date night outfit",
-                "image": "https://via.placeholder.com/200x300/FFEAA7/333?text=Romantic+Chic",
-                "pieces": ["Silk blouse", "High-waisted skirt", "Ankle boots", "Delicate jewelry"],
-                "tips": ["Choose comfortable shoes", "Add personal touches", "Consider the venue"],
-                "confidence": "Feel feminine and comfortable being yourself",
-                "versatility": "Great for dinners and cultural events"
-            },
-            {
-                "title": "Effortless Cool",
-                "description": "Relaxed yet put-together date outfit",
-                "image": "https://via.placeholder.com/200x300/DDA0DD/white?text=Effortless+Cool",
-                "pieces": ["Denim jacket", "Midi dress", "White sneakers", "Crossbody bag"],
-                "tips": ["Layer for weather", "Choose pieces you feel confident in"],
-                "confidence": "Look effortlessly stylish and approachable",
-                "versatility": "Perfect for casual dates and weekend outings"
-            }
-        ],
-        "party": [
-            {
-                "title": "Statement Maker",
-                "description": "Bold and eye-catching party look",
-                "image": "https://via.placeholder.com/200x300/FF1493/white?text=Statement+Look",
-                "pieces": ["Sequin top", "Black trousers", "Statement heels", "Bold accessories"],
-                "tips": ["Balance bold pieces with basics", "Comfort is key for dancing"],
-                "confidence": "Stand out while feeling completely yourself",
-                "versatility": "Mix pieces for other special occasions"
-            },
-            {
-                "title": "Chic Minimalist",
-                "description": "Understated elegance for sophisticated parties",
-                "image": "https://via.placeholder.com/200x300/000080/white?text=Chic+Minimal",
-                "pieces": ["Little black dress", "Statement accessories", "Classic heels", "Elegant clutch"],
-                "tips": ["Focus on quality and fit", "Let accessories do the talking"],
-                "confidence": "Classic elegance never goes out of style",
-                "versatility": "Your go-to for any upscale event"
-            }
-        ],
-        "casual": [
-            {
-                "title": "Weekend Comfort",
-                "description": "Comfortable yet stylish casual wear",
-                "image": "https://via.placeholder.com/200x300/87CEEB/white?text=Weekend+Comfort",
-                "pieces": ["Cozy sweater", "Leggings", "Comfortable sneakers", "Tote bag"],
-                "tips": ["Prioritize comfort", "Add one elevated piece", "Layer for temperature"],
-                "confidence": "Feel relaxed and put-together",
-                "versatility": "Perfect for errands, coffee dates, and relaxing"
-            },
-            {
-                "title": "Athleisure Chic",
-                "description": "Sporty-chic casual outfit",
-                "image": "https://via.placeholder.com/200x300/32CD32/white?text=Athleisure+Chic",
-                "pieces": ["Athletic top", "High-waisted leggings", "Clean sneakers", "Baseball cap"],
-                "tips": ["Choose quality athletic wear", "Keep it clean and fitted"],
-                "confidence": "Look active and healthy",
-                "versatility": "Great for workouts and casual outings"
-            }
-        ]
+    return {
+        "outfits": outfits,
+        "occasion": occasion,
+        "style_analysis": {
+            "occasion": occasion,
+            "user_style": style,
+            "gender": gender,
+            "budget": budget,
+            "total_outfits": len(outfits)
+        },
+        "general_tips": themes.tips_for(occasion)
     }
-    
-    # Get themes for the specific occasion, or default to casual
-    themes = base_themes.get(occasion, base_themes["casual"])
-    
-    # Add more themes to reach 6 total
-    while len(themes) < 6:
-        themes.extend(themes[:2])  # Duplicate some themes with variations
-    
-    return themes[:6]
 
-def get_occasion_tips(occasion):
-    """Get general styling tips for specific occasions"""
-    tips = {
-        "wedding": [
-            "Avoid white, ivory, or cream colors",
-            "Consider the venue and time of day",
-            "Bring a wrap or jacket for temperature changes",
-            "Choose comfortable shoes for dancing"
-        ],
-        "business": [
-            "Ensure your outfit is well-fitted",
-            "Stick to neutral and professional colors",
-            "Keep accessories minimal and polished",
-            "Invest in quality pieces that last"
-        ],
-        "date": [
-            "Choose something you feel confident in",
-            "Consider the planned activities",
-            "Don't overdress or underdress for the venue",
-            "Add a personal touch that shows your style"
-        ],
-        "party": [
-            "Have fun with colors and textures",
-            "Ensure you can move comfortably",
-            "Consider the party's dress code",
-            "Bring a small bag for essentials"
-        ],
-        "casual": [
-            "Comfort should be your priority",
-            "One elevated piece can upgrade any casual look",
-            "Layer for changing weather",
-            "Choose versatile pieces you can mix and match"
-        ]
-    }
+async def generate_text(prompt, config):
+    """Run a text-only prompt and return the answer"""
+    # The budget starts here so background refreshes get a full one too
+    with request_deadline(OCCASION_BUDGET_S):
+        response = await generate_content(
+            model=TEXT_MODEL,
+            contents=[prompt],
+            config=config
+        )
+    return response.text
+
+async def stream_styling(prompt, config, details, cache_key):
+    """Yield the outfits straight away, then the styling advice as the model writes it"""
+    yield "outfits", details
+    
+    cached = await styling_cache.lookup(cache_key, lambda: generate_text(prompt, config))
+    if cached is not None:
+        yield "ai_styling_advice", cached
+        yield "done", {}
+        return
     
-    return tips.get(occasion, tips["casual"])
+    chunks = []
+    try:
+        with request_deadline(OCCASION_BUDGET_S):
+            async for chunk in generate_content_stream(model=TEXT_MODEL, contents=[prompt], config=config):
+                if chunk.text:
+                    chunks.append(chunk.text)
+                    yield "ai_styling_advice", chunk.text
+    except Exception as e:
+        # Headers are already sent, so report the failure in-band
+        print(f"Error streaming occasion styling: {str(e)}")
+        yield "error", f"Occasion styling failed: {str(e)}"
+        return
+    await styling_cache.put(cache_key, "".join(chunks))
+    yield "done", {}
 
 @router.post("/style-personality")
 async def style_personality(request: dict):
@@ -271,12 +170,9 @@ async def style_personality(request: dict):
         6. Celebrities with similar style for inspiration
         """
         
-        response = client.models.generate_content(
-            model="gemini-2.0-flash-exp",
-            contents=[prompt],
-            config=types.GenerateContentConfig(
-                response_modalities=['TEXT']
-            )
+        detailed_analysis = await personality_cache.get_or_compute(
+            request_key(answers),
+            lambda: generate_text(prompt, types.GenerateContentConfig(response_modalities=['TEXT']))
         )
         
         # Generate style personality results
@@ -285,7 +181,7 @@ async def style_personality(request: dict):
         
         return JSONResponse(content={
             "style_personality": primary_style,
-            "detailed_analysis": response.text,
+            "detailed_analysis": detailed_analysis,
             "confidence_level": random.randint(85, 95),
             "recommended_colors": ["Navy", "Cream", "Burgundy", "Camel", "Black"],
             "key_pieces": [
@@ -303,6 +199,8 @@ async def style_personality(request: dict):
             ]
         })
         
+    except UPSTREAM_ERRORS as e:
+        raise upstream_http_error(e)
     except Exception as e:
         print(f"Error in style personality: {str(e)}")
         raise HTTPException(status_code=500, detail=f"Style personality analysis failed: {str(e)}")
\ No newline at end of file
@@ -1,36 +1,68 @@
-from fastapi import APIRouter, File, UploadFile, Form, HTTPException
+from fastapi import APIRouter, File, UploadFile, Form, HTTPException, Request
 from fastapi.responses import JSONResponse
-import google.genai as genai
 from google.genai import types
-import os
-import base64
-import io
-from PIL import Image
+from utils import palette
+from utils.artifact_store import image_reference
+from utils.result_cache import ResultCache, analysis_cache, cached_text, content_key
+from utils.gemini_client import IMAGE_MODEL, TEXT_MODEL, generate_content, response_image
+from utils.metrics import FALLBACKS
+from utils.resilience import request_deadline
+from utils.scheduler import PAIRING, priority
+from utils.streaming import stream_events
+from utils.timing import stage, timed
+from utils.image_pipeline import InvalidImageError, load_image, prepare_upload
+from utils.near_duplicates import image_id
+from utils.uploads import UploadBudget
+from pathlib import Path
+import asyncio
 import json
-import random
-
-# Configure Gemini
-client = genai.Client(api_key=os.getenv("GOOGLE_API_KEY"))
+import os
+from typing import NamedTuple
 
 router = APIRouter(tags=["Smart Pairing"])
 
+# Upper bound on image generations running at once for a single request
+MAX_PARALLEL_GENERATIONS = int(os.getenv("PAIRING_MAX_PARALLEL", "6"))
+# Seconds to wait for one suggestion image before using its placeholder
+ITEM_TIMEOUT_S = float(os.getenv("PAIRING_ITEM_TIMEOUT_S", "25"))
+# Seconds to wait for the item analysis before using the fallback text
+ANALYSIS_TIMEOUT_S = float(os.getenv("PAIRING_ANALYSIS_TIMEOUT_S", "25"))
+
+PLACEHOLDER_COLORS = ["FF6B6B", "4ECDC4", "45B7D1", "96CEB4", "FFEAA7", "DDA0DD"]
+
+# Suggestion images depend only on the prompt parameters, never on the
+# upload, so they are shared by every request with the same find_type, style
+# and gender. scripts/precompute_pairing_images.py fills this ahead of time.
+PAIRING_CACHE_DIR = os.getenv("PAIRING_CACHE_DIR", "data/cache/pairing")
+pairing_image_cache = ResultCache(
+    "pairing_images",
+    max_memory_bytes=int(float(os.getenv("PAIRING_CACHE_MEMORY_MB", "128")) * 1024 * 1024),
+    directory=Path(PAIRING_CACHE_DIR) if PAIRING_CACHE_DIR else None,
+    ttl_s=float(os.getenv("PAIRING_CACHE_TTL_S", str(30 * 24 * 3600))),
+)
+
 @router.post("/smart-pairing")
 async def smart_pairing(
+    request: Request,
     item_image: UploadFile = File(...),
     item_type: str = Form(...),  # "top" or "bottom"
     find_type: str = Form(...),  # "top" or "bottom" (opposite of item_type)
     style: str = Form("casual"),
-    gender: str = Form("unisex")
+    gender: str = Form("unisex"),
+    stream: bool = Form(False)  # stream the analysis and each suggestion as NDJSON/SSE
 ):
+    # Normalised so equivalent requests share cached suggestion images
+    style = style.strip().lower()
+    gender = gender.strip().lower()
+    item_palette = None
     try:
-        # Process the uploaded image
-        image_data = await item_image.read()
-        image = Image.open(io.BytesIO(image_data))
-        
-        # Convert to base64 for Gemini
-        buffered = io.BytesIO()
-        image.save(buffered, format="JPEG")
-        img_base64 = base64.b64encode(buffered.getvalue()).decode()
+        # Process the uploaded image: one decode, at most one encode
+        upload = await UploadBudget().read(item_image, "item_image")
+        item = await prepare_upload(upload.data, upload.mime_type)
+        # Suggestions are scored against the item's colours locally, without the model
+        item_palette = await timed("palette", upload_palette(item))
+        # Re-uploads of the same photo share one id, and so one cached analysis
+        item_id = await timed("near_duplicates", image_id(upload.data, item))
         
         # Enhanced prompt for AI analysis and image generation
         analysis_prompt = f"""
@@ -63,143 +95,43 @@ async def smart_pairing(
         Focus on practical, wearable combinations that enhance the original item.
         """
         
-        # AI analysis
-        ai_analysis = "AI analysis completed successfully"
-        try:
-            response = client.models.generate_content(
-                model="gemini-2.0-flash-exp",
-                contents=[
-                    types.Content(
-                        parts=[
-                            types.Part.from_text(analysis_prompt),
-                            types.Part.from_bytes(
-                                data=base64.b64decode(img_base64),
-                                mime_type="image/jpeg"
-                            )
-                        ]
-                    )
-                ],
-                config=types.GenerateContentConfig(
-                    response_modalities=['TEXT']
-                )
+        item_suggestions = suggestion_names(find_type, style)
+        
+        if stream:
+            return stream_events(
+                request,
+                stream_pairing(request, item, item_id, item_palette, analysis_prompt, item_suggestions, item_type, find_type, style, gender)
             )
-            ai_analysis = response.text if response.text else "AI analysis completed"
-        except Exception as ai_error:
-            print(f"AI Analysis failed: {ai_error}")
-            ai_analysis = f"Smart pairing analysis for {item_type} completed with style preferences: {style}"
-        
-        # Generate AI-powered suggestions with AI-generated images
-        suggestions = []
-        
-        # Define clothing items based on find_type
-        if find_type == "top":
-            item_suggestions = [
-                f"Classic {style.title()} Blouse",
-                f"Elegant {style.title()} Shirt",
-                f"Trendy {style.title()} Top",
-                f"Sophisticated {style.title()} Blouse",
-                f"Modern {style.title()} Tee",
-                f"Stylish {style.title()} Sweater"
-            ]
-        else:  # bottom
-            item_suggestions = [
-                f"Perfect {style.title()} Pants",
-                f"Classic {style.title()} Trousers",
-                f"Trendy {style.title()} Jeans",
-                f"Elegant {style.title()} Skirt",
-                f"Modern {style.title()} Shorts",
-                f"Sophisticated {style.title()} Leggings"
-            ]
         
-        # Generate AI images for each suggestion
-        for i, item_name in enumerate(item_suggestions):
-            try:
-                # Create image generation prompt
-                image_prompt = f"""
-                Generate a high-quality fashion photography image of a {item_name.lower()} that would perfectly match the uploaded {item_type}.
-                
-                Style specifications:
-                - Style: {style}
-                - Gender: {gender}
-                - Item type: {find_type}
-                - Professional fashion photography
-                - Clean white background
-                - High resolution and detailed
-                - {item_name}
-                
-                The {find_type} should complement the color scheme and style of the uploaded {item_type} image.
-                Make it look like a professional product photo for an e-commerce website.
-                """
-                
-                # Generate image using Gemini
-                image_response = client.models.generate_content(
-                    model="gemini-2.0-flash-exp-image-generation",
-                    contents=[image_prompt],
-                    config=types.GenerateContentConfig(
-                        response_modalities=['IMAGE']
-                    )
-                )
-                
-                # Extract generated image
-                generated_image = None
-                if image_response.candidates and len(image_response.candidates) > 0:
-                    parts = image_response.candidates[0].content.parts
-                    for part in parts:
-                        if hasattr(part, "inline_data") and part.inline_data:
-                            image_data = part.inline_data.data
-                            image_mime_type = getattr(part.inline_data, "mime_type", "image/png")
-                            generated_image = f"data:{image_mime_type};base64,{base64.b64encode(image_data).decode('utf-8')}"
-                            break
-                
-                # Fallback to placeholder if AI generation fails
-                if not generated_image:
-                    colors = ["FF6B6B", "4ECDC4", "45B7D1", "96CEB4", "FFEAA7", "DDA0DD"]
-                    generated_image = f"https://via.placeholder.com/200x250/{colors[i]}/white?text={find_type.title()}+{i+1}"
-                
-                suggestions.append({
-                    "name": item_name,
-                    "image": generated_image,
-                    "match_reason": f"AI-generated perfect match for your {item_type}",
-                    "styling_tip": f"Perfect for {style} occasions",
-                    "occasion": style.title(),
-                    "color_harmony": f"Complements your {item_type} beautifully",
-                    "confidence_score": random.randint(85, 98),
-                    "generated": True  # Flag to indicate AI-generated image
-                })
-                
-            except Exception as img_error:
-                print(f"Image generation failed for {item_name}: {img_error}")
-                # Fallback suggestion with placeholder
-                colors = ["FF6B6B", "4ECDC4", "45B7D1", "96CEB4", "FFEAA7", "DDA0DD"]
-                suggestions.append({
-                    "name": item_name,
-                    "image": f"https://via.placeholder.com/200x250/{colors[i]}/white?text={find_type.title()}+{i+1}",
-                    "match_reason": f"Recommended pairing for {style} style",
-                    "styling_tip": f"Perfect for {style} occasions",
-                    "occasion": style.title(),
-                    "color_harmony": f"Matches your {item_type} style",
-                    "confidence_score": random.randint(75, 90),
-                    "generated": False
-                })
+        # Run the analysis and all image generations concurrently; each image
+        # falls back to its placeholder on its own without holding up the rest
+        parallel = asyncio.Semaphore(MAX_PARALLEL_GENERATIONS)
+        ai_analysis, *suggestions = await asyncio.gather(
+            timed("analysis", analyze_item(item, item_id, analysis_prompt, item_type, style)),
+            *[
+                timed(f"image_gen_{i}", generate_suggestion(request, i, item_name, item_type, find_type, style, gender, parallel, item_palette))
+                for i, item_name in enumerate(item_suggestions)
+            ]
+        )
         
-        return JSONResponse(content={
-            "suggestions": suggestions,
-            "ai_analysis": ai_analysis,
-            "pairing_logic": f"AI-generated {find_type} pieces that complement your {item_type}",
-            "style_analysis": {
-                "item_type": item_type,
-                "find_type": find_type,
-                "style_preference": style,
-                "gender": gender,
-                "ai_powered": True
-            }
-        })
+        with stage("serialize"):
+            response = JSONResponse(content={
+                "suggestions": suggestions,
+                "ai_analysis": ai_analysis,
+                **pairing_details(item_type, find_type, style, gender, item_palette)
+            })
+        return response
         
+    except HTTPException:
+        raise
+    except InvalidImageError as e:
+        raise HTTPException(status_code=400, detail=str(e))
     except Exception as e:
         print(f"Error in smart pairing: {str(e)}")
+        FALLBACKS.inc("smart_pairing")
         # Return fallback suggestions
         fallback_suggestions = []
-        colors = ["FF6B6B", "4ECDC4", "45B7D1", "96CEB4", "FFEAA7", "DDA0DD"]
+        colors = PLACEHOLDER_COLORS
         occasions = ["Casual", "Work", "Date Night", "Weekend", "Formal", "Party"]
         
         for i in range(6):
@@ -209,8 +141,7 @@ async def smart_pairing(
                 "match_reason": f"Recommended pairing for {style} style",
                 "styling_tip": f"Perfect for {occasions[i].lower()} occasions",
                 "occasion": occasions[i],
-                "color_harmony": f"Matches your {item_type} style",
-                "confidence_score": random.randint(75, 90),
+                **colour_match(item_palette, None, f"Matches your {item_type} style"),
                 "generated": False
             })
         
@@ -225,4 +156,223 @@ async def smart_pairing(
                 "gender": gender,
                 "note": "Using fallback suggestions due to API issue"
             }
-        })
\ No newline at end of file
+        })
+
+def suggestion_names(find_type, style):
+    """The six suggested items for a find_type and style"""
+    if find_type == "top":
+        return [
+            f"Classic {style.title()} Blouse",
+            f"Elegant {style.title()} Shirt",
+            f"Trendy {style.title()} Top",
+            f"Sophisticated {style.title()} Blouse",
+            f"Modern {style.title()} Tee",
+            f"Stylish {style.title()} Sweater"
+        ]
+    # bottom
+    return [
+        f"Perfect {style.title()} Pants",
+        f"Classic {style.title()} Trousers",
+        f"Trendy {style.title()} Jeans",
+        f"Elegant {style.title()} Skirt",
+        f"Modern {style.title()} Shorts",
+        f"Sophisticated {style.title()} Leggings"
+    ]
+
+def suggestion_prompt(item_name, item_type, find_type, style, gender):
+    """Image generation prompt for one suggestion"""
+    return f"""
+    Generate a high-quality fashion photography image of a {item_name.lower()} that would perfectly match the uploaded {item_type}.
+    
+    Style specifications:
+    - Style: {style}
+    - Gender: {gender}
+    - Item type: {find_type}
+    - Professional fashion photography
+    - Clean white background
+    - High resolution and detailed
+    - {item_name}
+    
+    The {find_type} should complement the color scheme and style of the uploaded {item_type} image.
+    Make it look like a professional product photo for an e-commerce website.
+    """
+
+class SuggestionImage(NamedTuple):
+    data: bytes | None  # None when the model returned no image
+    mime_type: str | None
+    palette: palette.Palette | None
+    cached: bool
+
+def image_palette(data):
+    """Palette of a generated image"""
+    return palette.extract_palette(load_image(data, (palette.SAMPLE_EDGE * 2, palette.SAMPLE_EDGE * 2)))
+
+async def suggestion_image(item_name, item_type, find_type, style, gender, parallel, timeout_s=ITEM_TIMEOUT_S):
+    """Return a suggestion image and its palette, generating and storing both on a miss.
+
+    Generation waits on ``parallel``, then gets ``timeout_s``; cache hits do neither.
+    """
+    prompt = suggestion_prompt(item_name, item_type, find_type, style, gender)
+    # Keyed by the full prompt, so editing the template invalidates old images
+    cache_key = content_key(IMAGE_MODEL, prompt)
+    cached = await pairing_image_cache.get(cache_key)
+    if cached:
+        if "palette" in cached.meta:
+            image_colours = palette.from_json(cached.meta["palette"])
+        else:
+            # Stored before palettes were kept alongside the image
+            image_colours = await asyncio.to_thread(image_palette, cached.payload)
+        return SuggestionImage(cached.payload, cached.meta["mime_type"], image_colours, True)
+    
+    async with parallel:
+        # Generate image using Gemini
+        with request_deadline(timeout_s):
+            image_response = await generate_content(
+                model=IMAGE_MODEL,
+                contents=[prompt],
+                config=types.GenerateContentConfig(
+                    response_modalities=['IMAGE']
+                )
+            )
+    image_data, image_mime_type = response_image(image_response)
+    if not image_data:
+        return SuggestionImage(None, None, None, False)
+    image_colours = await asyncio.to_thread(image_palette, image_data)
+    await pairing_image_cache.put(cache_key, image_data, {
+        "mime_type": image_mime_type,
+        "name": item_name,
+        "palette": palette.to_json(image_colours),
+    })
+    return SuggestionImage(image_data, image_mime_type, image_colours, False)
+
+async def upload_palette(item):
+    """Palette of the uploaded item, or None when it was not decoded locally"""
+    if item.image is None:
+        return None
+    return await asyncio.to_thread(palette.extract_palette, item.image)
+
+def colour_match(item_palette, suggestion_palette, fallback_harmony):
+    """color_harmony and confidence_score from how the suggestion's colours go with the item's"""
+    if item_palette is None or suggestion_palette is None:
+        return {"color_harmony": fallback_harmony, "confidence_score": None}
+    score = palette.harmony_scores(item_palette, palette.stack([suggestion_palette]))[0]
+    return {
+        "color_harmony": palette.describe_harmony(item_palette, suggestion_palette),
+        "confidence_score": int(round(float(score) * 100)),
+    }
+
+def pairing_details(item_type, find_type, style, gender, item_palette):
+    """Response fields that do not depend on any model output"""
+    return {
+        "pairing_logic": f"AI-generated {find_type} pieces that complement your {item_type}",
+        "style_analysis": {
+            "item_type": item_type,
+            "find_type": find_type,
+            "style_preference": style,
+            "gender": gender,
+            "item_colours": palette.palette_summary(item_palette) if item_palette is not None else [],
+            "ai_powered": True
+        }
+    }
+
+async def stream_pairing(request, item, item_id, item_palette, analysis_prompt, item_suggestions, item_type, find_type, style, gender):
+    """Yield the analysis and each suggestion as soon as it is ready, then a closing summary"""
+    parallel = asyncio.Semaphore(MAX_PARALLEL_GENERATIONS)
+    
+    async def tagged(event, index, coro):
+        return event, index, await coro
+    
+    tasks = [asyncio.create_task(tagged("ai_analysis", None, timed("analysis", analyze_item(item, item_id, analysis_prompt, item_type, style))))]
+    tasks += [
+        asyncio.create_task(tagged("suggestion", i, timed(f"image_gen_{i}", generate_suggestion(request, i, item_name, item_type, find_type, style, gender, parallel, item_palette))))
+        for i, item_name in enumerate(item_suggestions)
+    ]
+    try:
+        for next_done in asyncio.as_completed(tasks):
+            event, index, value = await next_done
+            if event == "suggestion":
+                value = {"index": index, **value}
+            yield event, value
+        yield "done", pairing_details(item_type, find_type, style, gender, item_palette)
+    finally:
+        # The client may disconnect mid-stream; don't leave generations running
+        for task in tasks:
+            task.cancel()
+
+async def analyze_item(item, item_id, analysis_prompt, item_type, style):
+    """Ask the text model to analyse the uploaded item"""
+    try:
+        async def analyse():
+            # A deadline rather than wait_for, so timeouts count against the circuit
+            with request_deadline(ANALYSIS_TIMEOUT_S):
+                response = await generate_content(
+                    model=TEXT_MODEL,
+                    contents=[
+                        types.Content(
+                            parts=[
+                                types.Part.from_text(text=analysis_prompt),
+                                types.Part.from_bytes(
+                                    data=item.data,
+                                    mime_type=item.mime_type
+                                )
+                            ]
+                        )
+                    ],
+                    config=types.GenerateContentConfig(
+                        response_modalities=['TEXT']
+                    )
+                )
+            return response.text
+        
+        # The same photo with the same preferences gets the stored analysis
+        text = await cached_text(analysis_cache, content_key(TEXT_MODEL, analysis_prompt, item_id), analyse)
+        return text if text else "AI analysis completed"
+    except Exception as ai_error:
+        print(f"AI Analysis failed: {ai_error!r}")
+        FALLBACKS.inc("pairing_analysis")
+        return f"Smart pairing analysis for {item_type} completed with style preferences: {style}"
+
+async def generate_suggestion(request, i, item_name, item_type, find_type, style, gender, parallel, item_palette):
+    """Generate one suggestion with an AI image, falling back to a placeholder"""
+    placeholder = f"https://via.placeholder.com/200x250/{PLACEHOLDER_COLORS[i]}/white?text={find_type.title()}+{i+1}"
+    
+    try:
+        # Served from the shared cache when this suggestion was generated
+        # before; otherwise the thumbnail queues behind interactive calls
+        generated_image = None
+        with priority(PAIRING):
+            suggestion = await suggestion_image(item_name, item_type, find_type, style, gender, parallel)
+        if suggestion.data:
+            generated_image = await image_reference(request, suggestion.data, suggestion.mime_type)
+        
+        # Fallback to placeholder if AI generation fails
+        suggestion_palette = suggestion.palette
+        if not generated_image:
+            FALLBACKS.inc("pairing_image")
+            generated_image = placeholder
+            # A placeholder swatch's colour says nothing about a real match
+            suggestion_palette = None
+        
+        return {
+            "name": item_name,
+            "image": generated_image,
+            "match_reason": f"AI-generated perfect match for your {item_type}",
+            "styling_tip": f"Perfect for {style} occasions",
+            "occasion": style.title(),
+            **colour_match(item_palette, suggestion_palette, f"Complements your {item_type} beautifully"),
+            "generated": generated_image != placeholder  # Flag to indicate AI-generated image
+        }
+    
+    except Exception as img_error:
+        print(f"Image generation failed for {item_name}: {img_error!r}")
+        FALLBACKS.inc("pairing_image")
+        # Fallback suggestion with placeholder
+        return {
+            "name": item_name,
+            "image": placeholder,
+            "match_reason": f"Recommended pairing for {style} style",
+            "styling_tip": f"Perfect for {style} occasions",
+            "occasion": style.title(),
+            **colour_match(item_palette, None, f"Matches your {item_type} style"),
+            "generated": False
+        }
@@ -1,19 +1,33 @@
-from fastapi import APIRouter, File, UploadFile, Form, HTTPException
+from fastapi import APIRouter, File, UploadFile, Form, HTTPException, Request
 from fastapi.responses import JSONResponse
-import google.genai as genai
-import os
-import base64
+from google.genai import types
+from utils.gemini_client import generate_content
+from utils.artifact_store import image_reference
+from utils.image_pipeline import InvalidImageError, prepare_upload
+from utils.resilience import UPSTREAM_ERRORS, request_deadline, upstream_http_error
+from utils.result_cache import analysis_cache, cached_text, content_key
+from utils.timing import timed
+from utils.uploads import UploadBudget
+from utils.swr_cache import StaleWhileRevalidateCache, request_key
+import asyncio
 import io
+import os
 from PIL import Image, ImageDraw
 import random
 
-# Configure Gemini
-genai.configure(api_key=os.getenv("GOOGLE_API_KEY"))
+# Model used for the outfit and wishlist analysis in this router
+ANALYSIS_MODEL = "gemini-1.5-flash"
+# Latency budget for one analysis call, retries included
+STYLING_BUDGET_S = float(os.getenv("STYLING_BUDGET_S", "45"))
 
 router = APIRouter(tags=["Styling"])
 
+# Wishlist analysis depends only on the item and preferences
+wishlist_cache = StaleWhileRevalidateCache("wishlist_pairing")
+
 @router.post("/tryon-outfit")
 async def tryon_complete_outfit(
+    request: Request,
     person_image: UploadFile = File(...),
     clothing_type: str = Form(...),  # "top", "bottom", "both"
     top_clothing: UploadFile = File(None),
@@ -28,32 +42,15 @@ async def tryon_complete_outfit(
         elif clothing_type == "bottom" and not bottom_clothing:
             raise HTTPException(status_code=400, detail="Bottom clothing required")
         
-        # Process person image
-        person_data = await person_image.read()
-        person_img = Image.open(io.BytesIO(person_data))
-        
-        # Convert person image to base64
-        person_buffered = io.BytesIO()
-        person_img.save(person_buffered, format="JPEG")
-        person_base64 = base64.b64encode(person_buffered.getvalue()).decode()
-        
-        # Process clothing images
-        clothing_data = []
-        if top_clothing:
-            top_data = await top_clothing.read()
-            top_img = Image.open(io.BytesIO(top_data))
-            top_buffered = io.BytesIO()
-            top_img.save(top_buffered, format="JPEG")
-            top_base64 = base64.b64encode(top_buffered.getvalue()).decode()
-            clothing_data.append(("top", top_base64))
-        
-        if bottom_clothing:
-            bottom_data = await bottom_clothing.read()
-            bottom_img = Image.open(io.BytesIO(bottom_data))
-            bottom_buffered = io.BytesIO()
-            bottom_img.save(bottom_buffered, format="JPEG")
-            bottom_base64 = base64.b64encode(bottom_buffered.getvalue()).decode()
-            clothing_data.append(("bottom", bottom_base64))
+        # Process person and clothing images: one decode, at most one encode each
+        budget = UploadBudget()
+        files = [("person_image", person_image), ("top_clothing", top_clothing), ("bottom_clothing", bottom_clothing)]
+        uploads = []
+        for field, upload_file in files:
+            if upload_file:
+                upload = await budget.read(upload_file, field)
+                uploads.append(prepare_upload(upload.data, upload.mime_type))
+        person, *clothing_images = await asyncio.gather(*uploads)
         
         # Create prompt for AI analysis
         if clothing_type == "both":
@@ -87,37 +84,46 @@ async def tryon_complete_outfit(
             - Occasion recommendations
             """
         
-        # Generate AI analysis
-        model = genai.GenerativeModel('gemini-1.5-flash')
-        
         # Create content list for Gemini
         content_list = [prompt]
-        content_list.append({"mime_type": "image/jpeg", "data": person_base64})
+        content_list.append(types.Part.from_bytes(data=person.data, mime_type=person.mime_type))
         
-        for clothing_type_item, clothing_base64 in clothing_data:
-            content_list.append({"mime_type": "image/jpeg", "data": clothing_base64})
+        for clothing in clothing_images:
+            content_list.append(types.Part.from_bytes(data=clothing.data, mime_type=clothing.mime_type))
         
-        response = model.generate_content(content_list)
+        # Generate AI analysis, or reuse the one stored for these exact images
+        async def analyse():
+            with request_deadline(STYLING_BUDGET_S):
+                response = await generate_content(model=ANALYSIS_MODEL, contents=content_list)
+            return response.text
         
-        # Generate a result image (placeholder for now)
-        # In a real implementation, you would use actual try-on AI/ML models
-        result_image = create_tryon_result_image(person_img, clothing_type)
+        cache_key = content_key(ANALYSIS_MODEL, prompt, person.data, *[clothing.data for clothing in clothing_images])
+        analysis = await timed("analysis", cached_text(analysis_cache, cache_key, analyse))
         
-        # Convert result to base64
-        result_buffered = io.BytesIO()
-        result_image.save(result_buffered, format="JPEG")
-        result_base64 = base64.b64encode(result_buffered.getvalue()).decode()
-        result_url = f"data:image/jpeg;base64,{result_base64}"
+        # Generate a result image (placeholder for now)
+        # In a real implementation, you would use actual try-on AI/ML models.
+        # Formats Pillow cannot decode (HEIC) are analysed but get no overlay.
+        result_url = None
+        if person.image is not None:
+            result_data = await asyncio.to_thread(render_tryon_result, person.image, clothing_type)
+            # Store the result image and reference it by URL
+            result_url = await image_reference(request, result_data, "image/jpeg")
         
         return JSONResponse(content={
             "result_image": result_url,
-            "analysis": response.text,
+            "analysis": analysis,
             "outfit_type": clothing_type,
             "confidence_score": random.randint(85, 95),
             "styling_tips": generate_styling_tips(clothing_type),
             "occasions": suggest_occasions(clothing_type)
         })
         
+    except HTTPException:
+        raise
+    except InvalidImageError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    except UPSTREAM_ERRORS as e:
+        raise upstream_http_error(e)
     except Exception as e:
         print(f"Error in outfit try-on: {str(e)}")
         raise HTTPException(status_code=500, detail=f"Outfit try-on failed: {str(e)}")
@@ -144,6 +150,12 @@ def create_tryon_result_image(person_img, clothing_type):
     
     return result_img
 
+def render_tryon_result(person_img, clothing_type) -> bytes:
+    """The placeholder result image as JPEG bytes; run in a worker thread"""
+    result_buffered = io.BytesIO()
+    create_tryon_result_image(person_img, clothing_type).save(result_buffered, format="JPEG")
+    return result_buffered.getvalue()
+
 def generate_styling_tips(clothing_type):
     """Generate styling tips based on clothing type"""
     tips = {
@@ -196,8 +208,10 @@ async def wishlist_pairing(request: dict):
         For each suggestion, explain why it works well with "{selected_item}".
         """
         
-        model = genai.GenerativeModel('gemini-1.5-flash')
-        response = model.generate_content(prompt)
+        ai_analysis = await wishlist_cache.get_or_compute(
+            request_key(selected_item, preferences),
+            lambda: wishlist_analysis(prompt)
+        )
         
         # Generate mock suggestions
         suggestions = []
@@ -212,10 +226,18 @@ async def wishlist_pairing(request: dict):
         
         return JSONResponse(content={
             "suggestions": suggestions,
-            "ai_analysis": response.text,
+            "ai_analysis": ai_analysis,
             "selected_item": selected_item
         })
         
+    except UPSTREAM_ERRORS as e:
+        raise upstream_http_error(e)
     except Exception as e:
         print(f"Error in wishlist pairing: {str(e)}")
-        raise HTTPException(status_code=500, detail=f"Wishlist pairing failed: {str(e)}")
\ No newline at end of file
+        raise HTTPException(status_code=500, detail=f"Wishlist pairing failed: {str(e)}")
+
+async def wishlist_analysis(prompt):
+    """Ask the model for pairing suggestions for a wishlist item"""
+    with request_deadline(STYLING_BUDGET_S):
+        response = await generate_content(model=ANALYSIS_MODEL, contents=[prompt])
+    return response.text
@@ -1,25 +1,269 @@
-from fastapi import APIRouter, UploadFile, File, Form, HTTPException
+from fastapi import APIRouter, UploadFile, File, Form, HTTPException, Request
 from fastapi.responses import JSONResponse
-from utils.base64_helpers import array_buffer_to_base64
+from utils import jobs
+from utils.artifact_store import image_reference, save_artifact
+from utils.gemini_client import IMAGE_MODEL, generate_content
+from utils.image_pipeline import InvalidImageError, PreparedImage, prepare_upload
+from utils.near_duplicates import image_id, known_image_id
+from utils.resilience import UPSTREAM_ERRORS, request_deadline, upstream_http_error
+from utils.result_cache import ResultCache, content_key
+from utils.streaming import stream_events
+from utils.timing import stage
+from utils.uploads import UploadBudget
 from dotenv import load_dotenv
+from pathlib import Path
 import os
-from google import genai
 from google.genai import types
+import asyncio
 import traceback
-import base64
+from typing import NamedTuple
 
 load_dotenv()
 
 router = APIRouter()
 
-GEMINI_API_KEY = os.getenv("GEMINI_API_KEY")
-if not GEMINI_API_KEY:
-    raise ValueError("Missing GEMINI_API_KEY in .env")
+# Generated try-ons keyed by both input images and every form field
+TRYON_CACHE_DIR = os.getenv("TRYON_CACHE_DIR", "data/cache/tryon")
+tryon_cache = ResultCache(
+    "tryon",
+    max_memory_bytes=int(float(os.getenv("TRYON_CACHE_MEMORY_MB", "256")) * 1024 * 1024),
+    directory=Path(TRYON_CACHE_DIR) if TRYON_CACHE_DIR else None,
+    ttl_s=float(os.getenv("TRYON_CACHE_TTL_S", str(7 * 24 * 3600))),
+)
+
+# Latency budget for one try-on generation, retries included
+TRYON_BUDGET_S = float(os.getenv("TRYON_BUDGET_S", "120"))
+
+# Job mode: generations run on a bounded worker pool instead of the request
+tryon_jobs = jobs.JobQueue(
+    "tryon",
+    store=jobs.make_store(),
+    workers=int(os.getenv("TRYON_JOB_WORKERS", "4")),
+    max_depth=int(os.getenv("TRYON_JOB_MAX_QUEUE", "100")),
+    ttl_s=float(os.getenv("TRYON_JOB_TTL_S", "3600")),
+)
+# Longest a status request may long-poll for a job to finish
+MAX_JOB_WAIT_S = float(os.getenv("TRYON_JOB_MAX_WAIT_S", "25"))
+
+# Batch mode: garments per request and generations running at once per batch
+MAX_BATCH_ITEMS = int(os.getenv("TRYON_BATCH_MAX_ITEMS", "20"))
+MAX_BATCH_PARALLEL = int(os.getenv("TRYON_BATCH_MAX_PARALLEL", "4"))
+
+class TryOnResult(NamedTuple):
+    image_data: bytes | None
+    mime_type: str | None
+    text: str
+    cached: bool
+
+
+async def generate_try_on(user_bytes: bytes, person_mime_type: str, cloth_bytes: bytes, cloth_mime_type: str,
+                          instructions: str, model_type: str, gender: str, garment_type: str,
+                          style: str, person: PreparedImage | None = None) -> TryOnResult:
+    """Generate (or replay from cache) a try-on of the garment onto the person.
+
+    ``person`` is the already-prepared person image when the caller reuses it
+    across several garments.
+    """
+    def key(person_id, cloth_id):
+        return content_key(person_id, cloth_id, instructions, model_type, gender, garment_type, style)
+
+    # Images are keyed by id, so a re-compressed or resized re-upload of a
+    # photo finds the result of the original; bytes seen before need no decode
+    person_id, cloth_id = known_image_id(user_bytes), known_image_id(cloth_bytes)
+    cache_key = None
+    if person_id and cloth_id:
+        cache_key = key(person_id, cloth_id)
+        with stage("cache_lookup"):
+            cached = await tryon_cache.get(cache_key)
+        if cached:
+            return TryOnResult(cached.payload, cached.meta["mime_type"], cached.meta["text"], True)
+
+    # Decode, orient and downscale each image once; raw bytes go upstream
+    if person is None:
+        person, cloth = await asyncio.gather(
+            prepare_upload(user_bytes, person_mime_type),
+            prepare_upload(cloth_bytes, cloth_mime_type),
+        )
+    else:
+        cloth = await prepare_upload(cloth_bytes, cloth_mime_type)
+
+    with stage("near_duplicates"):
+        if person_id is None:
+            person_id = await image_id(user_bytes, person)
+        if cloth_id is None:
+            cloth_id = await image_id(cloth_bytes, cloth)
+    if key(person_id, cloth_id) != cache_key:
+        cache_key = key(person_id, cloth_id)
+        with stage("cache_lookup"):
+            cached = await tryon_cache.get(cache_key)
+        if cached:
+            return TryOnResult(cached.payload, cached.meta["mime_type"], cached.meta["text"], True)
+
+    prompt = f"""
+        {{
+        "objective": "Generate a photorealistic virtual try-on image, seamlessly integrating a specified clothing item onto a person while rigidly preserving their facial identity, the clothing's exact appearance, and placing them in a completely new, distinct background.",
+        "task": "High-Fidelity Virtual Try-On with Identity/Garment Preservation and Background Replacement", 
+
+        "inputs": {{
+        "person_image": {{
+            "description": "Source image containing the target person. Used *primarily* for identity (face, skin tone), pose, body shape, hair, and accessories. The original background will be DISCARDED.",
+            "id": "input_1"
+        }},
+        "garment_image": {{
+            "description": "Source image containing the target clothing item. May include a model, mannequin, or be flat-lay. Used *strictly* for the clothing's visual properties (color, style, texture, pattern).",
+            "id": "input_2"
+        }}
+        }},
+
+        "processing_steps": [
+        "Isolate the clothing item from 'garment_image' (input_2), discarding any original model, mannequin, or background. Extract exact color, pattern, texture, and style information.",
+        "Identify the person (face, body shape, skin tone), pose, hair, and accessories from 'person_image' (input_1).",
+        "Segment the person from the original background in 'person_image'.",
+        "Determine the desired new background based on 'background_preference' or generate a suitable default.",
+        "Analyze lighting cues from 'person_image' to inform initial lighting on the subject, but adapt lighting for consistency with the *new* background."
+        ],
+
+        "output_requirements": {{
+        "description": "Generate a single, high-resolution image where the person from 'person_image' appears to be naturally and realistically wearing the clothing item from 'garment_image', situated within a **completely new and different background**.",
+        "format": "Image (e.g., PNG, JPG)",
+        "quality": "Photorealistic, free of obvious artifacts, blending issues, or inconsistencies between subject, garment, and the new background."
+        }},
+
+        "core_constraints": {{
+        "identity_lock": {{
+            "priority": "ABSOLUTE CRITICAL",
+            "instruction": "Maintain the **PERFECT** facial identity, features, skin tone, and expression of the person from 'person_image'. **ZERO alterations** to the face are permitted. Treat the head region (including hair) as immutable unless directly and logically occluded by the garment. DO NOT GUESS OR HALLUCINATE FACIAL FEATURES."
+        }},
+        "garment_fidelity": {{
+            "priority": "ABSOLUTE CRITICAL",
+            "instruction": "Preserve the **EXACT** color (hue, saturation, brightness), pattern, texture, material properties, and design details of the clothing item from 'garment_image'. **ZERO deviations** in style, color, or visual appearance are allowed. Render the garment precisely as depicted in input_2."
+        }},
+        "background_replacement": {{
+            "priority": "CRITICAL",
+            "instruction": "Generate a **COMPLETELY NEW and DIFFERENT** background that is distinct from the original background in 'person_image'. The new background should be photorealistic and contextually plausible for a person/fashion image unless otherwise specified by 'background_preference'. Ensure the person is seamlessly integrated into this new environment. **NO elements** from the original background should remain visible."
+        }},
+        "pose_preservation": {{
+            "priority": "HIGH",
+            "instruction": "Retain the **exact** body pose and positioning of the person from 'person_image'."
+        }},
+        "realistic_integration": {{
+            "priority": "HIGH",
+            "instruction": "Simulate physically plausible draping, folding, and fit of the garment onto the person's body according to their shape and pose. Ensure natural interaction with the body within the context of the *new* background."
+        }},
+        "lighting_consistency": {{
+            "priority": "HIGH",
+            "instruction": "Apply lighting, shadows, and highlights to the rendered garment AND the person that are **perfectly consistent** with the direction, intensity, and color temperature implied by the **NEW background**. Adjust subject lighting subtly if necessary to match the new scene, but prioritize maintaining a natural look consistent with the original subject's lighting where possible."
+        }}
+        }},
+
+        "additional_constraints": {{
+        "body_proportion_accuracy": "Scale the garment accurately to match the person's body proportions.",
+        "occlusion_handling": "Render natural and correct occlusion where the garment covers parts of the body, hair, or existing accessories from 'person_image'. Preserve visible unique features (tattoos, scars) unless occluded.",
+        "hair_and_accessory_integrity": "Maintain hair and non-clothing accessories (glasses, jewelry, hats) from 'person_image' unless logically occluded by the new garment. Integrate them seamlessly with the person and the new background.",
+        "texture_and_detail_rendering": "Render fine details (e.g., embroidery, seams, buttons, lace, sheer fabric properties) from the garment with high fidelity.",
+        "scene_coherence": "Ensure the person logically fits within the generated background environment (e.g., appropriate scale, perspective, interaction with ground plane if applicable)."
+        }},
+
+        "edge_case_handling": {{
+        "tight_fitting_clothing": "Accurately depict fabric stretch and conformity to body contours.",
+        "transparent_sheer_clothing": "Realistically render transparency, showing underlying skin tone or layers appropriately.",
+        "complex_garment_geometry": "Handle unusual shapes, layers, or asymmetrical designs with correct draping.",
+        "unusual_poses": "Ensure garment drape remains physically plausible even in non-standard or dynamic poses.",
+        "garment_partially_out_of_frame": "Render the visible parts of the garment correctly; do not hallucinate missing sections.",
+        "low_resolution_inputs": "Maximize detail preservation but prioritize realistic integration over inventing details not present in the inputs.",
+        "mismatched_lighting_inputs": "Prioritize generating a coherent lighting environment based on the **NEW background**, adapting the garment and slightly adjusting the person's apparent lighting for a unified final image. Avoid harsh lighting clashes."
+        }},
+
+        "prohibitions": [
+        "DO NOT alter the person's facial features, identity, expression, or skin tone.",
+        "DO NOT modify the intrinsic color, pattern, texture, or style of the clothing item.",
+        "DO NOT retain ANY part of the original background from 'person_image'.",
+        "DO NOT change the person's pose.",
+        "DO NOT introduce elements not present in the input images (person, garment) except for the generated background and necessary shadows/lighting adjustments for integration.",
+        "DO NOT hallucinate or guess facial details; if obscured, maintain the integrity of visible parts based on identity lock.",
+        "DO NOT generate a background that is stylistically jarring or contextually nonsensical without explicit instruction via 'background_preference'."
+        ]
+        }}
+
+        You are a virtual fashion stylist.
+        Create a realistic try-on visualization of the uploaded clothing onto the person image.
+        Match the following context:
+        - Model Type: {model_type}
+        - Gender: {gender}
+        - Garment Type: {garment_type}
+        - Style: {style}
+        - Special Instructions: {instructions}
+
+       Return image of try on and a short caption or summary of how the outfit looks and fits. Also include suggestions for improvement.
+    
+    """
+           
+    print(model_type)
+    print(gender)
+    print(garment_type)
+    print(style)
+    print(instructions)
+    
+    print(prompt)
+
+    contents=[
+        prompt,
+        types.Part.from_bytes(
+            data=person.data,
+            mime_type=person.mime_type,
+        ),
+        types.Part.from_bytes(
+            data=cloth.data,
+            mime_type=cloth.mime_type,
+        ),
+    ]        
+    
+    with stage("generate", IMAGE_MODEL):
+        response = await generate_content(
+            model=IMAGE_MODEL,
+            contents=contents,
+            config=types.GenerateContentConfig(
+            response_modalities=['TEXT', 'IMAGE']
+            )
+        )
+
+
+    print(response)
+    
+    image_data = None
+    image_mime_type = None
+    text_response = "No Description available."
+    if response.candidates and len(response.candidates) > 0:
+        parts = response.candidates[0].content.parts
+
+        if parts:
+            print("Number of parts in response:", len(parts))
+
+            for part in parts:
+                if hasattr(part, "inline_data") and part.inline_data:
+                    image_data = part.inline_data.data
+                    image_mime_type = getattr(part.inline_data, "mime_type", "image/png")
+                    print("Image data received, length:", len(image_data))
+                    print("MIME type:", image_mime_type)
+
+                elif hasattr(part, "text") and part.text:
+                    text_response = part.text
+                    preview = (text_response[:100] + "...") if len(text_response) > 100 else text_response
+                    print("Text response received:", preview)
+        else:
+            print("No parts found in the response candidate.")
+    else:
+        print("No candidates found in the API response.")
+
+    if image_data:
+        # Only successful generations are worth replaying
+        await tryon_cache.put(cache_key, image_data, {"mime_type": image_mime_type, "text": text_response})
+    return TryOnResult(image_data, image_mime_type, text_response, False)
 
-client = genai.Client(api_key=GEMINI_API_KEY)
 
 @router.post("/try-on")
 async def try_on(
+    request: Request,
     person_image: UploadFile = File(...),
     cloth_image: UploadFile = File(...),
     instructions: str = Form(""),
@@ -29,211 +273,179 @@ async def try_on(
     style: str = Form(""),
 ):
     try:
-        
-        MAX_IMAGE_SIZE_MB = 10
-        ALLOWED_MIME_TYPES = {
-            "image/jpeg",
-            "image/png",
-            "image/webp",
-            "image/heic",
-            "image/heif",
-        }
-
-        if person_image.content_type not in ALLOWED_MIME_TYPES:
-            raise HTTPException(
-                status_code=400, detail=f"Unsupported file type for person_image: {person_image.content_type}"
-            )
-
-        user_bytes = await person_image.read()
-
-        size_in_mb_for_person_image = len(user_bytes) / (1024 * 1024)
-        if size_in_mb_for_person_image > MAX_IMAGE_SIZE_MB:
-            raise HTTPException(status_code=400, detail="Image exceeds 10MB size limit for person_image")
-        
-        if cloth_image.content_type not in ALLOWED_MIME_TYPES:
-            raise HTTPException(
-                status_code=400, detail=f"Unsupported file type for cloth_image: {cloth_image.content_type}"
-            )
+        # Bounded chunked reads; the type is sniffed, not taken from content_type
+        budget = UploadBudget()
+        person_upload = await budget.read(person_image, "person_image")
+        cloth_upload = await budget.read(cloth_image, "cloth_image")
+        user_bytes, cloth_bytes = person_upload.data, cloth_upload.data
 
-        cloth_bytes = await cloth_image.read()
-
-        size_in_mb_for_cloth_image = len(cloth_bytes) / (1024 * 1024)
-        if size_in_mb_for_cloth_image > MAX_IMAGE_SIZE_MB:
-            raise HTTPException(status_code=400, detail="Image exceeds 10MB size limit for cloth_image")
-
-
-        user_b64 = array_buffer_to_base64(user_bytes)
-        cloth_b64 = array_buffer_to_base64(cloth_bytes)
-
-        prompt = f"""
-            {{
-            "objective": "Generate a photorealistic virtual try-on image, seamlessly integrating a specified clothing item onto a person while rigidly preserving their facial identity, the clothing's exact appearance, and placing them in a completely new, distinct background.",
-            "task": "High-Fidelity Virtual Try-On with Identity/Garment Preservation and Background Replacement", 
-
-            "inputs": {{
-            "person_image": {{
-                "description": "Source image containing the target person. Used *primarily* for identity (face, skin tone), pose, body shape, hair, and accessories. The original background will be DISCARDED.",
-                "id": "input_1"
-            }},
-            "garment_image": {{
-                "description": "Source image containing the target clothing item. May include a model, mannequin, or be flat-lay. Used *strictly* for the clothing's visual properties (color, style, texture, pattern).",
-                "id": "input_2"
-            }}
-            }},
-
-            "processing_steps": [
-            "Isolate the clothing item from 'garment_image' (input_2), discarding any original model, mannequin, or background. Extract exact color, pattern, texture, and style information.",
-            "Identify the person (face, body shape, skin tone), pose, hair, and accessories from 'person_image' (input_1).",
-            "Segment the person from the original background in 'person_image'.",
-            "Determine the desired new background based on 'background_preference' or generate a suitable default.",
-            "Analyze lighting cues from 'person_image' to inform initial lighting on the subject, but adapt lighting for consistency with the *new* background."
-            ],
-
-            "output_requirements": {{
-            "description": "Generate a single, high-resolution image where the person from 'person_image' appears to be naturally and realistically wearing the clothing item from 'garment_image', situated within a **completely new and different background**.",
-            "format": "Image (e.g., PNG, JPG)",
-            "quality": "Photorealistic, free of obvious artifacts, blending issues, or inconsistencies between subject, garment, and the new background."
-            }},
-
-            "core_constraints": {{
-            "identity_lock": {{
-                "priority": "ABSOLUTE CRITICAL",
-                "instruction": "Maintain the **PERFECT** facial identity, features, skin tone, and expression of the person from 'person_image'. **ZERO alterations** to the face are permitted. Treat the head region (including hair) as immutable unless directly and logically occluded by the garment. DO NOT GUESS OR HALLUCINATE FACIAL FEATURES."
-            }},
-            "garment_fidelity": {{
-                "priority": "ABSOLUTE CRITICAL",
-                "instruction": "Preserve the **EXACT** color (hue, saturation, brightness), pattern, texture, material properties, and design details of the clothing item from 'garment_image'. **ZERO deviations** in style, color, or visual appearance are allowed. Render the garment precisely as depicted in input_2."
-            }},
-            "background_replacement": {{
-                "priority": "CRITICAL",
-                "instruction": "Generate a **COMPLETELY NEW and DIFFERENT** background that is distinct from the original background in 'person_image'. The new background should be photorealistic and contextually plausible for a person/fashion image unless otherwise specified by 'background_preference'. Ensure the person is seamlessly integrated into this new environment. **NO elements** from the original background should remain visible."
-            }},
-            "pose_preservation": {{
-                "priority": "HIGH",
-                "instruction": "Retain the **exact** body pose and positioning of the person from 'person_image'."
-            }},
-            "realistic_integration": {{
-                "priority": "HIGH",
-                "instruction": "Simulate physically plausible draping, folding, and fit of the garment onto the person's body according to their shape and pose. Ensure natural interaction with the body within the context of the *new* background."
-            }},
-            "lighting_consistency": {{
-                "priority": "HIGH",
-                "instruction": "Apply lighting, shadows, and highlights to the rendered garment AND the person that are **perfectly consistent** with the direction, intensity, and color temperature implied by the **NEW background**. Adjust subject lighting subtly if necessary to match the new scene, but prioritize maintaining a natural look consistent with the original subject's lighting where possible."
-            }}
-            }},
-
-            "additional_constraints": {{
-            "body_proportion_accuracy": "Scale the garment accurately to match the person's body proportions.",
-            "occlusion_handling": "Render natural and correct occlusion where the garment covers parts of the body, hair, or existing accessories from 'person_image'. Preserve visible unique features (tattoos, scars) unless occluded.",
-            "hair_and_accessory_integrity": "Maintain hair and non-clothing accessories (glasses, jewelry, hats) from 'person_image' unless logically occluded by the new garment. Integrate them seamlessly with the person and the new background.",
-            "texture_and_detail_rendering": "Render fine details (e.g., embroidery, seams, buttons, lace, sheer fabric properties) from the garment with high fidelity.",
-            "scene_coherence": "Ensure the person logically fits within the generated background environment (e.g., appropriate scale, perspective, interaction with ground plane if applicable)."
-            }},
-
-            "edge_case_handling": {{
-            "tight_fitting_clothing": "Accurately depict fabric stretch and conformity to body contours.",
-            "transparent_sheer_clothing": "Realistically render transparency, showing underlying skin tone or layers appropriately.",
-            "complex_garment_geometry": "Handle unusual shapes, layers, or asymmetrical designs with correct draping.",
-            "unusual_poses": "Ensure garment drape remains physically plausible even in non-standard or dynamic poses.",
-            "garment_partially_out_of_frame": "Render the visible parts of the garment correctly; do not hallucinate missing sections.",
-            "low_resolution_inputs": "Maximize detail preservation but prioritize realistic integration over inventing details not present in the inputs.",
-            "mismatched_lighting_inputs": "Prioritize generating a coherent lighting environment based on the **NEW background**, adapting the garment and slightly adjusting the person's apparent lighting for a unified final image. Avoid harsh lighting clashes."
-            }},
-
-            "prohibitions": [
-            "DO NOT alter the person's facial features, identity, expression, or skin tone.",
-            "DO NOT modify the intrinsic color, pattern, texture, or style of the clothing item.",
-            "DO NOT retain ANY part of the original background from 'person_image'.",
-            "DO NOT change the person's pose.",
-            "DO NOT introduce elements not present in the input images (person, garment) except for the generated background and necessary shadows/lighting adjustments for integration.",
-            "DO NOT hallucinate or guess facial details; if obscured, maintain the integrity of visible parts based on identity lock.",
-            "DO NOT generate a background that is stylistically jarring or contextually nonsensical without explicit instruction via 'background_preference'."
-            ]
-            }}
-
-            You are a virtual fashion stylist.
-            Create a realistic try-on visualization of the uploaded clothing onto the person image.
-            Match the following context:
-            - Model Type: {model_type}
-            - Gender: {gender}
-            - Garment Type: {garment_type}
-            - Style: {style}
-            - Special Instructions: {instructions}
-
-           Return image of try on and a short caption or summary of how the outfit looks and fits. Also include suggestions for improvement.
-        
-        """
-               
-        print(model_type)
-        print(gender)
-        print(garment_type)
-        print(style)
-        print(instructions)
-        
-        print(prompt)
-
-        contents=[
-            prompt,
-            types.Part.from_bytes(
-                data=user_b64,
-                mime_type= person_image.content_type,
-            ),
-            types.Part.from_bytes(
-                data=cloth_b64,
-                mime_type= cloth_image.content_type,
-            ),
-        ]        
-        
-        response = client.models.generate_content(
-            model="gemini-2.0-flash-exp-image-generation",
-            contents=contents,
-            config=types.GenerateContentConfig(
-            response_modalities=['TEXT', 'IMAGE']
+        with request_deadline(TRYON_BUDGET_S):
+            result = await generate_try_on(
+                user_bytes, person_upload.mime_type, cloth_bytes, cloth_upload.mime_type,
+                instructions, model_type, gender, garment_type, style,
             )
-        )
-
-
-        print(response)
-        
-        image_data = None
-        text_response = "No Description available."
-        if response.candidates and len(response.candidates) > 0:
-            parts = response.candidates[0].content.parts
-
-            if parts:
-                print("Number of parts in response:", len(parts))
-
-                for part in parts:
-                    if hasattr(part, "inline_data") and part.inline_data:
-                        image_data = part.inline_data.data
-                        image_mime_type = getattr(part.inline_data, "mime_type", "image/png")
-                        print("Image data received, length:", len(image_data))
-                        print("MIME type:", image_mime_type)
-
-                    elif hasattr(part, "text") and part.text:
-                        text_response = part.text
-                        preview = (text_response[:100] + "...") if len(text_response) > 100 else text_response
-                        print("Text response received:", preview)
-            else:
-                print("No parts found in the response candidate.")
-        else:
-            print("No candidates found in the API response.")
 
         image_url = None
-        if image_data:
-            image_base64 = base64.b64encode(image_data).decode("utf-8")
-            image_url = f"data:{image_mime_type};base64,{image_base64}"
-        else:
-            image_url = None
+        if result.image_data:
+            image_url = await image_reference(request, result.image_data, result.mime_type)
     
         return JSONResponse(
         content={
             "image": image_url,
-            "text": text_response,
-        }
+            "text": result.text,
+        },
+        headers={"X-Cache": "HIT" if result.cached else "MISS"},
         )
 
+    except HTTPException:
+        raise
+    except InvalidImageError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    except UPSTREAM_ERRORS as e:
+        raise upstream_http_error(e)
     except Exception as e:
         print(f"Error in /api/try-on endpoint: {e}")
         traceback.print_exc()
         raise HTTPException(status_code=500, detail="Internal Server Error")
+
+
+def job_response(request: Request, job: dict) -> dict:
+    """Public view of a job record; the result image is referenced by artifact URL"""
+    body = {
+        "job_id": job["id"],
+        "status": job["status"],
+        "created_at": job["created_at"],
+        "updated_at": job["updated_at"],
+        "status_url": str(request.url_for("get_try_on_job", job_id=job["id"])),
+    }
+    if job["status"] == jobs.SUCCEEDED:
+        result = job["result"]
+        body["result"] = {
+            "image": str(request.url_for("get_artifact", name=result["artifact"])) if result["artifact"] else None,
+            "text": result["text"],
+        }
+    elif job["error"]:
+        body["error"] = job["error"]
+    return body
+
+@router.post("/try-on/jobs", status_code=202)
+async def submit_try_on_job(
+    request: Request,
+    person_image: UploadFile = File(...),
+    cloth_image: UploadFile = File(...),
+    instructions: str = Form(""),
+    model_type: str = Form(""),
+    gender: str = Form(""),
+    garment_type: str = Form(""),
+    style: str = Form(""),
+):
+    """Queue a try-on and return its job id immediately"""
+    budget = UploadBudget()
+    person_upload = await budget.read(person_image, "person_image")
+    cloth_upload = await budget.read(cloth_image, "cloth_image")
+
+    async def run():
+        with request_deadline(TRYON_BUDGET_S):
+            result = await generate_try_on(
+                person_upload.data, person_upload.mime_type, cloth_upload.data, cloth_upload.mime_type,
+                instructions, model_type, gender, garment_type, style,
+            )
+        # Jobs outlive the request, so the image is always stored as an artifact
+        artifact = await save_artifact(result.image_data, result.mime_type) if result.image_data else None
+        return {"artifact": artifact, "text": result.text}
+
+    try:
+        job = await tryon_jobs.submit("try-on", run)
+    except jobs.QueueFullError as e:
+        raise HTTPException(status_code=503, detail=str(e), headers={"Retry-After": "5"})
+
+    body = job_response(request, job)
+    return JSONResponse(status_code=202, content=body, headers={"Location": body["status_url"]})
+
+@router.get("/try-on/jobs/{job_id}", name="get_try_on_job")
+async def get_try_on_job(request: Request, job_id: str, wait: float = 0):
+    """Job status; ``wait`` long-polls up to that many seconds for the job to finish"""
+    job = await tryon_jobs.get(job_id, min(max(wait, 0), MAX_JOB_WAIT_S))
+    if job is None:
+        raise HTTPException(status_code=404, detail="Job not found")
+    return job_response(request, job)
+
+@router.delete("/try-on/jobs/{job_id}")
+async def cancel_try_on_job(request: Request, job_id: str):
+    """Cancel a queued or running job"""
+    job = await tryon_jobs.cancel(job_id)
+    if job is None:
+        raise HTTPException(status_code=404, detail="Job not found")
+    return job_response(request, job)
+
+@router.post("/try-on/batch")
+async def try_on_batch(
+    request: Request,
+    person_image: UploadFile = File(...),
+    cloth_images: list[UploadFile] = File(...),
+    instructions: str = Form(""),
+    model_type: str = Form(""),
+    gender: str = Form(""),
+    garment_type: str = Form(""),
+    style: str = Form(""),
+):
+    """Try one person image on many garments, streaming each result as it finishes"""
+    if len(cloth_images) > MAX_BATCH_ITEMS:
+        raise HTTPException(status_code=413, detail=f"Too many garments: at most {MAX_BATCH_ITEMS} per batch")
+    budget = UploadBudget()
+    budget.check_count(1 + len(cloth_images))
+    person_upload = await budget.read(person_image, "person_image")
+
+    # A bad garment only fails its own item
+    garments = []
+    for cloth_image in cloth_images:
+        try:
+            garments.append(await budget.read(cloth_image, "cloth_images"))
+        except HTTPException as e:
+            garments.append(e)
+
+    # The person image is validated, preprocessed and fingerprinted once for the whole batch
+    try:
+        person = await prepare_upload(person_upload.data, person_upload.mime_type)
+    except InvalidImageError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    await image_id(person_upload.data, person)
+
+    fields = (instructions, model_type, gender, garment_type, style)
+    return stream_events(request, stream_batch(request, person_upload, person, garments, cloth_images, fields))
+
+async def stream_batch(request, person_upload, person, garments, cloth_images, fields):
+    """Yield one item event per garment in completion order, then a summary"""
+    parallel = asyncio.Semaphore(MAX_BATCH_PARALLEL)
+
+    async def try_garment(index, garment):
+        item = {"index": index, "filename": cloth_images[index].filename}
+        if isinstance(garment, HTTPException):
+            return {**item, "error": garment.detail}
+        try:
+            async with parallel:
+                with request_deadline(TRYON_BUDGET_S):
+                    result = await generate_try_on(
+                        person_upload.data, person_upload.mime_type, garment.data, garment.mime_type,
+                        *fields, person=person,
+                    )
+            image_url = await image_reference(request, result.image_data, result.mime_type) if result.image_data else None
+            return {**item, "image": image_url, "text": result.text, "cached": result.cached}
+        except (InvalidImageError, *UPSTREAM_ERRORS) as e:
+            return {**item, "error": str(e)}
+        except Exception as e:
+            print(f"Error in /api/try-on/batch item {index}: {e}")
+            return {**item, "error": "Try-on failed for this garment"}
+
+    tasks = [asyncio.create_task(try_garment(i, garment)) for i, garment in enumerate(garments)]
+    failed = 0
+    try:
+        for next_done in asyncio.as_completed(tasks):
+            item = await next_done
+            failed += "error" in item
+            yield "item", item
+        yield "done", {"total": len(tasks), "succeeded": len(tasks) - failed, "failed": failed}
+    finally:
+        # The client may disconnect mid-stream; don't leave generations running
+        for task in tasks:
+            task.cancel()
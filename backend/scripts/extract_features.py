@@ -0,0 +1,166 @@
+"""Extract catalog image features into a memory-mapped feature store.
+
+Walks a directory of product images, decodes and featurises them across a
+process pool and writes the vectors into ``features.npy`` inside the catalog
+directory, with the product id of every row in ``ids.txt``. The API opens
+the matrix memory-mapped at startup (see ``utils/catalog.py``).
+
+Progress is tracked per row in ``done.npy``, so an interrupted run picks up
+where it stopped when started again with the same arguments. Once all rows
+are processed the IVF index is trained and saved next to the features, so
+API workers load it instead of training it at startup. The descriptor
+version is recorded in ``feature_version.txt``; a store written by an
+older version is extracted again from scratch.
+
+Run from the backend directory:
+
+    python -m scripts.extract_features /path/to/product/images --out data/catalog
+"""
+import argparse
+import json
+import os
+import time
+from multiprocessing import Pool
+from pathlib import Path
+
+import numpy as np
+from PIL import Image, ImageOps
+
+from utils import catalog, similarity
+
+IMAGE_SUFFIXES = {".jpg", ".jpeg", ".png", ".webp"}
+ROW_PENDING, ROW_DONE, ROW_FAILED = 0, 1, 2
+
+
+def list_images(root: Path) -> list[str]:
+    """Relative paths of every image under root, in a stable order"""
+    return sorted(
+        path.relative_to(root).as_posix()
+        for path in root.rglob("*")
+        if path.suffix.lower() in IMAGE_SUFFIXES and path.is_file()
+    )
+
+
+def featurise(path: Path) -> np.ndarray:
+    """Decode, orient and describe one image"""
+    with Image.open(path) as image:
+        # Decode JPEGs at reduced size; descriptors only need a 32x32 view
+        image.draft("RGB", (similarity.PHASH_SIZE * 2, similarity.PHASH_SIZE * 2))
+        image = ImageOps.exif_transpose(image)
+        return similarity.feature_vectors(similarity.describe(image))
+
+
+def featurise_batch(job: tuple[str, list[int], list[str]]):
+    """Worker entry point: featurise a batch of rows, reporting failures per row"""
+    root, rows, relative_paths = job
+    vectors = np.zeros((len(rows), similarity.FEATURE_DIM), dtype=np.float32)
+    status = np.full(len(rows), ROW_DONE, dtype=np.uint8)
+    for i, relative_path in enumerate(relative_paths):
+        try:
+            vectors[i] = featurise(Path(root) / relative_path)
+        except Exception as e:
+            print(f"Skipping {relative_path}: {e}")
+            status[i] = ROW_FAILED
+    return rows, vectors, status
+
+
+def open_store(out: Path, ids: list[str], restart: bool):
+    """Create the feature store, or reopen it when resuming the same image list"""
+    ids_path = out / "ids.txt"
+    features_path = out / "features.npy"
+    done_path = out / "done.npy"
+    version_path = out / "feature_version.txt"
+    shape = (len(ids), similarity.FEATURE_DIM)
+
+    resumable = (
+        not restart
+        and ids_path.exists() and features_path.exists() and done_path.exists()
+        and stored_version(out) == similarity.FEATURE_VERSION
+        and ids_path.read_text(encoding="utf-8").splitlines() == ids
+    )
+    if resumable:
+        features = np.load(features_path, mmap_mode="r+")
+        done = np.load(done_path, mmap_mode="r+")
+        if features.shape == shape and done.shape == (len(ids),):
+            return features, done
+
+    out.mkdir(parents=True, exist_ok=True)
+    ids_path.write_text("\n".join(ids) + "\n", encoding="utf-8")
+    version_path.write_text(f"{similarity.FEATURE_VERSION}\n", encoding="utf-8")
+    features = np.lib.format.open_memmap(features_path, mode="w+", dtype=np.float32, shape=shape)
+    done = np.lib.format.open_memmap(done_path, mode="w+", dtype=np.uint8, shape=(len(ids),))
+    return features, done
+
+
+def stored_version(out: Path) -> int:
+    """Descriptor version of an existing store; 1 for stores written before versions were recorded"""
+    try:
+        return int((out / "feature_version.txt").read_text(encoding="utf-8"))
+    except FileNotFoundError:
+        return 1
+
+
+def write_stub_products(out: Path, ids: list[str]):
+    """Give every image a minimal product record unless real records exist"""
+    products_path = out / "products.jsonl"
+    if products_path.exists():
+        return
+    with open(products_path, "w", encoding="utf-8") as f:
+        for product_id in ids:
+            f.write(json.dumps({"id": product_id, "name": Path(product_id).stem, "image": product_id}) + "\n")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("images", type=Path, help="directory of product images")
+    parser.add_argument("--out", type=Path, default=Path("data/catalog"), help="catalog directory")
+    parser.add_argument("--workers", type=int, default=os.cpu_count(), help="worker processes")
+    parser.add_argument("--batch-size", type=int, default=256, help="images per worker task")
+    parser.add_argument("--flush-every", type=float, default=10.0, help="seconds between checkpoints")
+    parser.add_argument("--restart", action="store_true", help="ignore progress from an earlier run")
+    args = parser.parse_args()
+
+    ids = list_images(args.images)
+    if not ids:
+        raise SystemExit(f"No images found in {args.images}")
+    features, done = open_store(args.out, ids, args.restart)
+    write_stub_products(args.out, ids)
+
+    pending = np.flatnonzero(done == ROW_PENDING)
+    print(f"{len(ids)} images, {len(ids) - len(pending)} already processed, {len(pending)} to go")
+    jobs = [
+        (str(args.images), rows.tolist(), [ids[row] for row in rows])
+        for rows in np.array_split(pending, max(1, -(-len(pending) // args.batch_size)))
+        if len(rows)
+    ]
+
+    started = last_flush = time.perf_counter()
+    processed = 0
+    with Pool(processes=args.workers) as pool:
+        # Unordered results keep every worker busy; only the parent writes the store
+        for rows, vectors, status in pool.imap_unordered(featurise_batch, jobs):
+            features[rows] = vectors
+            done[rows] = status
+            processed += len(rows)
+            if time.perf_counter() - last_flush >= args.flush_every:
+                # A killed process keeps its writes in the page cache; flushing
+                # also lets progress survive a machine crash
+                features.flush()
+                done.flush()
+                last_flush = time.perf_counter()
+                rate = processed / (last_flush - started)
+                print(f"{processed}/{len(pending)} images ({rate:.0f}/s)")
+
+    features.flush()
+    done.flush()
+    failed = int(np.count_nonzero(done == ROW_FAILED))
+    elapsed = time.perf_counter() - started
+    print(f"Finished {processed} images in {elapsed:.1f}s with {failed} failures; store at {args.out}")
+
+    started = time.perf_counter()
+    catalog.read_catalog(args.out)
+    print(f"Index ready in {time.perf_counter() - started:.1f}s")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,96 @@
+"""Fill the smart-pairing suggestion image cache ahead of time.
+
+Suggestion images depend only on find_type, style and gender (see
+``routers/smart_pairing.py``). This generates the six images of every
+combination, with their colour palettes, into the cache the API reads
+(``PAIRING_CACHE_DIR``). Images already cached are skipped, so an
+interrupted run picks up where it stopped. Generation runs at background
+priority and with its own concurrency limit, so it can share a quota with
+a live server.
+
+Run from the backend directory:
+
+    python -m scripts.precompute_pairing_images
+    python -m scripts.precompute_pairing_images --styles casual,formal --genders female --parallel 2
+    python -m scripts.precompute_pairing_images --dry-run
+"""
+import argparse
+import asyncio
+import time
+from collections import Counter
+
+from routers.smart_pairing import (
+    PAIRING_CACHE_DIR, pairing_image_cache, suggestion_image, suggestion_names, suggestion_prompt,
+)
+from utils.gemini_client import IMAGE_MODEL
+from utils.result_cache import content_key
+from utils.scheduler import BACKGROUND, priority
+
+FIND_TYPES = ("top", "bottom")
+# The options the smart-pairing page offers
+STYLES = ("casual", "formal", "streetwear", "traditional", "sports")
+GENDERS = ("female", "male", "unisex")
+
+
+def suggestions(find_types, styles, genders):
+    """Every (item_name, item_type, find_type, style, gender) the API can ask for"""
+    for find_type in find_types:
+        # The page always looks for the opposite of the uploaded item
+        item_type = "bottom" if find_type == "top" else "top"
+        for style in styles:
+            for gender in genders:
+                for item_name in suggestion_names(find_type, style):
+                    yield item_name, item_type, find_type, style, gender
+
+
+async def run(args):
+    todo = list(suggestions(
+        args.find_types.split(","), args.styles.split(","), args.genders.split(",")
+    ))
+    if args.dry_run:
+        cached = 0
+        for params in todo:
+            cached += await pairing_image_cache.get(content_key(IMAGE_MODEL, suggestion_prompt(*params))) is not None
+        print(f"{len(todo)} suggestion images, {cached} cached, {len(todo) - cached} to generate")
+        return
+
+    parallel = asyncio.Semaphore(args.parallel)
+    outcomes = Counter()
+    started = time.perf_counter()
+
+    async def precompute(params):
+        try:
+            with priority(BACKGROUND):
+                suggestion = await suggestion_image(*params, parallel, timeout_s=args.timeout)
+            outcome = "cached" if suggestion.cached else "generated" if suggestion.data else "no image"
+        except Exception as e:
+            print(f"Failed {params[0]} ({params[4]}): {e!r}")
+            outcome = "failed"
+        outcomes[outcome] += 1
+        done = sum(outcomes.values())
+        if outcome != "cached" or done == len(todo):
+            print(f"{done}/{len(todo)} {outcome}: {params[0]} ({params[4]})")
+
+    await asyncio.gather(*[precompute(params) for params in todo])
+    print(f"Finished in {time.perf_counter() - started:.0f}s: " + ", ".join(f"{n} {k}" for k, n in outcomes.items()))
+    if outcomes["failed"] or outcomes["no image"]:
+        print("Run again to retry the missing images")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--find-types", default=",".join(FIND_TYPES), help="comma-separated")
+    parser.add_argument("--styles", default=",".join(STYLES), help="comma-separated")
+    parser.add_argument("--genders", default=",".join(GENDERS), help="comma-separated")
+    parser.add_argument("--parallel", type=int, default=4, help="image generations at once")
+    parser.add_argument("--timeout", type=float, default=120.0, help="seconds per image generation")
+    parser.add_argument("--dry-run", action="store_true", help="only count what is already cached")
+    args = parser.parse_args()
+
+    if not PAIRING_CACHE_DIR:
+        raise SystemExit("PAIRING_CACHE_DIR is empty, so precomputed images would not be kept")
+    asyncio.run(run(args))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,52 @@
+"""Shared fixtures: an offline Gemini client and fresh upstream state for each test."""
+import os
+
+# Short pauses so throttling and retry tests finish quickly; read at import time
+os.environ.setdefault("GEMINI_RATE_LIMIT_PAUSE_S", "0.2")
+os.environ.setdefault("GEMINI_RETRY_BASE_S", "0.01")
+
+import pytest
+from google.genai import errors
+
+from benchmarks.fake_genai import FakeGenAIClient
+from utils import gemini_client, resilience
+from utils.scheduler import UpstreamScheduler
+from utils.singleflight import SingleFlight
+
+TEXT_MODEL = "test-text-model"
+IMAGE_MODEL = "test-image-model"
+
+
+class RateLimitedFake(FakeGenAIClient):
+    """Fake client whose first ``limited`` calls are answered with a 429"""
+
+    def __init__(self, limited: int, **kwargs):
+        super().__init__(**kwargs)
+        self.limited = limited
+        self.rate_limited = 0
+
+    def complete_call(self):
+        if self.rate_limited < self.limited:
+            self.rate_limited += 1
+            raise errors.ClientError(429, {"error": {"code": 429, "message": "fake quota", "status": "RESOURCE_EXHAUSTED"}})
+        super().complete_call()
+
+
+def fake_client(cls=FakeGenAIClient, **kwargs) -> FakeGenAIClient:
+    """A fake with fixed 50ms latency, so timings in tests are predictable"""
+    settings = {"text_latency_ms": 50, "image_latency_ms": 50, "latency_sigma": 0, "image_bytes": 1_000, "seed": 0}
+    return cls(**{**settings, **kwargs})
+
+
+@pytest.fixture
+def upstream(monkeypatch):
+    """Fresh breakers, queues and in-flight calls; install a fake with ``upstream(fake)``"""
+    monkeypatch.setattr(resilience, "BREAKERS", {})
+    monkeypatch.setattr(gemini_client, "scheduler", UpstreamScheduler())
+    monkeypatch.setattr(gemini_client, "upstream_calls", SingleFlight("gemini"))
+
+    def install(fake: FakeGenAIClient) -> FakeGenAIClient:
+        monkeypatch.setattr(gemini_client, "client", fake)
+        return fake
+
+    return install
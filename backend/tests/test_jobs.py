@@ -0,0 +1,194 @@
+import asyncio
+
+import pytest
+
+from conftest import IMAGE_MODEL, fake_client
+from utils import gemini_client, jobs
+from utils.jobs import (CANCELLED, FAILED, QUEUED, RUNNING, SUCCEEDED, JobQueue, MemoryJobStore, QueueFullError,
+                        SQLiteJobStore)
+
+
+@pytest.fixture(autouse=True)
+def fast_polling(monkeypatch):
+    monkeypatch.setattr(jobs, "CANCEL_POLL_S", 0.02)
+    monkeypatch.setattr(jobs, "HEARTBEAT_S", 0.05)
+    monkeypatch.setattr(jobs, "OWNER_TIMEOUT_S", 0.15)
+
+
+def make_queue(store=None, workers: int = 2, max_depth: int = 10) -> JobQueue:
+    return JobQueue("test", store or MemoryJobStore(), workers=workers, max_depth=max_depth, ttl_s=60)
+
+
+async def blocked(started: asyncio.Event | None = None):
+    if started is not None:
+        started.set()
+    await asyncio.sleep(10)
+
+
+def test_job_runs_through_the_fake_client(upstream):
+    fake = upstream(fake_client())
+
+    async def render():
+        response = await gemini_client.generate_content(IMAGE_MODEL, "render")
+        return {"image_bytes": len(gemini_client.response_image(response)[0])}
+
+    async def main():
+        queue = make_queue()
+        await queue.start()
+        try:
+            job = await queue.submit("tryon", render)
+            assert job["status"] == QUEUED
+            return await queue.get(job["id"], wait_s=2)
+        finally:
+            await queue.stop()
+
+    job = asyncio.run(main())
+    assert job["status"] == SUCCEEDED
+    assert job["result"] == {"image_bytes": len(fake.image)}
+
+
+def test_failed_job_records_the_error():
+    async def broken():
+        raise ValueError("bad garment image")
+
+    async def main():
+        queue = make_queue()
+        await queue.start()
+        try:
+            job = await queue.submit("tryon", broken)
+            return await queue.get(job["id"], wait_s=2), queue.stats()
+        finally:
+            await queue.stop()
+
+    job, stats = asyncio.run(main())
+    assert job["status"] == FAILED and job["error"] == "bad garment image"
+    assert stats["failed"] == 1
+
+
+def test_full_queue_rejects_new_jobs():
+    async def main():
+        queue = make_queue(workers=1, max_depth=2)
+        await queue.start()
+        try:
+            await queue.submit("tryon", blocked)
+            await queue.submit("tryon", blocked)
+            with pytest.raises(QueueFullError):
+                await queue.submit("tryon", blocked)
+            return queue.stats()["rejected"]
+        finally:
+            await queue.stop()
+
+    assert asyncio.run(main()) == 1
+
+
+def test_cancelling_a_running_job_cancels_its_task():
+    async def main():
+        queue = make_queue()
+        await queue.start()
+        try:
+            started = asyncio.Event()
+            job = await queue.submit("tryon", lambda: blocked(started))
+            await asyncio.wait_for(started.wait(), 1)
+            cancelled = await asyncio.wait_for(queue.cancel(job["id"]), 1)
+            return cancelled, queue.stats()
+        finally:
+            await queue.stop()
+
+    job, stats = asyncio.run(main())
+    assert job["status"] == CANCELLED
+    assert stats["cancelled"] == 1 and stats["running"] == 0
+
+
+def test_cancelled_queued_job_never_runs():
+    runs = []
+
+    async def record():
+        runs.append("ran")
+
+    async def main():
+        queue = make_queue(workers=1)
+        await queue.start()
+        try:
+            started = asyncio.Event()
+            first = await queue.submit("tryon", lambda: blocked(started))
+            await asyncio.wait_for(started.wait(), 1)
+            second = await queue.submit("tryon", record)
+            cancelled = await queue.cancel(second["id"])
+            await queue.cancel(first["id"])
+            await asyncio.sleep(0.05)
+            return cancelled, await queue.get(second["id"])
+        finally:
+            await queue.stop()
+
+    cancelled, later = asyncio.run(main())
+    assert cancelled["status"] == CANCELLED and later["status"] == CANCELLED
+    assert runs == []
+
+
+def test_finished_job_cannot_be_cancelled():
+    async def done():
+        return {"ok": True}
+
+    async def main():
+        queue = make_queue()
+        await queue.start()
+        try:
+            job = await queue.submit("tryon", done)
+            await queue.get(job["id"], wait_s=1)
+            return await queue.cancel(job["id"])
+        finally:
+            await queue.stop()
+
+    assert asyncio.run(main())["status"] == SUCCEEDED
+
+
+def test_cancel_through_another_worker_stops_the_owner(tmp_path):
+    async def main():
+        owner = make_queue(SQLiteJobStore(tmp_path / "jobs.sqlite3"))
+        sibling = make_queue(SQLiteJobStore(tmp_path / "jobs.sqlite3"))
+        await owner.start()
+        await sibling.start()
+        try:
+            started = asyncio.Event()
+            job = await owner.submit("tryon", lambda: blocked(started))
+            await asyncio.wait_for(started.wait(), 1)
+            # The sibling has no task for the job; it records the cancellation
+            await sibling.cancel(job["id"])
+            await asyncio.sleep(0.1)  # a few cancellation polls
+            return await sibling.get(job["id"]), owner.stats()
+        finally:
+            await owner.stop()
+            await sibling.stop()
+
+    job, stats = asyncio.run(main())
+    assert job["status"] == CANCELLED
+    assert stats["running"] == 0
+
+
+def test_jobs_of_a_dead_owner_are_failed_and_live_ones_kept(tmp_path):
+    async def main():
+        crashed = make_queue(SQLiteJobStore(tmp_path / "jobs.sqlite3"))
+        survivor = make_queue(SQLiteJobStore(tmp_path / "jobs.sqlite3"))
+        await crashed.start()
+        await survivor.start()
+        try:
+            started = asyncio.Event()
+            orphan = await crashed.submit("tryon", lambda: blocked(started))
+            await asyncio.wait_for(started.wait(), 1)
+            survivor_started = asyncio.Event()
+            kept = await survivor.submit("tryon", lambda: blocked(survivor_started))
+            await asyncio.wait_for(survivor_started.wait(), 1)
+
+            # Stopping the workers leaves the job running in the store, like a crash
+            await crashed.stop()
+            assert (await survivor.get(orphan["id"]))["status"] == RUNNING
+            # The survivor keeps heartbeating, so only the crashed owner goes stale
+            await asyncio.sleep(0.4)
+            return await survivor.get(orphan["id"]), await survivor.get(kept["id"])
+        finally:
+            await survivor.stop()
+
+    orphan, kept = asyncio.run(main())
+    assert orphan["status"] == FAILED
+    assert orphan["error"] == "Interrupted by a server restart"
+    assert kept["status"] == RUNNING
@@ -0,0 +1,138 @@
+import asyncio
+import time
+
+import pytest
+from google.genai import errors
+
+from conftest import IMAGE_MODEL, TEXT_MODEL, fake_client
+from utils import gemini_client, resilience
+from utils.resilience import (CLOSED, HALF_OPEN, OPEN, CircuitBreaker, CircuitOpenError, UpstreamTimeout,
+                              breaker_for, request_deadline)
+
+
+def open_breaker(reset_after_s: float = 0.05) -> CircuitBreaker:
+    breaker = CircuitBreaker("test", failure_threshold=2, reset_after_s=reset_after_s)
+    breaker.record_failure()
+    breaker.record_failure()
+    return breaker
+
+
+def test_breaker_opens_after_consecutive_failures():
+    breaker = CircuitBreaker("test", failure_threshold=3, reset_after_s=30)
+    breaker.record_failure()
+    breaker.record_failure()
+    breaker.record_success()  # resets the streak
+    breaker.record_failure()
+    breaker.record_failure()
+    assert breaker.state == CLOSED
+    breaker.record_failure()
+    assert breaker.state == OPEN
+    with pytest.raises(CircuitOpenError) as raised:
+        breaker.before_call()
+    assert raised.value.retry_after_s == pytest.approx(30, abs=1)
+    assert breaker.stats()["rejected"] == 1
+
+
+def test_half_open_lets_a_single_probe_through():
+    breaker = open_breaker()
+    time.sleep(0.06)
+    breaker.before_call()
+    assert breaker.state == HALF_OPEN
+    with pytest.raises(CircuitOpenError):
+        breaker.before_call()
+    breaker.record_success()
+    assert breaker.state == CLOSED
+    breaker.before_call()
+
+
+def test_failed_probe_reopens_the_circuit():
+    breaker = open_breaker()
+    time.sleep(0.06)
+    breaker.before_call()
+    breaker.record_failure()
+    assert breaker.state == OPEN
+    with pytest.raises(CircuitOpenError):
+        breaker.before_call()
+
+
+def test_abandoned_probe_frees_the_probe_slot():
+    breaker = open_breaker()
+    time.sleep(0.06)
+    breaker.before_call()
+    breaker.abandon_call()
+    assert breaker.state == HALF_OPEN
+    breaker.before_call()
+
+
+def test_upstream_errors_open_the_circuit_and_stop_calls(upstream, monkeypatch):
+    monkeypatch.setattr(resilience, "CircuitBreaker",
+                        lambda name: CircuitBreaker(name, failure_threshold=3, reset_after_s=30))
+    fake = upstream(fake_client(error_rate=1.0))
+
+    async def main():
+        outcomes = []
+        for _ in range(5):
+            try:
+                await gemini_client.generate_content(IMAGE_MODEL, "render")
+            except Exception as e:
+                outcomes.append(type(e))
+        return outcomes
+
+    outcomes = asyncio.run(main())
+    assert outcomes == [errors.ServerError] * 3 + [CircuitOpenError] * 2
+    assert fake.calls == 3
+    assert breaker_for(IMAGE_MODEL).state == OPEN
+
+
+def test_transient_text_errors_are_retried(upstream, monkeypatch):
+    monkeypatch.setattr(resilience, "TEXT_RETRIES", 2)
+    fake = upstream(fake_client(error_rate=0.5, seed=3))
+
+    async def main():
+        return await gemini_client.generate_content(TEXT_MODEL, "hello")
+
+    assert asyncio.run(main()).text
+    assert fake.errors >= 1 and fake.calls == fake.errors + 1
+    assert breaker_for(TEXT_MODEL).state == CLOSED
+
+
+def test_client_errors_do_not_count_against_the_circuit(upstream):
+    class Rejecting:
+        async def generate_content(self, model, contents, config=None):
+            raise errors.ClientError(400, {"error": {"code": 400, "message": "bad request", "status": "INVALID_ARGUMENT"}})
+
+    fake = upstream(fake_client())
+    fake.aio.models = Rejecting()
+
+    async def main():
+        for _ in range(resilience.FAILURE_THRESHOLD + 1):
+            with pytest.raises(errors.ClientError):
+                await gemini_client.generate_content(TEXT_MODEL, "hello")
+
+    asyncio.run(main())
+    assert breaker_for(TEXT_MODEL).state == CLOSED
+
+
+def test_deadline_bounds_the_call_and_counts_as_a_failure(upstream):
+    upstream(fake_client(image_latency_ms=500))
+
+    async def main():
+        started = time.monotonic()
+        with request_deadline(0.1), pytest.raises(UpstreamTimeout):
+            await gemini_client.generate_content(IMAGE_MODEL, "render")
+        return time.monotonic() - started
+
+    assert asyncio.run(main()) < 0.3
+    assert breaker_for(IMAGE_MODEL).failures == 1
+
+
+def test_spent_deadline_fails_before_calling(upstream):
+    fake = upstream(fake_client())
+
+    async def main():
+        with request_deadline(0), pytest.raises(UpstreamTimeout):
+            await gemini_client.generate_content(TEXT_MODEL, "hello")
+
+    asyncio.run(main())
+    assert fake.calls == 0
+    assert breaker_for(TEXT_MODEL).failures == 0
@@ -0,0 +1,142 @@
+import asyncio
+import time
+
+import pytest
+
+from conftest import TEXT_MODEL, RateLimitedFake, fake_client
+from utils import gemini_client
+from utils.resilience import CLOSED, QueueTimeout, breaker_for
+from utils.scheduler import BACKGROUND, INTERACTIVE, PAIRING, ModelQueue, priority
+
+
+def test_token_bucket_allows_burst_then_paces_at_rpm():
+    async def main():
+        queue = ModelQueue("m", max_in_flight=10, rpm=600, burst=2)  # one token every 0.1s
+        started = time.monotonic()
+        grants = []
+        for _ in range(4):
+            await queue.acquire(INTERACTIVE, timeout=5)
+            grants.append(time.monotonic() - started)
+        return grants
+
+    grants = asyncio.run(main())
+    assert grants[1] < 0.05  # the burst is served at once
+    assert grants[2] == pytest.approx(0.1, abs=0.05)
+    assert grants[3] == pytest.approx(0.2, abs=0.05)
+
+
+def test_concurrency_cap_holds_calls_until_release():
+    async def main():
+        queue = ModelQueue("m", max_in_flight=1)
+        await queue.acquire(INTERACTIVE, timeout=5)
+        waiter = asyncio.create_task(queue.acquire(INTERACTIVE, timeout=5))
+        await asyncio.sleep(0.05)
+        assert not waiter.done()
+        assert queue.stats()["queued"]["interactive"] == 1
+        queue.release()
+        await asyncio.wait_for(waiter, 1)
+        assert queue.in_flight == 1
+
+    asyncio.run(main())
+
+
+def test_waiters_are_granted_in_priority_order():
+    async def main():
+        queue = ModelQueue("m", max_in_flight=1)
+        await queue.acquire(INTERACTIVE, timeout=5)
+        order = []
+
+        async def wait(level, label):
+            await queue.acquire(level, timeout=5)
+            order.append(label)
+            queue.release()
+
+        # Queued lowest class first; the interactive call still goes first
+        tasks = []
+        for level, label in [(BACKGROUND, "background"), (PAIRING, "pairing"), (INTERACTIVE, "interactive"),
+                             (BACKGROUND, "background-2")]:
+            tasks.append(asyncio.create_task(wait(level, label)))
+            await asyncio.sleep(0.01)
+        queue.release()
+        await asyncio.gather(*tasks)
+        return order
+
+    assert asyncio.run(main()) == ["interactive", "pairing", "background", "background-2"]
+
+
+def test_wait_beyond_deadline_is_rejected_without_queueing():
+    async def main():
+        queue = ModelQueue("m", max_in_flight=10, rpm=60, burst=1)  # next token in 1s
+        await queue.acquire(INTERACTIVE, timeout=5)
+        started = time.monotonic()
+        with pytest.raises(QueueTimeout):
+            await queue.acquire(INTERACTIVE, timeout=0.2)
+        assert time.monotonic() - started < 0.05
+        assert queue.stats()["rejected"] == 1
+        assert queue.queued() == 0
+
+    asyncio.run(main())
+
+
+def test_cancelled_waiter_leaves_the_queue():
+    async def main():
+        queue = ModelQueue("m", max_in_flight=1)
+        await queue.acquire(INTERACTIVE, timeout=5)
+        waiter = asyncio.create_task(queue.acquire(INTERACTIVE, timeout=5))
+        await asyncio.sleep(0.01)
+        waiter.cancel()
+        await asyncio.gather(waiter, return_exceptions=True)
+        queue.release()
+        # The abandoned waiter must not hold the slot it was never given
+        assert queue.in_flight == 0
+        await asyncio.wait_for(queue.acquire(INTERACTIVE, timeout=5), 1)
+
+    asyncio.run(main())
+
+
+def test_throttle_pauses_the_queue_and_empties_the_bucket():
+    async def main():
+        queue = ModelQueue("m", max_in_flight=10, rpm=600, burst=5)
+        queue.throttle(pause_s=0.2)
+        assert queue.tokens == 0
+        started = time.monotonic()
+        await queue.acquire(INTERACTIVE, timeout=5)
+        return time.monotonic() - started, queue.stats()["throttled"]
+
+    waited, throttled = asyncio.run(main())
+    assert waited >= 0.2
+    assert throttled == 1
+
+
+def test_429_throttles_the_model_and_is_retried_through_the_queue(upstream):
+    fake = upstream(fake_client(RateLimitedFake, limited=1))
+
+    async def main():
+        started = time.monotonic()
+        response = await gemini_client.generate_content(TEXT_MODEL, "hello")
+        return response, time.monotonic() - started
+
+    response, elapsed = asyncio.run(main())
+    assert response.text
+    assert fake.rate_limited == 1 and fake.calls == 1
+    stats = gemini_client.scheduler.queue(TEXT_MODEL).stats()
+    assert stats["throttled"] == 1
+    assert stats["in_flight"] == 0
+    # The retry waited out the pause instead of hitting the model again at once
+    assert elapsed >= 0.2
+    # Quota pushback is not an outage
+    assert breaker_for(TEXT_MODEL).state == CLOSED
+    assert breaker_for(TEXT_MODEL).failures == 0
+
+
+def test_slot_uses_the_priority_of_the_calling_context(upstream):
+    upstream(fake_client())
+
+    async def main():
+        with priority(BACKGROUND):
+            await gemini_client.generate_content(TEXT_MODEL, "background")
+        await gemini_client.generate_content(TEXT_MODEL, "interactive")
+
+    asyncio.run(main())
+    granted = gemini_client.scheduler.queue(TEXT_MODEL).stats()["granted"]
+    assert granted == {"interactive": 1, "pairing": 0, "background": 1}
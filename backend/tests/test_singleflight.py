@@ -0,0 +1,153 @@
+import asyncio
+
+import pytest
+
+from conftest import TEXT_MODEL, fake_client
+from utils import gemini_client
+from utils.resilience import UpstreamTimeout, request_deadline
+from utils.scheduler import BACKGROUND, priority
+from utils.singleflight import SingleFlight
+
+
+def test_concurrent_identical_calls_share_one_upstream_call(upstream):
+    fake = upstream(fake_client())
+
+    async def main():
+        return await asyncio.gather(*(gemini_client.generate_content(TEXT_MODEL, "same prompt") for _ in range(5)))
+
+    responses = asyncio.run(main())
+    assert fake.calls == 1
+    assert all(response is responses[0] for response in responses)
+    stats = gemini_client.upstream_calls.stats()
+    assert stats["collapsed"] == 4 and stats["in_flight"] == 0
+
+
+def test_different_calls_are_not_shared(upstream):
+    fake = upstream(fake_client())
+
+    async def main():
+        await asyncio.gather(gemini_client.generate_content(TEXT_MODEL, "one"),
+                             gemini_client.generate_content(TEXT_MODEL, "two"),
+                             gemini_client.generate_content(TEXT_MODEL, "one", coalesce=False))
+
+    asyncio.run(main())
+    assert fake.calls == 3
+
+
+def test_calls_at_different_priorities_are_not_shared(upstream):
+    fake = upstream(fake_client())
+
+    async def background():
+        with priority(BACKGROUND):
+            return await gemini_client.generate_content(TEXT_MODEL, "same prompt")
+
+    async def main():
+        await asyncio.gather(gemini_client.generate_content(TEXT_MODEL, "same prompt"), background())
+
+    asyncio.run(main())
+    assert fake.calls == 2
+
+
+def test_errors_are_shared_with_every_waiter():
+    flight = SingleFlight("test")
+    runs = 0
+
+    async def failing():
+        nonlocal runs
+        runs += 1
+        await asyncio.sleep(0.02)
+        raise ValueError("boom")
+
+    async def main():
+        return await asyncio.gather(*(flight.do("key", failing) for _ in range(3)), return_exceptions=True)
+
+    results = asyncio.run(main())
+    assert runs == 1
+    assert all(isinstance(result, ValueError) for result in results)
+
+
+def test_cancelled_caller_does_not_cancel_the_call_for_others():
+    flight = SingleFlight("test")
+    runs = 0
+
+    async def call():
+        nonlocal runs
+        runs += 1
+        await asyncio.sleep(0.05)
+        return "done"
+
+    async def main():
+        first = asyncio.create_task(flight.do("key", call))
+        second = asyncio.create_task(flight.do("key", call))
+        await asyncio.sleep(0.01)
+        first.cancel()
+        with pytest.raises(asyncio.CancelledError):
+            await first
+        return await second
+
+    assert asyncio.run(main()) == "done"
+    assert runs == 1
+
+
+def test_call_is_cancelled_once_every_caller_has_gone():
+    flight = SingleFlight("test")
+
+    async def main():
+        stopped = asyncio.Event()
+
+        async def call():
+            try:
+                await asyncio.sleep(10)
+            except asyncio.CancelledError:
+                stopped.set()
+                raise
+
+        callers = [asyncio.create_task(flight.do("key", call)) for _ in range(2)]
+        await asyncio.sleep(0.01)
+        for caller in callers:
+            caller.cancel()
+        await asyncio.gather(*callers, return_exceptions=True)
+        await asyncio.wait_for(stopped.wait(), 1)
+        await asyncio.sleep(0)
+        return flight.stats()["in_flight"]
+
+    assert asyncio.run(main()) == 0
+
+
+def test_joiner_with_a_longer_deadline_reruns_after_the_starter_times_out(upstream):
+    fake = upstream(fake_client(text_latency_ms=200))
+
+    async def caller(budget_s: float):
+        with request_deadline(budget_s):
+            return await gemini_client.generate_content(TEXT_MODEL, "same prompt")
+
+    async def main():
+        short = asyncio.create_task(caller(0.05))
+        await asyncio.sleep(0.01)
+        long = asyncio.create_task(caller(5))
+        with pytest.raises(UpstreamTimeout):
+            await short
+        return await long
+
+    assert asyncio.run(main()).text
+    assert fake.calls == 1  # the timed-out run never completed upstream
+    assert gemini_client.upstream_calls.stats()["reruns"] == 1
+
+
+def test_joiner_does_not_rerun_when_its_own_deadline_is_spent(upstream):
+    upstream(fake_client(text_latency_ms=200))
+
+    async def caller(budget_s: float):
+        with request_deadline(budget_s):
+            return await gemini_client.generate_content(TEXT_MODEL, "same prompt")
+
+    async def main():
+        first = asyncio.create_task(caller(0.1))
+        await asyncio.sleep(0.01)
+        # Joins with a deadline that runs out before the shared call fails
+        second = asyncio.create_task(caller(0.05))
+        return await asyncio.gather(first, second, return_exceptions=True)
+
+    results = asyncio.run(main())
+    assert all(isinstance(result, UpstreamTimeout) for result in results)
+    assert gemini_client.upstream_calls.stats()["reruns"] == 0
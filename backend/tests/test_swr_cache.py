@@ -0,0 +1,131 @@
+import asyncio
+
+from conftest import TEXT_MODEL, fake_client
+from utils import gemini_client
+from utils.result_store import SQLiteResultStore
+from utils.swr_cache import StaleWhileRevalidateCache, request_key
+
+
+def make_cache(fresh_ttl_s: float = 0.05, stale_ttl_s: float = 10) -> StaleWhileRevalidateCache:
+    cache = StaleWhileRevalidateCache("test", fresh_ttl_s=fresh_ttl_s, stale_ttl_s=stale_ttl_s, max_entries=10)
+    cache.shared = None
+    return cache
+
+
+def test_request_key_ignores_case_spacing_and_dict_order():
+    assert request_key("Wedding  Guest", {"b": 1, "A": 2}) == request_key("wedding guest", {"a": 2, "b": 1})
+    assert request_key("wedding") != request_key("funeral")
+
+
+def test_fresh_hit_does_not_refresh():
+    cache = make_cache(fresh_ttl_s=10)
+    refreshes = 0
+
+    async def refresh():
+        nonlocal refreshes
+        refreshes += 1
+        return "new"
+
+    async def main():
+        await cache.put("key", "old")
+        return await cache.lookup("key", refresh)
+
+    assert asyncio.run(main()) == "old"
+    assert refreshes == 0
+    assert cache.stats()["hits"] == 1
+
+
+def test_stale_hit_serves_old_value_and_refreshes_once_in_the_background(upstream):
+    fake = upstream(fake_client())
+    cache = make_cache(fresh_ttl_s=0.2)
+
+    async def refresh():
+        response = await gemini_client.generate_content(TEXT_MODEL, "refresh")
+        return response.text
+
+    async def main():
+        await cache.put("key", "old")
+        await asyncio.sleep(0.21)
+        served = [await cache.lookup("key", refresh) for _ in range(3)]
+        assert cache.stats()["refreshing"] == 1
+        await asyncio.sleep(0.1)  # the fake answers in 50ms
+        return served, await cache.lookup("key", refresh)
+
+    served, after = asyncio.run(main())
+    assert served == ["old"] * 3
+    assert after == fake.text
+    assert fake.calls == 1
+    assert cache.stats()["stale_hits"] == 3
+    # Nobody waits on a refresh, so it runs in the background class
+    assert gemini_client.scheduler.queue(TEXT_MODEL).stats()["granted"]["background"] == 1
+
+
+def test_failed_refresh_keeps_serving_the_stale_value(upstream):
+    upstream(fake_client(error_rate=1.0))
+    cache = make_cache()
+
+    async def refresh():
+        response = await gemini_client.generate_content(TEXT_MODEL, "refresh")
+        return response.text
+
+    async def main():
+        await cache.put("key", "old")
+        await asyncio.sleep(0.06)
+        first = await cache.lookup("key", refresh)
+        await asyncio.sleep(0.3)
+        return first, await cache.lookup("key", refresh)
+
+    assert asyncio.run(main()) == ("old", "old")
+    assert cache.stats()["refresh_failures"] == 1
+
+
+def test_entries_past_the_stale_window_are_misses():
+    cache = make_cache(fresh_ttl_s=0.02, stale_ttl_s=0.02)
+
+    async def main():
+        await cache.put("key", "old")
+        await asyncio.sleep(0.05)
+        return await cache.get_or_compute("key", lambda: asyncio.sleep(0, "computed"))
+
+    assert asyncio.run(main()) == "computed"
+    assert cache.stats()["misses"] == 1
+
+
+def test_least_recently_used_entry_is_evicted():
+    cache = make_cache(fresh_ttl_s=10)
+    cache.max_entries = 2
+
+    async def main():
+        await cache.put("a", 1)
+        await cache.put("b", 2)
+        await cache.lookup("a")
+        await cache.put("c", 3)
+        return [await cache.lookup(key) for key in ("a", "b", "c")]
+
+    assert asyncio.run(main()) == [1, None, 3]
+
+
+def test_workers_share_entries_and_adopt_each_others_refreshes(tmp_path):
+    store = SQLiteResultStore(tmp_path / "results.sqlite3")
+    worker_a, worker_b = make_cache(), make_cache()
+    worker_a.shared = worker_b.shared = store
+    refreshes = 0
+
+    async def refresh():
+        nonlocal refreshes
+        refreshes += 1
+        return "refreshed by b"
+
+    async def main():
+        await worker_a.put("key", "old")
+        assert await worker_b.lookup("key") == "old"
+        await asyncio.sleep(0.06)
+        # A refreshes first; B's own refresh finds the fresh shared entry
+        await worker_a.put("key", "refreshed by a")
+        assert await worker_b.lookup("key", refresh) == "old"
+        await asyncio.sleep(0.01)
+        return await worker_b.lookup("key")
+
+    assert asyncio.run(main()) == "refreshed by a"
+    assert refreshes == 0
+    assert worker_b.stats()["shared_hits"] == 1
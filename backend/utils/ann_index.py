@@ -0,0 +1,114 @@
+"""Inverted-file (IVF) approximate nearest-neighbour index over unit vectors.
+
+Vectors are partitioned by spherical k-means into ``nlist`` cells. A query is
+compared with the cell centroids, and only the vectors of the ``nprobe``
+closest cells are scored exactly. The index never copies the vector matrix,
+so it can sit on top of a read-only memory-mapped feature store. Its trained
+cells (``lists()``) can be saved and passed back in to skip training.
+"""
+import numpy as np
+
+# Below this many vectors an exhaustive scan is faster than probing cells
+EXACT_SEARCH_LIMIT = 20_000
+# Rows scored per matrix multiply while assigning vectors to cells
+ASSIGN_CHUNK = 16_384
+
+
+def _nearest_centroids(vectors: np.ndarray, centroids: np.ndarray, rows: np.ndarray | None = None) -> np.ndarray:
+    count = len(vectors) if rows is None else len(rows)
+    assignments = np.empty(count, dtype=np.int32)
+    for start in range(0, count, ASSIGN_CHUNK):
+        stop = min(start + ASSIGN_CHUNK, count)
+        chunk = vectors[start:stop] if rows is None else vectors[rows[start:stop]]
+        assignments[start:stop] = np.argmax(np.asarray(chunk, dtype=np.float32) @ centroids.T, axis=1)
+    return assignments
+
+
+def spherical_kmeans(sample: np.ndarray, k: int, iterations: int = 10, seed: int = 0) -> np.ndarray:
+    """Cluster unit vectors by cosine similarity and return unit-length centroids"""
+    rng = np.random.default_rng(seed)
+    centroids = sample[rng.choice(len(sample), size=k, replace=False)].astype(np.float32)
+    for _ in range(iterations):
+        assignments = _nearest_centroids(sample, centroids)
+        order = np.argsort(assignments, kind="stable")
+        counts = np.bincount(assignments, minlength=k)
+        filled = np.flatnonzero(counts)
+        starts = np.concatenate(([0], np.cumsum(counts)[:-1]))[filled]
+        centroids[filled] = np.add.reduceat(sample[order], starts, axis=0)
+        # Re-seed empty cells from random points so no cell stays unused
+        empty = np.flatnonzero(counts == 0)
+        if len(empty):
+            centroids[empty] = sample[rng.choice(len(sample), size=len(empty), replace=False)]
+        norms = np.linalg.norm(centroids, axis=1, keepdims=True)
+        centroids /= np.where(norms == 0, 1, norms)
+    return centroids
+
+
+class IVFIndex:
+    """Maximum inner-product search over the rows of a unit-vector matrix.
+
+    ``rows`` restricts the index to a subset of the matrix (for example the
+    rows an interrupted extraction run has finished) without copying it.
+    ``lists`` is a (centroids, list ids, offsets) triple from ``lists()`` of
+    an index over the same vectors and rows; training is skipped.
+    """
+
+    def __init__(self, vectors: np.ndarray, nlist: int | None = None, nprobe: int = 16,
+                 train_size: int = 65_536, seed: int = 0, rows: np.ndarray | None = None,
+                 lists: tuple[np.ndarray, np.ndarray, np.ndarray] | None = None):
+        self.vectors = vectors
+        self.rows = None if rows is None else np.asarray(rows, dtype=np.int64)
+        self.nprobe = nprobe
+        count = len(vectors) if rows is None else len(self.rows)
+
+        if count <= EXACT_SEARCH_LIMIT:
+            self.centroids = None
+            return
+        if lists is not None:
+            self.centroids, self.list_ids, self.offsets = lists
+            return
+
+        nlist = nlist or int(2 * np.sqrt(count))
+        rng = np.random.default_rng(seed)
+        sample = np.sort(rng.choice(count, size=min(count, max(train_size, nlist * 32)), replace=False))
+        if self.rows is not None:
+            sample = self.rows[sample]
+        self.centroids = spherical_kmeans(np.asarray(vectors[sample], dtype=np.float32), nlist, seed=seed)
+
+        assignments = _nearest_centroids(vectors, self.centroids, self.rows)
+        # Row ids grouped by cell, ascending inside each cell for sequential reads
+        self.list_ids = np.argsort(assignments, kind="stable").astype(np.int64)
+        if self.rows is not None:
+            self.list_ids = self.rows[self.list_ids]
+        self.offsets = np.concatenate(([0], np.cumsum(np.bincount(assignments, minlength=nlist))))
+
+    def __len__(self) -> int:
+        return len(self.vectors) if self.rows is None else len(self.rows)
+
+    def lists(self) -> tuple[np.ndarray, np.ndarray, np.ndarray] | None:
+        """The trained (centroids, list ids, offsets), or None for an exhaustive index"""
+        if self.centroids is None:
+            return None
+        return self.centroids, self.list_ids, self.offsets
+
+    def _candidates(self, query: np.ndarray, nprobe: int) -> np.ndarray:
+        nprobe = min(nprobe, len(self.centroids))
+        cells = np.argpartition(-(self.centroids @ query), nprobe - 1)[:nprobe]
+        return np.sort(np.concatenate([self.list_ids[self.offsets[c]:self.offsets[c + 1]] for c in cells]))
+
+    def search(self, query: np.ndarray, k: int = 10, nprobe: int | None = None) -> tuple[np.ndarray, np.ndarray]:
+        """Return (row ids, inner-product scores) of the k best rows, best first"""
+        query = np.asarray(query, dtype=np.float32)
+        if self.centroids is None:
+            ids = self.rows
+            scores = np.asarray(self.vectors if ids is None else self.vectors[ids], dtype=np.float32) @ query
+        else:
+            ids = self._candidates(query, nprobe or self.nprobe)
+            scores = np.asarray(self.vectors[ids], dtype=np.float32) @ query
+
+        k = min(k, len(scores))
+        if k <= 0:
+            return np.empty(0, dtype=np.int64), np.empty(0, dtype=np.float32)
+        top = np.argpartition(-scores, k - 1)[:k]
+        top = top[np.argsort(-scores[top])]
+        return (top if ids is None else ids[top]), scores[top]
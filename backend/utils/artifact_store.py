@@ -0,0 +1,110 @@
+"""Content-addressed store for generated images, served by routers/artifacts.py.
+
+Responses reference generated images by URL instead of embedding them as
+base64 data URLs, which keeps JSON payloads small and lets browsers and CDNs
+cache the images. Set INLINE_IMAGE_RESPONSES=true to keep the old data URLs.
+
+Only PNG, JPEG and WebP are stored; images of other types are returned
+inline by image_reference(). A periodic sweep deletes artifacts not saved
+again for ``ARTIFACT_TTL_S``, then the oldest ones until the directory is
+under ``ARTIFACT_MAX_MB``. Saving an existing artifact refreshes its age,
+so images still being generated stay stored.
+"""
+import asyncio
+import base64
+import hashlib
+import os
+import re
+import time
+import uuid
+from pathlib import Path
+
+from fastapi import Request
+
+ARTIFACT_DIR = Path(os.getenv("ARTIFACT_DIR", "data/artifacts"))
+INLINE_IMAGE_RESPONSES = os.getenv("INLINE_IMAGE_RESPONSES", "false").lower() in ("1", "true", "yes")
+ARTIFACT_TTL_S = float(os.getenv("ARTIFACT_TTL_S", str(7 * 24 * 3600)))
+ARTIFACT_MAX_BYTES = int(float(os.getenv("ARTIFACT_MAX_MB", "2048")) * 1024 * 1024)
+ARTIFACT_SWEEP_S = float(os.getenv("ARTIFACT_SWEEP_S", "600"))
+
+EXTENSIONS = {"image/png": "png", "image/jpeg": "jpg", "image/webp": "webp"}
+MIME_TYPES = {extension: mime_type for mime_type, extension in EXTENSIONS.items()}
+ARTIFACT_NAME = re.compile(r"^([0-9a-f]{64})\.(png|jpg|webp)$")
+
+
+def artifact_path(name: str) -> Path | None:
+    """Location of a stored artifact, or None for names that are not artifact ids"""
+    match = ARTIFACT_NAME.match(name)
+    if not match:
+        return None
+    return ARTIFACT_DIR / match.group(1)[:2] / name
+
+
+def _write(path: Path, data: bytes):
+    try:
+        # Already stored: mark it recently used so the sweep keeps it
+        os.utime(path)
+        return
+    except FileNotFoundError:
+        pass
+    path.parent.mkdir(parents=True, exist_ok=True)
+    # Unique per writer: threads and workers may save the same content at once,
+    # and whichever rename lands last leaves identical bytes
+    tmp_path = path.with_suffix(f"{path.suffix}.{uuid.uuid4().hex}.tmp")
+    try:
+        tmp_path.write_bytes(data)
+        os.replace(tmp_path, path)
+    finally:
+        tmp_path.unlink(missing_ok=True)
+
+
+async def save_artifact(data: bytes, mime_type: str) -> str:
+    """Store image bytes under their SHA-256 and return the artifact name"""
+    if mime_type not in EXTENSIONS:
+        raise ValueError(f"Cannot store artifacts of type {mime_type}")
+    name = f"{hashlib.sha256(data).hexdigest()}.{EXTENSIONS[mime_type]}"
+    await asyncio.to_thread(_write, artifact_path(name), data)
+    return name
+
+
+def sweep(now: float | None = None) -> int:
+    """Delete expired artifacts, then the oldest, until under the size limit; returns the count"""
+    now = time.time() if now is None else now
+    files = []
+    for path in ARTIFACT_DIR.glob("*/*"):
+        try:
+            stat = path.stat()
+        except FileNotFoundError:
+            continue
+        files.append((stat.st_mtime, stat.st_size, path))
+    files.sort()
+    total = sum(size for _, size, _ in files)
+    removed = 0
+    for mtime, size, path in files:
+        # Leftover temp files of interrupted writes age out the same way
+        if mtime >= now - ARTIFACT_TTL_S and total <= ARTIFACT_MAX_BYTES:
+            break
+        path.unlink(missing_ok=True)
+        total -= size
+        removed += 1
+    return removed
+
+
+async def sweeper():
+    """Run sweep() every ARTIFACT_SWEEP_S until cancelled"""
+    while True:
+        await asyncio.sleep(ARTIFACT_SWEEP_S)
+        try:
+            removed = await asyncio.to_thread(sweep)
+            if removed:
+                print(f"Removed {removed} expired artifacts")
+        except Exception as e:
+            print(f"Could not sweep artifacts: {e}")
+
+
+async def image_reference(request: Request, data: bytes, mime_type: str) -> str:
+    """URL of a generated image for a JSON response, or a data URL in inline mode"""
+    if INLINE_IMAGE_RESPONSES or mime_type not in EXTENSIONS:
+        return f"data:{mime_type};base64,{base64.b64encode(data).decode('utf-8')}"
+    name = await save_artifact(data, mime_type)
+    return str(request.url_for("get_artifact", name=name))
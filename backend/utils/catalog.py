@@ -0,0 +1,158 @@
+"""Product catalog with precomputed image features, searched through an IVF index.
+
+A catalog directory holds:
+
+- ``products.jsonl``: one product record per line with at least an ``id``,
+  plus display fields such as ``name``, ``brand``, ``price`` and ``image``.
+- ``features.npy``: float32 matrix with one feature vector per row, as
+  produced by ``similarity.feature_vectors``.
+- ``ids.txt`` (optional): the product id of each feature row. Without it
+  the rows follow the order of ``products.jsonl``.
+- ``done.npy`` (optional): per-row status written by
+  ``scripts/extract_features.py``; rows not marked done are left out.
+- ``feature_version.txt`` (optional): the descriptor version the features
+  were extracted with. A mismatch is served but logged, since queries are
+  described with the current version.
+- ``ivf_*.npy`` and ``ivf.json`` (optional): the trained IVF cells, written
+  by ``scripts/extract_features.py`` or by the first startup that trains
+  them. They are reused while the hash of ``features.npy`` and
+  ``done.npy`` recorded in ``ivf.json`` still matches, and rebuilt
+  otherwise.
+
+The feature matrix and the cell lists are memory-mapped read-only, so
+startup does not read them into memory and every worker process shares the
+same page cache.
+"""
+import hashlib
+import json
+import os
+import time
+from pathlib import Path
+
+import numpy as np
+
+from utils.ann_index import IVFIndex
+from utils.similarity import FEATURE_DIM, FEATURE_VERSION
+
+CATALOG_DIR = Path(os.getenv("CATALOG_DIR", "data/catalog"))
+CATALOG_NPROBE = int(os.getenv("CATALOG_NPROBE", "16"))
+
+INDEX_ARRAYS = ("centroids", "list_ids", "offsets")
+
+
+class Catalog:
+    """Product records aligned with the rows of a feature index"""
+
+    def __init__(self, products: list[dict], vectors: np.ndarray, nprobe: int = CATALOG_NPROBE,
+                 rows: np.ndarray | None = None, lists: tuple | None = None):
+        if len(products) != len(vectors):
+            raise ValueError(f"{len(products)} products but {len(vectors)} feature rows")
+        if len(vectors) and vectors.shape[1] != FEATURE_DIM:
+            raise ValueError(f"Feature rows have {vectors.shape[1]} dims, expected {FEATURE_DIM}")
+        self.products = products
+        self.index = IVFIndex(vectors, nprobe=nprobe, rows=rows, lists=lists)
+
+    def __len__(self) -> int:
+        return len(self.index)
+
+    def search(self, vector: np.ndarray, k: int = 6) -> list[tuple[dict, float]]:
+        """Return the k most similar products with their inner-product scores"""
+        rows, scores = self.index.search(vector, k)
+        return [(self.products[row], float(score)) for row, score in zip(rows, scores)]
+
+
+def read_catalog(directory: Path) -> Catalog:
+    """Load product records and their feature matrix from a catalog directory"""
+    records = {}
+    order = []
+    with open(directory / "products.jsonl", encoding="utf-8") as f:
+        for line in f:
+            if line.strip():
+                record = json.loads(line)
+                records[str(record["id"])] = record
+                order.append(str(record["id"]))
+
+    ids_path = directory / "ids.txt"
+    if ids_path.exists():
+        order = ids_path.read_text(encoding="utf-8").splitlines()
+
+    version_path = directory / "feature_version.txt"
+    version = int(version_path.read_text(encoding="utf-8")) if version_path.exists() else 1
+    if version != FEATURE_VERSION:
+        print(f"WARNING: catalog features are version {version}, queries use version {FEATURE_VERSION}; "
+              "re-run scripts/extract_features.py for full recall")
+
+    vectors = np.load(directory / "features.npy", mmap_mode="r")
+    products = [records.get(product_id, {"id": product_id}) for product_id in order]
+
+    rows = None
+    done_path = directory / "done.npy"
+    if done_path.exists():
+        done_rows = np.flatnonzero(np.load(done_path) == 1)
+        if len(done_rows) < len(vectors):
+            # Unfinished or failed extraction rows hold no usable vector
+            print(f"Indexing {len(done_rows)} of {len(vectors)} feature rows; the rest are unfinished or failed")
+            rows = done_rows
+
+    source_hash = features_hash(directory)
+    lists = load_index_lists(directory, source_hash)
+    catalog = Catalog(products, vectors, rows=rows, lists=lists)
+    if lists is None and catalog.index.lists() is not None:
+        try:
+            save_index_lists(directory, catalog.index, source_hash)
+        except OSError as e:
+            print(f"Could not save the catalog index to {directory}: {e}")
+    return catalog
+
+
+def features_hash(directory: Path) -> str:
+    """Hash of the feature rows and their status, which together fix the index"""
+    digest = hashlib.blake2b(digest_size=16)
+    for name in ("features.npy", "done.npy"):
+        path = directory / name
+        if path.exists():
+            with open(path, "rb") as f:
+                digest.update(hashlib.file_digest(f, "blake2b").digest())
+    return digest.hexdigest()
+
+
+def load_index_lists(directory: Path, source_hash: str) -> tuple | None:
+    """Saved IVF cells for these features, memory-mapped; None if missing or stale"""
+    try:
+        meta = json.loads((directory / "ivf.json").read_text(encoding="utf-8"))
+        if meta.get("features_hash") != source_hash:
+            print("Catalog features changed since the index was saved; rebuilding it")
+            return None
+        return tuple(np.load(directory / f"ivf_{name}.npy", mmap_mode="r") for name in INDEX_ARRAYS)
+    except (OSError, ValueError):
+        return None
+
+
+def save_index_lists(directory: Path, index: IVFIndex, source_hash: str):
+    """Write the trained IVF cells; ivf.json goes last because it marks them complete"""
+    for name, array in zip(INDEX_ARRAYS, index.lists()):
+        path = directory / f"ivf_{name}.npy"
+        tmp_path = path.with_suffix(f".{os.getpid()}.tmp")
+        with open(tmp_path, "wb") as f:
+            np.save(f, array)
+        os.replace(tmp_path, path)
+    meta_path = directory / "ivf.json"
+    tmp_path = meta_path.with_suffix(f".{os.getpid()}.tmp")
+    tmp_path.write_text(json.dumps({"features_hash": source_hash, "nlist": len(index.centroids)}), encoding="utf-8")
+    os.replace(tmp_path, meta_path)
+
+
+catalog: Catalog | None = None
+
+
+def load_catalog(directory: Path = CATALOG_DIR) -> Catalog | None:
+    """Load the catalog and build its index; called once at startup"""
+    global catalog
+    if not (directory / "products.jsonl").exists():
+        print(f"No product catalog found in {directory}; image search will return no matches")
+        return None
+
+    started = time.perf_counter()
+    catalog = read_catalog(directory)
+    print(f"Loaded {len(catalog)} catalog products in {time.perf_counter() - started:.1f}s")
+    return catalog
@@ -0,0 +1,204 @@
+"""Shared async access layer for the Gemini API used by every router."""
+import asyncio
+import hashlib
+import json
+import os
+import time
+from contextlib import contextmanager
+
+import httpx
+from dotenv import load_dotenv
+from google import genai
+from google.genai import types
+from pydantic import BaseModel
+
+from utils.metrics import UPSTREAM_CALLS, UPSTREAM_IN_FLIGHT, UPSTREAM_LATENCY
+from utils.resilience import (QueueTimeout, UpstreamNotConfigured, UpstreamTimeout, breaker_for, call_upstream,
+                              time_left, within_deadline)
+from utils.scheduler import UpstreamScheduler, current_priority
+from utils.singleflight import SingleFlight
+
+load_dotenv()
+
+TEXT_MODEL = "gemini-2.0-flash-exp"
+IMAGE_MODEL = "gemini-2.0-flash-exp-image-generation"
+
+# One pooled transport for all upstream traffic so connections are kept alive
+# between calls instead of paying a TLS handshake per request.
+MAX_CONNECTIONS = int(os.getenv("GEMINI_MAX_CONNECTIONS", "100"))
+MAX_KEEPALIVE_CONNECTIONS = int(os.getenv("GEMINI_MAX_KEEPALIVE_CONNECTIONS", "20"))
+KEEPALIVE_EXPIRY_S = float(os.getenv("GEMINI_KEEPALIVE_EXPIRY_S", "30"))
+
+# The one client every router shares. It is created on first use, so
+# importing the app stays cheap and a missing key fails only the calls that
+# need it, never startup.
+client: genai.Client | None = None
+
+
+def api_key() -> str | None:
+    return os.getenv("GEMINI_API_KEY") or os.getenv("GOOGLE_API_KEY")
+
+
+def is_configured() -> bool:
+    return client is not None or bool(api_key())
+
+
+def get_client() -> genai.Client:
+    """Return the shared client, creating it on first use"""
+    global client
+    if client is None:
+        key = api_key()
+        if not key:
+            raise UpstreamNotConfigured("GEMINI_API_KEY is not set")
+        started = time.perf_counter()
+        client = genai.Client(
+            api_key=key,
+            http_options=types.HttpOptions(
+                async_client_args={
+                    # Passing a transport also pins the SDK to httpx for async calls.
+                    "transport": httpx.AsyncHTTPTransport(
+                        limits=httpx.Limits(
+                            max_connections=MAX_CONNECTIONS,
+                            max_keepalive_connections=MAX_KEEPALIVE_CONNECTIONS,
+                            keepalive_expiry=KEEPALIVE_EXPIRY_S,
+                        )
+                    )
+                }
+            ),
+        )
+        print(f"Created Gemini client in {(time.perf_counter() - started) * 1000:.0f}ms")
+    return client
+
+# Per-model concurrency caps, token buckets and priority queues; see utils/scheduler.py
+scheduler = UpstreamScheduler()
+
+# Identical calls in flight at the same time share one upstream request
+upstream_calls = SingleFlight("gemini")
+
+
+def _canonical(value):
+    if isinstance(value, bytes):
+        # Inline images are identified by their hash, not their bytes
+        return {"sha256": hashlib.sha256(value).hexdigest()}
+    if isinstance(value, str):
+        return " ".join(value.split())
+    if isinstance(value, BaseModel):
+        return _canonical(value.model_dump(exclude_none=True))
+    if isinstance(value, dict):
+        return {str(k): _canonical(v) for k, v in value.items()}
+    if isinstance(value, (list, tuple)):
+        return [_canonical(v) for v in value]
+    return value
+
+
+def call_key(model: str, contents, config: types.GenerateContentConfig | None = None) -> str:
+    """Key identifying a call by model, whitespace-normalised prompts, input hashes and config"""
+    canonical = json.dumps(_canonical([model, contents, config]), sort_keys=True, default=str)
+    return hashlib.sha256(canonical.encode("utf-8")).hexdigest()
+
+
+@contextmanager
+def _observed(model: str):
+    """Record latency, outcome and in-flight count of one upstream call"""
+    UPSTREAM_IN_FLIGHT.inc(model)
+    start = time.perf_counter()
+    outcome = "error"
+    try:
+        yield
+        outcome = "ok"
+    except (asyncio.CancelledError, GeneratorExit):
+        # Timed out by the caller or abandoned mid-stream
+        outcome = "cancelled"
+        raise
+    finally:
+        UPSTREAM_IN_FLIGHT.dec(model)
+        UPSTREAM_LATENCY.observe(model, value=time.perf_counter() - start)
+        UPSTREAM_CALLS.inc(model, outcome)
+
+
+async def _generate(model: str, contents, config: types.GenerateContentConfig | None):
+    with _observed(model):
+        return await get_client().aio.models.generate_content(
+            model=model,
+            contents=contents,
+            config=config,
+        )
+
+
+def _is_text_call(model: str, config: types.GenerateContentConfig | None) -> bool:
+    """Text-only calls are cheap and safe to retry or hedge; image generations are not"""
+    modalities = [str(m).upper() for m in (config.response_modalities or [])] if config else []
+    return "image" not in model and not any("IMAGE" in m for m in modalities)
+
+
+async def generate_content(model: str, contents, config: types.GenerateContentConfig | None = None,
+                           coalesce: bool = True):
+    """Run a generate_content call on the async client without blocking the event loop.
+
+    Each call goes through the model's circuit breaker and the current
+    request deadline; text calls are also retried and optionally hedged.
+    Concurrent calls with the same call_key() share one upstream request
+    unless ``coalesce`` is False.
+
+    A shared call runs with the deadline and priority of the caller that
+    started it. Only calls at the same priority share, so an interactive
+    caller never waits in a background queue. A caller that joined with a
+    longer deadline than the starter's, and sees the shared call time out,
+    runs the call again under its own deadline.
+    """
+    get_client()  # fail fast, before any breaker or queue, when no key is set
+
+    async def resilient_call():
+        return await call_upstream(
+            model, lambda: _generate(model, contents, config), idempotent=_is_text_call(model, config),
+            acquire=lambda: scheduler.slot(model),
+        )
+
+    if not coalesce:
+        return await resilient_call()
+    key = f"{current_priority()}:{call_key(model, contents, config)}"
+    return await upstream_calls.do(
+        key, resilient_call, rerun_if=lambda e: isinstance(e, UpstreamTimeout) and time_left() > 0
+    )
+
+
+async def generate_content_stream(model: str, contents, config: types.GenerateContentConfig | None = None):
+    """Yield response chunks as the model produces them; holds a scheduler slot until done.
+
+    The circuit breaker applies and every chunk must arrive within the
+    current deadline, but a stream is never retried once it started.
+    """
+    upstream = get_client()
+    breaker = breaker_for(model)
+    breaker.before_call()
+    try:
+        async with scheduler.slot(model):
+            with _observed(model):
+                stream = await within_deadline(upstream.aio.models.generate_content_stream(
+                    model=model,
+                    contents=contents,
+                    config=config,
+                ), model)
+                chunks = aiter(stream)
+                while True:
+                    try:
+                        chunk = await within_deadline(anext(chunks), model)
+                    except StopAsyncIteration:
+                        break
+                    yield chunk
+    except (asyncio.CancelledError, GeneratorExit, QueueTimeout):
+        breaker.abandon_call()
+        raise
+    except Exception:
+        breaker.record_failure()
+        raise
+    breaker.record_success()
+
+
+def response_image(response) -> tuple[bytes | None, str | None]:
+    """Return the first inline image (data, mime_type) of a response, if any"""
+    if response.candidates and response.candidates[0].content and response.candidates[0].content.parts:
+        for part in response.candidates[0].content.parts:
+            if getattr(part, "inline_data", None) and part.inline_data.data:
+                return part.inline_data.data, part.inline_data.mime_type or "image/png"
+    return None, None
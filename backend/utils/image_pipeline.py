@@ -0,0 +1,102 @@
+"""Single-decode preprocessing for uploaded images before they go upstream.
+
+Each upload is opened once, oriented from its EXIF tag, converted to a mode
+the model accepts, downscaled to the largest size the model makes use of and
+encoded at most once to raw bytes. Uploads that already meet all of that are
+forwarded byte-for-byte without being decoded at all.
+"""
+import asyncio
+import io
+import os
+from typing import NamedTuple
+
+from PIL import ExifTags, Image, ImageOps, UnidentifiedImageError
+
+from utils.timing import stage
+
+# Gemini tiles images internally; detail beyond this edge length is discarded
+MAX_DIMENSION = int(os.getenv("IMAGE_MAX_DIMENSION", "1536"))
+JPEG_QUALITY = int(os.getenv("IMAGE_JPEG_QUALITY", "90"))
+
+# Formats the model accepts as-is, so they can be forwarded untouched
+PASSTHROUGH_FORMATS = {"JPEG": "image/jpeg", "PNG": "image/png", "WEBP": "image/webp"}
+# Formats Pillow cannot decode here but the model accepts directly
+OPAQUE_MIME_TYPES = {"image/heic", "image/heif"}
+
+
+class InvalidImageError(ValueError):
+    """The upload is not an image this pipeline can decode or forward"""
+
+
+class PreparedImage(NamedTuple):
+    data: bytes  # encoded bytes to send upstream
+    mime_type: str
+    image: Image.Image | None  # oriented image for local analysis; None if undecodable
+
+
+def _orientation(image: Image.Image) -> int:
+    return image.getexif().get(ExifTags.Base.Orientation, 1)
+
+
+def load_image(raw: bytes, size: tuple[int, int] | None = None) -> Image.Image:
+    """Open an image upright, letting the JPEG decoder downscale towards ``size``"""
+    image = Image.open(io.BytesIO(raw))
+    if size and image.format == "JPEG":
+        image.draft("RGB", size)
+    if _orientation(image) != 1:
+        ImageOps.exif_transpose(image, in_place=True)
+    return image
+
+
+def to_rgb(image: Image.Image) -> Image.Image:
+    if image.mode == "RGB":
+        return image
+    if image.mode in ("RGBA", "LA", "PA") or (image.mode == "P" and "transparency" in image.info):
+        # JPEG has no alpha; flatten onto white like a product photo backdrop
+        rgba = image.convert("RGBA")
+        background = Image.new("RGB", rgba.size, (255, 255, 255))
+        background.paste(rgba, mask=rgba.getchannel("A"))
+        return background
+    return image.convert("RGB")
+
+
+def prepare_image(raw: bytes, declared_mime_type: str | None = None,
+                  max_dimension: int = MAX_DIMENSION) -> PreparedImage:
+    """Decode, orient, convert and downscale an upload, encoding it at most once"""
+    with stage("image_decode"):
+        try:
+            image = Image.open(io.BytesIO(raw))
+        except UnidentifiedImageError:
+            if declared_mime_type in OPAQUE_MIME_TYPES:
+                return PreparedImage(raw, declared_mime_type, None)
+            raise InvalidImageError("Unsupported or corrupt image file")
+
+        if (
+            image.format in PASSTHROUGH_FORMATS
+            and max(image.size) <= max_dimension
+            and _orientation(image) == 1
+        ):
+            # Already upright, small enough and in a format the model accepts
+            return PreparedImage(raw, PASSTHROUGH_FORMATS[image.format], image)
+
+        if image.format == "JPEG":
+            # Decode at the smallest power-of-two scale still at least the target size
+            scale = max_dimension / max(image.size)
+            image.draft("RGB", (int(image.width * scale), int(image.height * scale)))
+        if _orientation(image) != 1:
+            ImageOps.exif_transpose(image, in_place=True)
+        image = to_rgb(image)
+        # Pillow's bilinear filter is antialiased when shrinking and about twice
+        # as fast as Lanczos; the model resamples its input anyway
+        image.thumbnail((max_dimension, max_dimension), Image.Resampling.BILINEAR, reducing_gap=2.0)
+
+    with stage("image_encode"):
+        buffered = io.BytesIO()
+        image.save(buffered, format="JPEG", quality=JPEG_QUALITY)
+    return PreparedImage(buffered.getvalue(), "image/jpeg", image)
+
+
+async def prepare_upload(raw: bytes, declared_mime_type: str | None = None,
+                         max_dimension: int = MAX_DIMENSION) -> PreparedImage:
+    """prepare_image() in a worker thread so decoding never blocks the event loop"""
+    return await asyncio.to_thread(prepare_image, raw, declared_mime_type, max_dimension)
@@ -0,0 +1,389 @@
+"""Background job queue with a bounded local worker pool.
+
+A job is submitted with a coroutine factory that produces its result, gets an
+id straight away and runs on one of ``workers`` asyncio workers. Job records
+(status, result, error) live in a pluggable store: in memory, or in SQLite
+so they survive a restart. Inputs stay in process memory only, so a job can
+only run in the process that accepted it.
+
+With ``JOB_STORE=sqlite`` several uvicorn workers share one job table. Each
+queue records itself as the job's owner and heartbeats every
+``JOB_HEARTBEAT_S``. Unfinished jobs whose owner has stopped heartbeating
+(the process exited or crashed) are marked failed by whichever worker
+notices first; jobs of live siblings are left alone. Status reads and
+cancellation go through the store, so any worker can answer for any job:
+a cancelled job is skipped by its owner if still queued, and its task is
+cancelled within ``JOB_CANCEL_POLL_S`` if running.
+"""
+import asyncio
+import json
+import os
+import socket
+import sqlite3
+import threading
+import time
+import uuid
+from pathlib import Path
+from typing import Awaitable, Callable
+
+QUEUED = "queued"
+RUNNING = "running"
+SUCCEEDED = "succeeded"
+FAILED = "failed"
+CANCELLED = "cancelled"
+FINISHED = {SUCCEEDED, FAILED, CANCELLED}
+
+JOB_STORE = os.getenv("JOB_STORE", "memory")  # "memory" or "sqlite"
+JOB_DB_PATH = os.getenv("JOB_DB_PATH", "data/jobs.sqlite3")
+HEARTBEAT_S = float(os.getenv("JOB_HEARTBEAT_S", "10"))
+# An owner that has not heartbeated for this long is gone
+OWNER_TIMEOUT_S = HEARTBEAT_S * 3
+CANCEL_POLL_S = float(os.getenv("JOB_CANCEL_POLL_S", "1"))
+UNFINISHED = (QUEUED, RUNNING)
+
+
+class QueueFullError(Exception):
+    pass
+
+
+class MemoryJobStore:
+    def __init__(self):
+        self._jobs: dict[str, dict] = {}
+
+    async def create(self, job: dict):
+        self._jobs[job["id"]] = dict(job)
+
+    async def get(self, job_id: str) -> dict | None:
+        job = self._jobs.get(job_id)
+        return dict(job) if job else None
+
+    async def update(self, job_id: str, expect=None, **fields) -> bool:
+        """Update a job, only if its status is in ``expect`` when given; True if it was updated"""
+        job = self._jobs.get(job_id)
+        if job is None or (expect is not None and job["status"] not in expect):
+            return False
+        job.update(fields)
+        return True
+
+    async def cancelled(self, job_ids: list[str]) -> set[str]:
+        return {job_id for job_id in job_ids if self._jobs.get(job_id, {}).get("status") == CANCELLED}
+
+    async def delete_finished(self, before: float) -> int:
+        expired = [
+            job_id for job_id, job in self._jobs.items()
+            if job["status"] in FINISHED and job["updated_at"] < before
+        ]
+        for job_id in expired:
+            del self._jobs[job_id]
+        return len(expired)
+
+    async def heartbeat(self, owner: str):
+        pass
+
+    async def fail_orphaned(self, error: str, stale_before: float) -> int:
+        # Only this process can see the jobs, so none can outlive their owner
+        return 0
+
+
+class SQLiteJobStore:
+    """Job records in one SQLite table; queries run in a worker thread"""
+
+    COLUMNS = ("id", "kind", "status", "created_at", "updated_at", "result", "error", "owner")
+
+    def __init__(self, path: str | Path):
+        Path(path).parent.mkdir(parents=True, exist_ok=True)
+        self._db = sqlite3.connect(str(path), check_same_thread=False)
+        self._db.execute("PRAGMA journal_mode=WAL")
+        self._db.execute("PRAGMA synchronous=NORMAL")
+        self._db.execute(
+            "CREATE TABLE IF NOT EXISTS jobs (id TEXT PRIMARY KEY, kind TEXT, status TEXT, "
+            "created_at REAL, updated_at REAL, result TEXT, error TEXT, owner TEXT)"
+        )
+        if "owner" not in {row[1] for row in self._db.execute("PRAGMA table_info(jobs)")}:
+            self._db.execute("ALTER TABLE jobs ADD COLUMN owner TEXT")
+        self._db.execute("CREATE INDEX IF NOT EXISTS jobs_status_updated ON jobs (status, updated_at)")
+        self._db.execute("CREATE TABLE IF NOT EXISTS job_owners (owner TEXT PRIMARY KEY, seen_at REAL)")
+        self._db.commit()
+        self._lock = threading.Lock()
+
+    def _execute(self, sql: str, params=()) -> list[tuple] | int:
+        with self._lock:
+            cursor = self._db.execute(sql, params)
+            rows = cursor.fetchall()
+            self._db.commit()
+            return rows if cursor.description else cursor.rowcount
+
+    async def create(self, job: dict):
+        values = [json.dumps(job[c]) if c == "result" else job[c] for c in self.COLUMNS]
+        await asyncio.to_thread(
+            self._execute,
+            f"INSERT INTO jobs ({', '.join(self.COLUMNS)}) VALUES ({', '.join('?' for _ in self.COLUMNS)})",
+            values,
+        )
+
+    async def get(self, job_id: str) -> dict | None:
+        rows = await asyncio.to_thread(
+            self._execute, f"SELECT {', '.join(self.COLUMNS)} FROM jobs WHERE id = ?", (job_id,)
+        )
+        if not rows:
+            return None
+        job = dict(zip(self.COLUMNS, rows[0]))
+        job["result"] = json.loads(job["result"]) if job["result"] else None
+        return job
+
+    async def update(self, job_id: str, expect=None, **fields) -> bool:
+        """Update a job, only if its status is in ``expect`` when given; True if it was updated"""
+        if "result" in fields:
+            fields["result"] = json.dumps(fields["result"])
+        assignments = ", ".join(f"{column} = ?" for column in fields)
+        sql, params = f"UPDATE jobs SET {assignments} WHERE id = ?", [*fields.values(), job_id]
+        if expect is not None:
+            sql += f" AND status IN ({', '.join('?' for _ in expect)})"
+            params.extend(expect)
+        return await asyncio.to_thread(self._execute, sql, params) > 0
+
+    async def cancelled(self, job_ids: list[str]) -> set[str]:
+        if not job_ids:
+            return set()
+        rows = await asyncio.to_thread(
+            self._execute,
+            f"SELECT id FROM jobs WHERE status = ? AND id IN ({', '.join('?' for _ in job_ids)})",
+            (CANCELLED, *job_ids),
+        )
+        return {row[0] for row in rows}
+
+    async def delete_finished(self, before: float) -> int:
+        placeholders = ", ".join("?" for _ in FINISHED)
+        return await asyncio.to_thread(
+            self._execute,
+            f"DELETE FROM jobs WHERE status IN ({placeholders}) AND updated_at < ?",
+            (*FINISHED, before),
+        )
+
+    async def heartbeat(self, owner: str):
+        await asyncio.to_thread(
+            self._execute, "INSERT OR REPLACE INTO job_owners (owner, seen_at) VALUES (?, ?)", (owner, time.time())
+        )
+
+    async def fail_orphaned(self, error: str, stale_before: float) -> int:
+        """Fail unfinished jobs whose owner has not heartbeated since ``stale_before``"""
+        placeholders = ", ".join("?" for _ in UNFINISHED)
+        failed = await asyncio.to_thread(
+            self._execute,
+            f"UPDATE jobs SET status = ?, error = ?, updated_at = ? WHERE status IN ({placeholders}) "
+            "AND (owner IS NULL OR owner NOT IN (SELECT owner FROM job_owners WHERE seen_at >= ?))",
+            (FAILED, error, time.time(), *UNFINISHED, stale_before),
+        )
+        await asyncio.to_thread(self._execute, "DELETE FROM job_owners WHERE seen_at < ?", (stale_before,))
+        return failed
+
+
+def make_store(kind: str = JOB_STORE, path: str | Path = JOB_DB_PATH):
+    """Job store selected by JOB_STORE.
+
+    A store that cannot be opened falls back to memory with a warning rather
+    than stopping the app from starting; /ready reports which store is in use.
+    """
+    try:
+        if kind == "sqlite":
+            return SQLiteJobStore(path)
+        if kind != "memory":
+            raise ValueError(f"Unknown job store: {kind}")
+    except (sqlite3.Error, OSError, ValueError) as e:
+        print(f"WARNING: could not open the {kind} job store ({e}); jobs will be kept in memory only")
+    return MemoryJobStore()
+
+
+class JobQueue:
+    def __init__(self, name: str, store, workers: int, max_depth: int, ttl_s: float):
+        self.name = name
+        self.store = store
+        self.workers = workers
+        self.max_depth = max_depth
+        self.ttl_s = ttl_s
+        self._queue: asyncio.Queue[tuple[str, Callable[[], Awaitable]]] = asyncio.Queue()
+        self._running: dict[str, asyncio.Task] = {}
+        self._done_events: dict[str, asyncio.Event] = {}
+        self._tasks: list[asyncio.Task] = []
+        self.owner: str | None = None
+        self.submitted = 0
+        self.rejected = 0
+        self.succeeded = 0
+        self.failed = 0
+        self.cancelled = 0
+
+    @property
+    def running(self) -> bool:
+        return bool(self._tasks)
+
+    @property
+    def depth(self) -> int:
+        """Jobs waiting for a worker plus jobs being worked on"""
+        return self._queue.qsize() + len(self._running)
+
+    async def start(self):
+        """Start the workers, the expiry sweeper and the owner heartbeat"""
+        # Chosen per start, so a restarted worker does not adopt its predecessor's jobs
+        self.owner = f"{socket.gethostname()}:{os.getpid()}:{uuid.uuid4().hex[:8]}"
+        await self.store.heartbeat(self.owner)
+        await self._fail_orphaned()
+        self._tasks = [asyncio.create_task(self._worker()) for _ in range(self.workers)]
+        self._tasks.append(asyncio.create_task(self._sweeper()))
+        self._tasks.append(asyncio.create_task(self._monitor()))
+
+    async def stop(self):
+        """Cancel the workers along with any job they are running"""
+        for task in self._tasks:
+            task.cancel()
+        await asyncio.gather(*self._tasks, return_exceptions=True)
+        self._tasks = []
+
+    async def submit(self, kind: str, run: Callable[[], Awaitable]) -> dict:
+        """Queue ``run()`` and return the new job record; raises QueueFullError at max depth"""
+        if not self.running:
+            self.rejected += 1
+            raise QueueFullError(f"{self.name} queue is not running")
+        if self.depth >= self.max_depth:
+            self.rejected += 1
+            raise QueueFullError(f"{self.name} queue is full ({self.max_depth} jobs)")
+
+        now = time.time()
+        job = {"id": uuid.uuid4().hex, "kind": kind, "status": QUEUED, "created_at": now,
+               "updated_at": now, "result": None, "error": None, "owner": self.owner}
+        await self.store.create(job)
+        self._done_events[job["id"]] = asyncio.Event()
+        self._queue.put_nowait((job["id"], run))
+        self.submitted += 1
+        return job
+
+    async def get(self, job_id: str, wait_s: float = 0) -> dict | None:
+        """Current job record; with ``wait_s`` long-polls until the job finishes or time runs out"""
+        job = await self.store.get(job_id)
+        if job is None or job["status"] in FINISHED or wait_s <= 0:
+            return job
+        done = self._done_events.get(job_id)
+        if done is not None:
+            try:
+                await asyncio.wait_for(done.wait(), wait_s)
+            except asyncio.TimeoutError:
+                pass
+            return await self.store.get(job_id)
+        # Another worker owns the job: poll the shared store
+        deadline = time.monotonic() + wait_s
+        while (remaining := deadline - time.monotonic()) > 0:
+            await asyncio.sleep(min(CANCEL_POLL_S, remaining))
+            job = await self.store.get(job_id)
+            if job is None or job["status"] in FINISHED:
+                break
+        return job
+
+    async def cancel(self, job_id: str) -> dict | None:
+        """Cancel a queued or running job; finished jobs are returned unchanged"""
+        job = await self.store.get(job_id)
+        if job is None or job["status"] in FINISHED:
+            return job
+        running = self._running.get(job_id)
+        done = self._done_events.get(job_id)
+        if running is not None:
+            # The worker records the cancellation when the task unwinds
+            running.cancel()
+            if done is not None:
+                await done.wait()
+        else:
+            # Queued here, or owned by another worker: the owner skips it when
+            # it comes up, or cancels its task on the next poll if running
+            await self._finish(job_id, CANCELLED)
+        return await self.store.get(job_id)
+
+    async def _finish(self, job_id: str, status: str, result=None, error: str | None = None):
+        # Conditional, so a cancellation recorded by another worker is not overwritten
+        finished = await self.store.update(
+            job_id, expect=UNFINISHED, status=status, result=result, error=error, updated_at=time.time()
+        )
+        done = self._done_events.pop(job_id, None)
+        if done is not None:
+            done.set()
+        if not finished:
+            return
+        if status == SUCCEEDED:
+            self.succeeded += 1
+        elif status == FAILED:
+            self.failed += 1
+        else:
+            self.cancelled += 1
+
+    async def _worker(self):
+        while True:
+            job_id, run = await self._queue.get()
+            try:
+                if not await self.store.update(job_id, expect=(QUEUED,), status=RUNNING, updated_at=time.time()):
+                    # Cancelled or failed while queued
+                    done = self._done_events.pop(job_id, None)
+                    if done is not None:
+                        done.set()
+                    continue
+                task = asyncio.create_task(run())
+                self._running[job_id] = task
+                try:
+                    result = await asyncio.shield(task)
+                except asyncio.CancelledError:
+                    if not task.cancelled():
+                        # The worker itself is shutting down
+                        task.cancel()
+                        raise
+                    await self._finish(job_id, CANCELLED)
+                except Exception as e:
+                    print(f"{self.name} job {job_id} failed: {e}")
+                    await self._finish(job_id, FAILED, error=str(e))
+                else:
+                    await self._finish(job_id, SUCCEEDED, result=result)
+            finally:
+                self._running.pop(job_id, None)
+                self._queue.task_done()
+
+    async def _sweeper(self):
+        interval = min(60.0, max(1.0, self.ttl_s / 10))
+        while True:
+            await asyncio.sleep(interval)
+            try:
+                removed = await self.store.delete_finished(time.time() - self.ttl_s)
+                if removed:
+                    print(f"Expired {removed} finished {self.name} jobs")
+            except Exception as e:
+                print(f"Could not expire {self.name} jobs: {e}")
+
+    async def _fail_orphaned(self):
+        orphaned = await self.store.fail_orphaned("Interrupted by a server restart", time.time() - OWNER_TIMEOUT_S)
+        if orphaned:
+            print(f"Marked {orphaned} interrupted {self.name} jobs as failed")
+
+    async def _monitor(self):
+        """Heartbeat as this queue's owner, fail orphaned jobs and pick up cancellations from other workers"""
+        last_heartbeat = time.monotonic()
+        while True:
+            await asyncio.sleep(CANCEL_POLL_S)
+            try:
+                if self._running:
+                    for job_id in await self.store.cancelled(list(self._running)):
+                        task = self._running.get(job_id)
+                        if task is not None:
+                            task.cancel()
+                if time.monotonic() - last_heartbeat >= HEARTBEAT_S:
+                    last_heartbeat = time.monotonic()
+                    await self.store.heartbeat(self.owner)
+                    await self._fail_orphaned()
+            except Exception as e:
+                print(f"{self.name} job monitor error: {e}")
+
+    def stats(self) -> dict:
+        return {
+            "queued": self._queue.qsize(),
+            "running": len(self._running),
+            "workers": self.workers,
+            "max_depth": self.max_depth,
+            "submitted": self.submitted,
+            "rejected": self.rejected,
+            "succeeded": self.succeeded,
+            "failed": self.failed,
+            "cancelled": self.cancelled,
+        }
@@ -0,0 +1,222 @@
+"""Minimal in-process metrics in the Prometheus text exposition format.
+
+Counters, gauges and histograms keep plain Python numbers per label set, so
+recording costs a dict lookup and, for histograms, a bisect. Values that
+already live elsewhere (such as cache stats) are read only when /metrics is
+scraped, through registered collectors.
+"""
+import bisect
+import time
+from typing import Callable, Iterable
+
+CONTENT_TYPE = "text/plain; version=0.0.4; charset=utf-8"
+
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 20, 30, 60)
+BYTES_BUCKETS = (256, 1024, 4096, 16384, 65536, 262144, 1048576, 4194304, 16777216)
+
+
+def _format_labels(names: tuple[str, ...], values: tuple[str, ...], extra: str = "") -> str:
+    pairs = [f'{name}="{_escape(value)}"' for name, value in zip(names, values)]
+    if extra:
+        pairs.append(extra)
+    return "{" + ",".join(pairs) + "}" if pairs else ""
+
+
+def _escape(value) -> str:
+    return str(value).replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+
+def _format_value(value: float) -> str:
+    if value == float("inf"):
+        return "+Inf"
+    return repr(float(value)) if isinstance(value, float) else str(value)
+
+
+class _Metric:
+    kind = ""
+
+    def __init__(self, name: str, documentation: str, labels: Iterable[str] = ()):
+        self.name = name
+        self.documentation = documentation
+        self.label_names = tuple(labels)
+        self._values: dict[tuple[str, ...], object] = {}
+
+    def _key(self, labels: tuple) -> tuple[str, ...]:
+        if len(labels) != len(self.label_names):
+            raise ValueError(f"{self.name} expects labels {self.label_names}")
+        return tuple(str(label) for label in labels)
+
+    def render(self) -> list[str]:
+        lines = [f"# HELP {self.name} {self.documentation}", f"# TYPE {self.name} {self.kind}"]
+        for labels, value in sorted(self._values.items()):
+            lines.extend(self._render_sample(labels, value))
+        return lines
+
+    def _render_sample(self, labels, value) -> list[str]:
+        return [f"{self.name}{_format_labels(self.label_names, labels)} {_format_value(value)}"]
+
+
+class Counter(_Metric):
+    kind = "counter"
+
+    def inc(self, *labels, amount: float = 1):
+        key = self._key(labels)
+        self._values[key] = self._values.get(key, 0) + amount
+
+
+class Gauge(_Metric):
+    kind = "gauge"
+
+    def set(self, *labels, value: float):
+        self._values[self._key(labels)] = value
+
+    def inc(self, *labels, amount: float = 1):
+        key = self._key(labels)
+        self._values[key] = self._values.get(key, 0) + amount
+
+    def dec(self, *labels, amount: float = 1):
+        self.inc(*labels, amount=-amount)
+
+
+class Histogram(_Metric):
+    kind = "histogram"
+
+    def __init__(self, name: str, documentation: str, labels: Iterable[str] = (),
+                 buckets: tuple[float, ...] = LATENCY_BUCKETS):
+        super().__init__(name, documentation, labels)
+        self.buckets = tuple(sorted(buckets))
+
+    def observe(self, *labels, value: float):
+        key = self._key(labels)
+        state = self._values.get(key)
+        if state is None:
+            # Per-bucket (non-cumulative) counts with a final +Inf slot, sum
+            state = self._values[key] = [[0] * (len(self.buckets) + 1), 0.0]
+        state[0][bisect.bisect_left(self.buckets, value)] += 1
+        state[1] += value
+
+    def _render_sample(self, labels, state) -> list[str]:
+        counts, total = state
+        lines = []
+        cumulative = 0
+        for bound, count in zip((*self.buckets, float("inf")), counts):
+            cumulative += count
+            le = f'le="{_format_value(float(bound))}"'
+            lines.append(f"{self.name}_bucket{_format_labels(self.label_names, labels, le)} {cumulative}")
+        lines.append(f"{self.name}_sum{_format_labels(self.label_names, labels)} {_format_value(total)}")
+        lines.append(f"{self.name}_count{_format_labels(self.label_names, labels)} {cumulative}")
+        return lines
+
+
+class Registry:
+    def __init__(self):
+        self._metrics: dict[str, _Metric] = {}
+        self._collectors: list[Callable[[], None]] = []
+
+    def register(self, metric: _Metric) -> _Metric:
+        if metric.name in self._metrics:
+            raise ValueError(f"Metric {metric.name} is already registered")
+        self._metrics[metric.name] = metric
+        return metric
+
+    def counter(self, name: str, documentation: str, labels: Iterable[str] = ()) -> Counter:
+        return self.register(Counter(name, documentation, labels))
+
+    def gauge(self, name: str, documentation: str, labels: Iterable[str] = ()) -> Gauge:
+        return self.register(Gauge(name, documentation, labels))
+
+    def histogram(self, name: str, documentation: str, labels: Iterable[str] = (),
+                  buckets: tuple[float, ...] = LATENCY_BUCKETS) -> Histogram:
+        return self.register(Histogram(name, documentation, labels, buckets))
+
+    def add_collector(self, collect: Callable[[], None]):
+        """Run ``collect`` before every scrape to refresh gauges from their source"""
+        self._collectors.append(collect)
+
+    def render(self) -> str:
+        for collect in self._collectors:
+            try:
+                collect()
+            except Exception as e:
+                print(f"Metrics collector failed: {e}")
+        lines = []
+        for metric in self._metrics.values():
+            lines.extend(metric.render())
+        return "\n".join(lines) + "\n"
+
+
+REGISTRY = Registry()
+
+REQUEST_LATENCY = REGISTRY.histogram(
+    "http_request_duration_seconds", "Time from request start to the end of the response body", ("route", "method")
+)
+REQUESTS = REGISTRY.counter("http_requests_total", "HTTP requests by final status", ("route", "method", "status"))
+REQUEST_BYTES = REGISTRY.histogram(
+    "http_request_size_bytes", "Request body size", ("route",), buckets=BYTES_BUCKETS
+)
+RESPONSE_BYTES = REGISTRY.histogram(
+    "http_response_size_bytes", "Response body size", ("route",), buckets=BYTES_BUCKETS
+)
+REQUESTS_IN_FLIGHT = REGISTRY.gauge("http_requests_in_flight", "HTTP requests being handled")
+
+UPSTREAM_LATENCY = REGISTRY.histogram(
+    "upstream_call_duration_seconds", "Gemini call latency, excluding time queued in the scheduler", ("model",)
+)
+UPSTREAM_CALLS = REGISTRY.counter("upstream_calls_total", "Gemini calls by outcome", ("model", "outcome"))
+UPSTREAM_IN_FLIGHT = REGISTRY.gauge("upstream_calls_in_flight", "Gemini calls in progress", ("model",))
+UPSTREAM_RETRIES = REGISTRY.counter("upstream_retries_total", "Retried Gemini calls", ("model",))
+UPSTREAM_HEDGES = REGISTRY.counter("upstream_hedges_total", "Hedged second requests started", ("model",))
+CIRCUIT_STATE = REGISTRY.gauge("circuit_state", "Circuit breaker state: 0 closed, 1 half-open, 2 open", ("model",))
+CIRCUIT_REJECTIONS = REGISTRY.counter("circuit_rejections_total", "Calls refused by an open circuit", ("model",))
+UPSTREAM_QUEUE_WAIT = REGISTRY.histogram(
+    "upstream_queue_wait_seconds", "Time Gemini calls waited for a scheduler slot", ("model", "priority")
+)
+UPSTREAM_THROTTLED = REGISTRY.counter("upstream_throttled_total", "429 answers that paused a model's queue", ("model",))
+FALLBACKS = REGISTRY.counter("fallbacks_total", "Responses served from fallback content", ("site",))
+
+
+class MetricsMiddleware:
+    """Record latency, status, body sizes and in-flight requests per route template"""
+
+    def __init__(self, app, excluded_paths: Iterable[str] = ("/metrics",)):
+        self.app = app
+        self.excluded_paths = set(excluded_paths)
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http" or scope["path"] in self.excluded_paths:
+            return await self.app(scope, receive, send)
+
+        start = time.perf_counter()
+        request_bytes = 0
+        response_bytes = 0
+        status = 500
+
+        async def counting_receive():
+            nonlocal request_bytes
+            message = await receive()
+            if message["type"] == "http.request":
+                request_bytes += len(message.get("body", b""))
+            return message
+
+        async def counting_send(message):
+            nonlocal response_bytes, status
+            if message["type"] == "http.response.start":
+                status = message["status"]
+            elif message["type"] == "http.response.body":
+                response_bytes += len(message.get("body", b""))
+            await send(message)
+
+        REQUESTS_IN_FLIGHT.inc()
+        try:
+            await self.app(scope, counting_receive, counting_send)
+        finally:
+            REQUESTS_IN_FLIGHT.dec()
+            # The router stores the matched route in the scope; label by its
+            # template so path parameters do not create new series
+            route = scope.get("route")
+            route = getattr(route, "path", None) or "unmatched"
+            method = scope["method"]
+            REQUEST_LATENCY.observe(route, method, value=time.perf_counter() - start)
+            REQUESTS.inc(route, method, status)
+            REQUEST_BYTES.observe(route, value=request_bytes)
+            RESPONSE_BYTES.observe(route, value=response_bytes)
@@ -0,0 +1,189 @@
+"""Near-duplicate detection for uploaded images, so caches survive re-compression.
+
+Phones re-upload the same photo re-compressed, resized or with its EXIF
+stripped. The bytes differ, so byte-keyed caches miss. Each upload is given
+an image id instead: the content hash of the first upload that looked the
+same. Caches key on that id.
+
+An upload looks the same as an earlier one when all of these hold:
+
+- its 64-bit pHash is within ``NEAR_DUP_PHASH_BITS`` and its 64-bit dHash
+  within ``NEAR_DUP_DHASH_BITS``, both taken over a 32x32 grayscale
+  thumbnail;
+- its aspect ratio is within ``NEAR_DUP_ASPECT_TOLERANCE``;
+- no cell of its 8x8 colour thumbnail differs by more than
+  ``NEAR_DUP_COLOUR_TOLERANCE`` (mean absolute RGB difference). Grayscale
+  hashes alone cannot tell a red tee from the same tee in blue, and a
+  worst-cell check catches a different garment in an otherwise identical
+  scene.
+
+Candidates come from a banded index. Each hash is split into four 16-bit
+bands, and any entry sharing one band value with the upload is verified.
+Exact byte repeats are answered from the content hash alone, without
+decoding. The index lives in process memory and keeps the most recently
+used ``NEAR_DUP_MAX_ENTRIES`` uploads; each worker builds its own.
+"""
+import asyncio
+import os
+from collections import OrderedDict
+from typing import NamedTuple
+
+import numpy as np
+from PIL import Image
+
+from utils.image_pipeline import PreparedImage, to_rgb
+from utils.result_cache import content_key
+from utils.similarity import PHASH_SIZE, dhash, phash
+
+NEAR_DUP_ENABLED = os.getenv("NEAR_DUP_ENABLED", "true").lower() in ("1", "true", "yes")
+PHASH_BITS = int(os.getenv("NEAR_DUP_PHASH_BITS", "6"))
+DHASH_BITS = int(os.getenv("NEAR_DUP_DHASH_BITS", "10"))
+ASPECT_TOLERANCE = float(os.getenv("NEAR_DUP_ASPECT_TOLERANCE", "0.02"))
+COLOUR_TOLERANCE = float(os.getenv("NEAR_DUP_COLOUR_TOLERANCE", "12"))
+MAX_ENTRIES = int(os.getenv("NEAR_DUP_MAX_ENTRIES", "20000"))
+
+BAND_BITS = 16
+BANDS = 64 // BAND_BITS
+COLOUR_GRID = 8
+
+
+class Fingerprint(NamedTuple):
+    phash: int
+    dhash: int
+    aspect: float  # width / height
+    colours: np.ndarray  # int16 (COLOUR_GRID * COLOUR_GRID, 3) mean RGB per cell
+
+
+def fingerprint(image: Image.Image) -> Fingerprint:
+    """Perceptual fingerprint of an oriented, decoded image"""
+    small = to_rgb(image.resize((PHASH_SIZE, PHASH_SIZE), Image.Resampling.BILINEAR, reducing_gap=2.0))
+    gray_image = small.convert("L")
+    gray = np.asarray(gray_image, dtype=np.float32)
+    gray_9x8 = np.asarray(gray_image.resize((9, 8), Image.Resampling.BOX), dtype=np.float32)
+    colours = np.asarray(small.resize((COLOUR_GRID, COLOUR_GRID), Image.Resampling.BOX), dtype=np.int16)
+    return Fingerprint(int(phash(gray)), int(dhash(gray_9x8)), image.width / image.height, colours.reshape(-1, 3))
+
+
+def _bands(value: int) -> list[int]:
+    mask = (1 << BAND_BITS) - 1
+    return [(value >> (i * BAND_BITS)) & mask for i in range(BANDS)]
+
+
+class _Entry(NamedTuple):
+    fingerprint: Fingerprint
+    canonical: str
+
+
+class NearDuplicateIndex:
+    def __init__(self, max_entries: int = MAX_ENTRIES, phash_bits: int = PHASH_BITS, dhash_bits: int = DHASH_BITS,
+                 aspect_tolerance: float = ASPECT_TOLERANCE, colour_tolerance: float = COLOUR_TOLERANCE):
+        self.max_entries = max_entries
+        self.phash_bits = phash_bits
+        self.dhash_bits = dhash_bits
+        self.aspect_tolerance = aspect_tolerance
+        self.colour_tolerance = colour_tolerance
+        self._entries: OrderedDict[str, _Entry] = OrderedDict()
+        # (hash kind, band number, band value) -> ids of entries with that band
+        self._buckets: dict[tuple[int, int, int], set[str]] = {}
+        self.exact_hits = 0
+        self.near_hits = 0
+        self.new_images = 0
+
+    def _band_keys(self, fp: Fingerprint) -> list[tuple[int, int, int]]:
+        return [(kind, i, band) for kind, value in enumerate((fp.phash, fp.dhash))
+                for i, band in enumerate(_bands(value))]
+
+    def matches(self, a: Fingerprint, b: Fingerprint) -> bool:
+        return (
+            (a.phash ^ b.phash).bit_count() <= self.phash_bits
+            and (a.dhash ^ b.dhash).bit_count() <= self.dhash_bits
+            and abs(a.aspect - b.aspect) <= self.aspect_tolerance * max(a.aspect, b.aspect)
+            and np.abs(a.colours - b.colours).mean(axis=1).max() <= self.colour_tolerance
+        )
+
+    def known(self, image_id: str) -> str | None:
+        """Canonical id for bytes seen before, without decoding them"""
+        entry = self._entries.get(image_id)
+        if entry is None:
+            return None
+        self._entries.move_to_end(image_id)
+        self.exact_hits += 1
+        return entry.canonical
+
+    def _find(self, fp: Fingerprint) -> str | None:
+        candidates = set()
+        for key in self._band_keys(fp):
+            candidates |= self._buckets.get(key, set())
+        best, best_distance = None, None
+        for image_id in candidates:
+            other = self._entries[image_id].fingerprint
+            if self.matches(fp, other):
+                distance = (fp.phash ^ other.phash).bit_count()
+                if best_distance is None or distance < best_distance:
+                    best, best_distance = image_id, distance
+        return best
+
+    def _add(self, image_id: str, entry: _Entry):
+        self._entries[image_id] = entry
+        for key in self._band_keys(entry.fingerprint):
+            self._buckets.setdefault(key, set()).add(image_id)
+        while len(self._entries) > self.max_entries:
+            evicted_id, evicted = self._entries.popitem(last=False)
+            for key in self._band_keys(evicted.fingerprint):
+                bucket = self._buckets.get(key)
+                if bucket is not None:
+                    bucket.discard(evicted_id)
+                    if not bucket:
+                        del self._buckets[key]
+
+    def resolve(self, image_id: str, fp: Fingerprint) -> str:
+        """Canonical id for an upload: an earlier look-alike's, or its own"""
+        canonical = self.known(image_id)
+        if canonical is not None:
+            return canonical
+        match = self._find(fp)
+        if match is None:
+            self.new_images += 1
+            canonical = image_id
+        else:
+            self.near_hits += 1
+            self._entries.move_to_end(match)
+            canonical = self._entries[match].canonical
+        self._add(image_id, _Entry(fp, canonical))
+        return canonical
+
+    def stats(self) -> dict:
+        lookups = self.exact_hits + self.near_hits + self.new_images
+        return {
+            "exact_hits": self.exact_hits,
+            "near_hits": self.near_hits,
+            "new_images": self.new_images,
+            "hit_ratio": round((self.exact_hits + self.near_hits) / lookups, 4) if lookups else 0.0,
+            "entries": len(self._entries),
+        }
+
+
+uploads = NearDuplicateIndex()
+
+
+def exact_id(raw: bytes) -> str:
+    return content_key(raw)
+
+
+def known_image_id(raw: bytes) -> str | None:
+    """Image id for upload bytes seen before, or None if they need fingerprinting"""
+    if not NEAR_DUP_ENABLED:
+        return exact_id(raw)
+    return uploads.known(exact_id(raw))
+
+
+async def image_id(raw: bytes, prepared: PreparedImage) -> str:
+    """Image id of an upload for cache keys: shared by re-compressed or resized copies"""
+    raw_id = exact_id(raw)
+    if not NEAR_DUP_ENABLED or prepared.image is None:
+        return raw_id
+    canonical = uploads.known(raw_id)
+    if canonical is not None:
+        return canonical
+    fp = await asyncio.to_thread(fingerprint, prepared.image)
+    return uploads.resolve(raw_id, fp)
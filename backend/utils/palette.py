@@ -0,0 +1,240 @@
+"""Dominant-colour palettes and colour-harmony scores, computed locally with NumPy.
+
+An image is downsampled to ``SAMPLE_EDGE`` pixels a side and converted to
+CIELAB. Product photos usually sit on a plain background, so pixels close to
+a uniform border colour are dropped. The remaining pixels are clustered with
+k-means (k-means++ seeding from a fixed seed, so the same image always gives
+the same palette) into up to ``PALETTE_SIZE`` colours, weighted by their
+pixel share.
+
+Harmony compares every colour of one palette with every colour of each
+candidate palette:
+
+- Two chromatic colours score by how close their hue difference is to a
+  classic scheme: analogous, triadic, split-complementary or complementary.
+- Neutrals (low chroma: black, white, grey, beige) go with anything.
+- Some lightness contrast scores better than none.
+
+Pair scores are weighted by both colours' shares. Candidate palettes are
+stacked into arrays, so a hundred candidates are scored in one vectorised
+pass.
+"""
+from typing import NamedTuple
+
+import numpy as np
+from PIL import Image
+
+PALETTE_SIZE = 5
+SAMPLE_EDGE = 64  # 64 * 64 = 4096 pixels to cluster
+KMEANS_ITERATIONS = 12
+# Below this chroma (CIELAB units) a colour counts as neutral
+NEUTRAL_CHROMA = 15.0
+# Pixels within this distance (CIELAB units) of a uniform border are background
+BACKGROUND_DISTANCE = 12.0
+# Clusters closer than this (CIELAB units) are reported as one colour
+MERGE_DISTANCE = 10.0
+# Lightness difference that earns the full contrast bonus
+FULL_CONTRAST_L = 35.0
+CONTRAST_WEIGHT = 0.25
+NEUTRAL_HARMONY = 0.85
+
+# Hue-difference schemes: (name, centre in degrees, width in degrees)
+SCHEMES = (
+    ("analogous", 0.0, 40.0),
+    ("triadic", 120.0, 15.0),
+    ("split-complementary", 150.0, 15.0),
+    ("complementary", 180.0, 20.0),
+)
+SCHEME_NAMES = (*(name for name, _, _ in SCHEMES), "neutral")
+_SCHEME_CENTRES = np.array([centre for _, centre, _ in SCHEMES], dtype=np.float32)
+_SCHEME_WIDTHS = np.array([width for _, _, width in SCHEMES], dtype=np.float32)
+
+# Names for describing palette colours, by sRGB value
+COLOUR_NAMES = {
+    "black": (20, 20, 20), "charcoal": (64, 64, 64), "grey": (128, 128, 128), "white": (245, 245, 245),
+    "cream": (245, 235, 210), "beige": (215, 195, 160), "camel": (190, 145, 90), "brown": (110, 70, 40),
+    "rust": (180, 80, 40), "red": (200, 30, 40), "burgundy": (120, 20, 40), "pink": (240, 150, 180),
+    "coral": (245, 120, 100), "orange": (240, 140, 30), "mustard": (215, 170, 40), "yellow": (245, 220, 60),
+    "olive": (120, 120, 40), "green": (50, 150, 70), "mint": (150, 210, 180), "teal": (20, 130, 130), "sky blue": (120, 180, 230),
+    "blue": (40, 90, 200), "navy": (25, 35, 80), "purple": (110, 50, 150), "lavender": (190, 170, 220),
+}
+
+
+class Palette(NamedTuple):
+    """A palette, or a batch of palettes stacked along axis 0 (padded with zero weights)"""
+    colours: np.ndarray  # float32 (k, 3) or (n, k, 3), CIELAB
+    weights: np.ndarray  # float32 (k,) or (n, k), each palette sums to 1
+
+
+def srgb_to_lab(rgb: np.ndarray) -> np.ndarray:
+    """CIELAB (D65) for sRGB values in 0-255, along the last axis"""
+    c = np.asarray(rgb, dtype=np.float32) / 255.0
+    linear = np.where(c > 0.04045, ((c + 0.055) / 1.055) ** 2.4, c / 12.92)
+    xyz = linear @ np.array([
+        [0.4124 / 0.95047, 0.2126, 0.0193 / 1.08883],
+        [0.3576 / 0.95047, 0.7152, 0.1192 / 1.08883],
+        [0.1805 / 0.95047, 0.0722, 0.9505 / 1.08883],
+    ], dtype=np.float32)
+    f = np.where(xyz > 216 / 24389, np.cbrt(xyz), (24389 / 27 * xyz + 16) / 116)
+    return np.stack([
+        116 * f[..., 1] - 16,
+        500 * (f[..., 0] - f[..., 1]),
+        200 * (f[..., 1] - f[..., 2]),
+    ], axis=-1).astype(np.float32)
+
+
+_NAMES = list(COLOUR_NAMES)
+_NAME_LAB = srgb_to_lab(np.array(list(COLOUR_NAMES.values())))
+
+
+def colour_name(lab: np.ndarray) -> str:
+    """The nearest named colour to one CIELAB colour"""
+    return _NAMES[int(np.argmin(((_NAME_LAB - lab) ** 2).sum(axis=1)))]
+
+
+def _foreground(lab: np.ndarray) -> np.ndarray:
+    """Pixels of an (h, w, 3) image that are not a uniform border background"""
+    border = np.concatenate([lab[0], lab[-1], lab[1:-1, 0], lab[1:-1, -1]])
+    background = np.median(border, axis=0)
+    pixels = lab.reshape(-1, 3)
+    if np.median(np.linalg.norm(border - background, axis=1)) > BACKGROUND_DISTANCE:
+        return pixels  # busy border: no plain background to remove
+    keep = np.linalg.norm(pixels - background, axis=1) > BACKGROUND_DISTANCE
+    # An image that is nearly all background is probably a plain swatch
+    return pixels[keep] if keep.mean() > 0.05 else pixels
+
+
+def _kmeans(pixels: np.ndarray, k: int) -> tuple[np.ndarray, np.ndarray]:
+    rng = np.random.default_rng(0)
+    centres = np.empty((k, 3), dtype=np.float32)
+    centres[0] = pixels[rng.integers(len(pixels))]
+    nearest = ((pixels - centres[0]) ** 2).sum(axis=1)
+    for i in range(1, k):
+        # k-means++: the next seed is drawn in proportion to squared distance
+        total = nearest.sum()
+        if total <= 0:
+            k = i
+            break
+        centres[i] = pixels[rng.choice(len(pixels), p=nearest / total)]
+        nearest = np.minimum(nearest, ((pixels - centres[i]) ** 2).sum(axis=1))
+    centres = centres[:k]
+
+    for _ in range(KMEANS_ITERATIONS):
+        # ||p - c||^2 without the constant ||p||^2 term
+        labels = np.argmin((centres ** 2).sum(axis=1) - 2 * pixels @ centres.T, axis=1)
+        counts = np.bincount(labels, minlength=k)
+        sums = np.stack([np.bincount(labels, weights=pixels[:, c], minlength=k) for c in range(3)], axis=1)
+        moved = np.where(counts[:, None] > 0, sums / np.maximum(counts, 1)[:, None], centres).astype(np.float32)
+        if np.allclose(moved, centres, atol=0.5):
+            break
+        centres = moved
+    counts = np.bincount(labels, minlength=k)
+    return centres, counts
+
+
+def extract_palette(image: Image.Image, k: int = PALETTE_SIZE) -> Palette:
+    """The dominant colours of an image, largest share first"""
+    if image.format == "JPEG":
+        image.draft("RGB", (SAMPLE_EDGE * 2, SAMPLE_EDGE * 2))
+    if image.mode != "RGB":
+        image = image.convert("RGB")
+    small = image.resize((SAMPLE_EDGE, SAMPLE_EDGE), Image.Resampling.BILINEAR, reducing_gap=2.0)
+    pixels = _foreground(srgb_to_lab(np.asarray(small)))
+
+    centres, counts = _kmeans(pixels, min(k, len(pixels)))
+    colours, weights = [], []
+    for i in np.argsort(-counts):
+        if counts[i] == 0:
+            break
+        # Shading splits one garment colour into near-identical clusters
+        for j, colour in enumerate(colours):
+            if np.linalg.norm(colour - centres[i]) < MERGE_DISTANCE:
+                weights[j] += counts[i]
+                break
+        else:
+            colours.append(centres[i])
+            weights.append(float(counts[i]))
+    weights = np.array(weights, dtype=np.float32)
+    return Palette(np.array(colours, dtype=np.float32), weights / weights.sum())
+
+
+def to_json(palette: Palette) -> list[dict]:
+    """Palette as JSON-friendly colours and shares, for storing and for responses"""
+    return [
+        {"lab": [round(float(v), 2) for v in colour], "weight": round(float(weight), 4)}
+        for colour, weight in zip(palette.colours, palette.weights)
+    ]
+
+
+def from_json(colours: list[dict]) -> Palette:
+    return Palette(
+        np.array([colour["lab"] for colour in colours], dtype=np.float32).reshape(-1, 3),
+        np.array([colour["weight"] for colour in colours], dtype=np.float32),
+    )
+
+
+def stack(palettes: list[Palette], k: int = PALETTE_SIZE) -> Palette:
+    """Stack palettes into one batch, padding shorter ones with zero-weight colours"""
+    colours = np.zeros((len(palettes), k, 3), dtype=np.float32)
+    weights = np.zeros((len(palettes), k), dtype=np.float32)
+    for i, palette in enumerate(palettes):
+        n = min(k, len(palette.weights))
+        colours[i, :n] = palette.colours[:n]
+        weights[i, :n] = palette.weights[:n]
+    return Palette(colours, weights)
+
+
+def _pair_scores(reference: Palette, candidates: Palette) -> tuple[np.ndarray, np.ndarray]:
+    """Harmony (n, k_ref, k) and scheme index of every colour pair"""
+    ref = reference.colours[None, :, None, :]  # (1, k_ref, 1, 3)
+    cand = candidates.colours[:, None, :, :]  # (n, 1, k, 3)
+
+    ref_chroma = np.hypot(ref[..., 1], ref[..., 2])
+    cand_chroma = np.hypot(cand[..., 1], cand[..., 2])
+    hue_gap = np.abs(np.arctan2(ref[..., 2], ref[..., 1]) - np.arctan2(cand[..., 2], cand[..., 1]))
+    hue_gap = np.degrees(np.minimum(hue_gap, 2 * np.pi - hue_gap))  # 0..180
+
+    fits = np.exp(-(((hue_gap[..., None] - _SCHEME_CENTRES) / _SCHEME_WIDTHS) ** 2))
+    scheme = np.argmax(fits, axis=-1)
+    hue_harmony = np.max(fits, axis=-1)
+
+    neutral = (ref_chroma < NEUTRAL_CHROMA) | (cand_chroma < NEUTRAL_CHROMA)
+    hue_harmony = np.where(neutral, NEUTRAL_HARMONY, hue_harmony)
+    scheme = np.where(neutral, len(SCHEMES), scheme)
+
+    contrast = np.minimum(1.0, np.abs(ref[..., 0] - cand[..., 0]) / FULL_CONTRAST_L)
+    return (1 - CONTRAST_WEIGHT) * hue_harmony + CONTRAST_WEIGHT * contrast, scheme
+
+
+def harmony_scores(reference: Palette, candidates: Palette) -> np.ndarray:
+    """Harmony in [0, 1] of one palette with each palette of a stacked batch"""
+    pair_harmony, _ = _pair_scores(reference, candidates)
+    pair_weights = reference.weights[None, :, None] * candidates.weights[:, None, :]
+    return (pair_harmony * pair_weights).sum(axis=(1, 2)) / np.maximum(pair_weights.sum(axis=(1, 2)), 1e-6)
+
+
+def describe_harmony(reference: Palette, candidate: Palette) -> str:
+    """One line on how a candidate's main colours work with the reference's"""
+    pair_harmony, scheme = _pair_scores(reference, stack([candidate]))
+    contribution = (pair_harmony * reference.weights[None, :, None] * stack([candidate]).weights[:, None, :])[0]
+    i, j = np.unravel_index(np.argmax(contribution), contribution.shape)
+    name = SCHEME_NAMES[scheme[0, i, j]]
+    theirs, yours = colour_name(candidate.colours[j]), colour_name(reference.colours[i])
+    if name == "neutral":
+        if np.hypot(*candidate.colours[j, 1:]) < NEUTRAL_CHROMA:
+            return f"{theirs.capitalize()} is an easy neutral with your {yours}"
+        return f"{theirs.capitalize()} stands out against your neutral {yours}"
+    if pair_harmony[0, i, j] < 0.5:
+        return f"Bold contrast: {theirs} with your {yours}"
+    if name == "analogous" and theirs == yours:
+        return f"Tonal {yours} look"
+    return f"{name.capitalize()} colours: {theirs} with your {yours}"
+
+
+def palette_summary(palette: Palette) -> list[dict]:
+    """Named colours and their shares, for responses"""
+    shares: dict[str, float] = {}
+    for colour, weight in zip(palette.colours, palette.weights):
+        name = colour_name(colour)
+        shares[name] = shares.get(name, 0.0) + float(weight)
+    return [{"name": name, "share": round(share, 2)} for name, share in shares.items()]
@@ -0,0 +1,283 @@
+"""Circuit breakers, deadlines, retries and hedging for upstream model calls.
+
+- Each model has a circuit breaker. After ``CIRCUIT_FAILURE_THRESHOLD``
+  consecutive upstream failures, calls fail immediately with
+  CircuitOpenError for ``CIRCUIT_RESET_S``. After that, a single probe call
+  decides whether the circuit closes again.
+- Routes set a latency budget with ``request_deadline()``. Every call made
+  under it is bounded by the time left, and never by more than
+  ``GEMINI_CALL_TIMEOUT_S``.
+- Idempotent calls (text generation) are retried on transient errors with
+  full-jitter exponential backoff, as long as the deadline leaves room.
+  With ``GEMINI_HEDGE_AFTER_S`` set, they are also hedged: a second
+  identical request starts if the first has not answered by then, and the
+  first answer wins.
+- A 429 is quota pushback, not an outage: it is not counted against the
+  circuit. The scheduler pauses that model's queue, and the call is
+  retried through it (any call, since a rejected request did no work).
+"""
+import asyncio
+import os
+import random
+import time
+from contextlib import contextmanager
+from contextvars import ContextVar
+from typing import AsyncContextManager, Awaitable, Callable
+
+import httpx
+from fastapi import HTTPException
+from google.genai import errors
+
+from utils.metrics import CIRCUIT_REJECTIONS, CIRCUIT_STATE, UPSTREAM_HEDGES, UPSTREAM_RETRIES
+
+FAILURE_THRESHOLD = int(os.getenv("CIRCUIT_FAILURE_THRESHOLD", "5"))
+RESET_AFTER_S = float(os.getenv("CIRCUIT_RESET_S", "30"))
+CALL_TIMEOUT_S = float(os.getenv("GEMINI_CALL_TIMEOUT_S", "120"))
+TEXT_RETRIES = int(os.getenv("GEMINI_TEXT_RETRIES", "2"))
+RETRY_BASE_S = float(os.getenv("GEMINI_RETRY_BASE_S", "0.5"))
+RETRY_MAX_S = float(os.getenv("GEMINI_RETRY_MAX_S", "4"))
+HEDGE_AFTER_S = float(os.getenv("GEMINI_HEDGE_AFTER_S", "0"))  # 0 disables hedging
+
+# Status codes worth retrying and counted against the circuit
+TRANSIENT_STATUS = {408, 500, 502, 503, 504}
+RATE_LIMITED_STATUS = 429
+
+CLOSED = "closed"
+OPEN = "open"
+HALF_OPEN = "half_open"
+STATE_VALUES = {CLOSED: 0, HALF_OPEN: 1, OPEN: 2}
+
+
+class CircuitOpenError(Exception):
+    def __init__(self, name: str, retry_after_s: float):
+        super().__init__(f"{name} is unavailable; retry in {retry_after_s:.0f}s")
+        self.retry_after_s = retry_after_s
+
+
+class UpstreamTimeout(TimeoutError):
+    pass
+
+
+class QueueTimeout(UpstreamTimeout):
+    """The deadline ran out while waiting for a local slot; the upstream was never called"""
+
+
+class UpstreamNotConfigured(RuntimeError):
+    pass
+
+
+# Upstream failures that routes report as 503/504 rather than 500
+UPSTREAM_ERRORS = (CircuitOpenError, UpstreamTimeout, UpstreamNotConfigured)
+
+
+def is_transient(error: BaseException) -> bool:
+    """True for failures that say nothing about the request itself"""
+    if isinstance(error, errors.APIError):
+        return error.code in TRANSIENT_STATUS or (error.code or 0) >= 500
+    return isinstance(error, (TimeoutError, httpx.TransportError))
+
+
+def is_rate_limited(error: BaseException) -> bool:
+    return isinstance(error, errors.APIError) and error.code == RATE_LIMITED_STATUS
+
+
+def upstream_http_error(error: Exception) -> HTTPException:
+    """HTTP error for an upstream call that was short-circuited, unconfigured or out of time"""
+    if isinstance(error, CircuitOpenError):
+        return HTTPException(status_code=503, detail=str(error),
+                             headers={"Retry-After": str(max(1, round(error.retry_after_s)))})
+    if isinstance(error, UpstreamNotConfigured):
+        return HTTPException(status_code=503, detail="The AI service is not configured")
+    return HTTPException(status_code=504, detail="The AI service did not answer in time")
+
+
+class CircuitBreaker:
+    def __init__(self, name: str, failure_threshold: int = FAILURE_THRESHOLD, reset_after_s: float = RESET_AFTER_S):
+        self.name = name
+        self.failure_threshold = failure_threshold
+        self.reset_after_s = reset_after_s
+        self.state = CLOSED
+        self.failures = 0
+        self.opened_at = 0.0
+        self._probing = False
+        self.rejected = 0
+        self.times_opened = 0
+        CIRCUIT_STATE.set(name, value=STATE_VALUES[CLOSED])
+
+    def _set_state(self, state: str):
+        if state != self.state:
+            print(f"Circuit for {self.name}: {self.state} -> {state}")
+        self.state = state
+        CIRCUIT_STATE.set(self.name, value=STATE_VALUES[state])
+
+    def before_call(self):
+        """Raise CircuitOpenError unless a call may go ahead"""
+        if self.state == CLOSED:
+            return
+        retry_after = self.opened_at + self.reset_after_s - time.monotonic()
+        if self.state == OPEN and retry_after <= 0:
+            self._set_state(HALF_OPEN)
+        if self.state == HALF_OPEN and not self._probing:
+            # Let exactly one call through to test the upstream
+            self._probing = True
+            return
+        self.rejected += 1
+        CIRCUIT_REJECTIONS.inc(self.name)
+        raise CircuitOpenError(self.name, max(retry_after, 1.0))
+
+    def abandon_call(self):
+        """The caller went away, so the call says nothing about the upstream"""
+        self._probing = False
+
+    def record_success(self):
+        self.failures = 0
+        self._probing = False
+        self._set_state(CLOSED)
+
+    def record_failure(self):
+        self.failures += 1
+        self._probing = False
+        if self.state == HALF_OPEN or self.failures >= self.failure_threshold:
+            if self.state != OPEN:
+                self.times_opened += 1
+            self.opened_at = time.monotonic()
+            self._set_state(OPEN)
+
+    def stats(self) -> dict:
+        return {
+            "state": self.state,
+            "consecutive_failures": self.failures,
+            "times_opened": self.times_opened,
+            "rejected": self.rejected,
+        }
+
+
+BREAKERS: dict[str, CircuitBreaker] = {}
+
+
+def breaker_for(name: str) -> CircuitBreaker:
+    breaker = BREAKERS.get(name)
+    if breaker is None:
+        breaker = BREAKERS[name] = CircuitBreaker(name)
+    return breaker
+
+
+_deadline: ContextVar[float | None] = ContextVar("upstream_deadline", default=None)
+
+
+@contextmanager
+def request_deadline(budget_s: float):
+    """Bound every upstream call inside the block by ``budget_s`` from now"""
+    deadline = time.monotonic() + budget_s
+    outer = _deadline.get()
+    token = _deadline.set(deadline if outer is None else min(outer, deadline))
+    try:
+        yield
+    finally:
+        _deadline.reset(token)
+
+
+def time_left() -> float:
+    """Seconds a call started now may take"""
+    deadline = _deadline.get()
+    if deadline is None:
+        return CALL_TIMEOUT_S
+    return min(CALL_TIMEOUT_S, deadline - time.monotonic())
+
+
+async def within_deadline(awaitable: Awaitable, name: str):
+    """Await ``awaitable`` for at most the time left, raising UpstreamTimeout"""
+    timeout = time_left()
+    if timeout <= 0:
+        raise UpstreamTimeout(f"Deadline exceeded before calling {name}")
+    try:
+        async with asyncio.timeout(timeout):
+            return await awaitable
+    except TimeoutError as e:
+        raise UpstreamTimeout(f"{name} did not answer within {timeout:.1f}s") from e
+
+
+async def _hedged(call: Callable[[], Awaitable], hedge_after_s: float, name: str):
+    first = asyncio.ensure_future(call())
+    done, _ = await asyncio.wait({first}, timeout=hedge_after_s)
+    if done:
+        return first.result()
+
+    UPSTREAM_HEDGES.inc(name)
+    attempts = {first, asyncio.ensure_future(call())}
+    try:
+        error = None
+        for next_done in asyncio.as_completed(attempts):
+            try:
+                return await next_done
+            except Exception as e:
+                # Wait for the other attempt before giving up
+                error = e
+        raise error
+    finally:
+        for attempt in attempts:
+            attempt.cancel()
+
+
+async def call_upstream(name: str, call: Callable[[], Awaitable], idempotent: bool = False,
+                        acquire: Callable[[], AsyncContextManager] | None = None):
+    """Run ``call()`` under the breaker for ``name`` and the current deadline.
+
+    Each attempt, hedged ones included, holds ``acquire()`` while it runs;
+    time spent waiting for it does not count against the breaker.
+    Idempotent calls are retried on transient errors and hedged when enabled.
+    """
+    async def attempt_once():
+        if acquire is None:
+            return await within_deadline(call(), name)
+        async with acquire():
+            return await within_deadline(call(), name)
+
+    breaker = breaker_for(name)
+    retries = TEXT_RETRIES if idempotent else 0
+    attempt = 0
+    while True:
+        if time_left() <= 0:
+            raise UpstreamTimeout(f"Deadline exceeded before calling {name}")
+        breaker.before_call()
+        try:
+            if idempotent and HEDGE_AFTER_S > 0:
+                result = await _hedged(attempt_once, HEDGE_AFTER_S, name)
+            else:
+                result = await attempt_once()
+        except (asyncio.CancelledError, QueueTimeout):
+            breaker.abandon_call()
+            raise
+        except UpstreamTimeout as e:
+            breaker.record_failure()
+            error = e
+        except Exception as e:
+            if is_rate_limited(e):
+                # Neutral for the circuit; the scheduler throttles the model
+                breaker.abandon_call()
+                if attempt >= TEXT_RETRIES or time_left() <= 0:
+                    raise
+                print(f"Retrying {name} after a 429 (attempt {attempt + 2} of {TEXT_RETRIES + 1})")
+                UPSTREAM_RETRIES.inc(name)
+                if acquire is None:
+                    # No queue to pause, so back off here
+                    await asyncio.sleep(random.uniform(0, min(RETRY_MAX_S, RETRY_BASE_S * 2 ** attempt)))
+                attempt += 1
+                continue
+            if not is_transient(e):
+                # The upstream answered; the request itself was at fault
+                breaker.record_success()
+                raise
+            breaker.record_failure()
+            error = e
+        else:
+            breaker.record_success()
+            return result
+
+        backoff = random.uniform(0, min(RETRY_MAX_S, RETRY_BASE_S * 2 ** attempt))
+        if attempt >= retries or backoff >= time_left():
+            raise error
+        print(f"Retrying {name} after {error!r} (attempt {attempt + 2} of {retries + 1})")
+        UPSTREAM_RETRIES.inc(name)
+        await asyncio.sleep(backoff)
+        attempt += 1
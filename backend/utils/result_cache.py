@@ -0,0 +1,138 @@
+"""Content-addressed result cache with an in-memory LRU tier and a store tier.
+
+Entries are a binary payload (for example a generated image) plus a small
+JSON-serialisable metadata dict. The memory tier is bounded by payload bytes;
+the store tier keeps entries across restarts and, with RESULT_STORE=sqlite,
+shares them between worker processes (see utils/result_store.py). Both tiers
+honour the same TTL.
+"""
+import asyncio
+import hashlib
+import os
+import sqlite3
+import time
+from collections import OrderedDict
+from pathlib import Path
+
+from utils.result_store import CachedResult, store_for
+
+# Every cache registers itself here so its stats() can be reported
+CACHES: dict[str, object] = {}
+
+
+def content_key(*parts: bytes | str) -> str:
+    """SHA-256 over length-prefixed parts, so ("ab", "c") and ("a", "bc") differ"""
+    digest = hashlib.sha256()
+    for part in parts:
+        data = part.encode("utf-8") if isinstance(part, str) else part
+        digest.update(len(data).to_bytes(8, "big"))
+        digest.update(data)
+    return digest.hexdigest()
+
+
+class ResultCache:
+    def __init__(self, name: str, max_memory_bytes: int, directory: Path | None, ttl_s: float):
+        self.name = name
+        self.max_memory_bytes = max_memory_bytes
+        # ``directory`` only matters for the disk store; None keeps entries in memory only
+        self.directory = directory
+        self.store = store_for(directory)
+        self.ttl_s = ttl_s
+        self._memory: OrderedDict[str, CachedResult] = OrderedDict()
+        self._memory_bytes = 0
+        self.hits = 0
+        self.store_hits = 0
+        self.misses = 0
+        CACHES[name] = self
+
+    def _expired(self, created_at: float) -> bool:
+        return time.time() - created_at > self.ttl_s
+
+    def _remember(self, key: str, entry: CachedResult):
+        if len(entry.payload) > self.max_memory_bytes:
+            return
+        old = self._memory.pop(key, None)
+        if old:
+            self._memory_bytes -= len(old.payload)
+        self._memory[key] = entry
+        self._memory_bytes += len(entry.payload)
+        while self._memory_bytes > self.max_memory_bytes:
+            _, evicted = self._memory.popitem(last=False)
+            self._memory_bytes -= len(evicted.payload)
+
+    def _read_store(self, key: str) -> CachedResult | None:
+        try:
+            entry = self.store.get(self.name, key)
+            if entry and self._expired(entry.created_at):
+                self.store.delete(self.name, key)
+                return None
+            return entry
+        except (OSError, sqlite3.Error) as e:
+            print(f"Could not read {self.name} cache entry from the {self.store.kind} store: {e}")
+            return None
+
+    async def get(self, key: str) -> CachedResult | None:
+        """Look a key up in memory, then in the store"""
+        entry = self._memory.get(key)
+        if entry and not self._expired(entry.created_at):
+            self._memory.move_to_end(key)
+            self.hits += 1
+            return entry
+        if entry:
+            self._memory.pop(key)
+            self._memory_bytes -= len(entry.payload)
+
+        if self.store is not None:
+            entry = await asyncio.to_thread(self._read_store, key)
+            if entry:
+                self._remember(key, entry)
+                self.hits += 1
+                self.store_hits += 1
+                return entry
+
+        self.misses += 1
+        return None
+
+    async def put(self, key: str, payload: bytes, meta: dict):
+        """Store an entry in memory and, when configured, in the store"""
+        entry = CachedResult(payload, meta, time.time())
+        self._remember(key, entry)
+        if self.store is not None:
+            try:
+                await asyncio.to_thread(self.store.put, self.name, key, entry, self.ttl_s)
+            except (OSError, sqlite3.Error) as e:
+                print(f"Could not write {self.name} cache entry to the {self.store.kind} store: {e}")
+
+    def stats(self) -> dict:
+        lookups = self.hits + self.misses
+        return {
+            "hits": self.hits,
+            "store_hits": self.store_hits,
+            "misses": self.misses,
+            "hit_ratio": round(self.hits / lookups, 4) if lookups else 0.0,
+            "store": self.store.kind if self.store else None,
+            "memory_entries": len(self._memory),
+            "memory_bytes": self._memory_bytes,
+        }
+
+
+async def cached_text(cache: ResultCache, key: str, compute) -> str | None:
+    """The text stored under ``key``, or ``await compute()`` stored there when it is non-empty"""
+    cached = await cache.get(key)
+    if cached:
+        return cached.payload.decode("utf-8")
+    text = await compute()
+    if text:
+        await cache.put(key, text.encode("utf-8"), {})
+    return text
+
+
+# Text analyses of uploaded images (smart pairing, outfit try-on, image
+# search), keyed by model, prompt and the images' bytes or ids
+ANALYSIS_CACHE_DIR = os.getenv("ANALYSIS_CACHE_DIR", "data/cache/analysis")
+analysis_cache = ResultCache(
+    "analysis",
+    max_memory_bytes=int(float(os.getenv("ANALYSIS_CACHE_MEMORY_MB", "16")) * 1024 * 1024),
+    directory=Path(ANALYSIS_CACHE_DIR) if ANALYSIS_CACHE_DIR else None,
+    ttl_s=float(os.getenv("ANALYSIS_CACHE_TTL_S", str(7 * 24 * 3600))),
+)
@@ -0,0 +1,235 @@
+"""Second-tier storage behind ResultCache and the stale-while-revalidate caches.
+
+- ``disk`` (the default): one directory of files per cache. Entries survive
+  restarts but have no size bound.
+- ``sqlite``: one SQLite database in WAL mode, shared by every cache and by
+  every uvicorn worker on the host. Readers never block the writer. A lookup
+  from one worker finds what another worker generated, and the OS page cache
+  holds one copy of the hot entries instead of one per worker. The database
+  is bounded by ``RESULT_STORE_MAX_MB``: once it grows past that, expired
+  entries go first, then the least recently used, until it is back under
+  ``RESULT_STORE_LOW_WATER`` of the limit.
+
+With the shared store, the per-worker memory tiers can be kept small (or set
+to 0) so memory use stays flat as workers are added.
+"""
+import json
+import os
+import sqlite3
+import threading
+import time
+from pathlib import Path
+from typing import NamedTuple
+
+RESULT_STORE = os.getenv("RESULT_STORE", "disk")  # "disk" or "sqlite"
+RESULT_DB_PATH = os.getenv("RESULT_DB_PATH", "data/cache/results.sqlite3")
+MAX_BYTES = int(float(os.getenv("RESULT_STORE_MAX_MB", "2048")) * 1024 * 1024)
+LOW_WATER = float(os.getenv("RESULT_STORE_LOW_WATER", "0.9"))
+# Reads refresh an entry's LRU position at most this often, so hot entries
+# do not turn every lookup into a write
+ACCESS_RESOLUTION_S = 60.0
+
+
+class CachedResult(NamedTuple):
+    payload: bytes
+    meta: dict
+    created_at: float
+
+
+class DiskResultStore:
+    """Entries as ``<key>.bin`` and ``<key>.json`` files under one directory"""
+
+    kind = "disk"
+
+    def __init__(self, directory: Path):
+        self.directory = directory
+
+    def _paths(self, key: str) -> tuple[Path, Path]:
+        folder = self.directory / key[:2]
+        return folder / f"{key}.bin", folder / f"{key}.json"
+
+    def get(self, namespace: str, key: str) -> CachedResult | None:
+        payload_path, meta_path = self._paths(key)
+        try:
+            stored = json.loads(meta_path.read_text(encoding="utf-8"))
+            return CachedResult(payload_path.read_bytes(), stored["meta"], stored["created_at"])
+        except (OSError, ValueError, KeyError):
+            return None
+
+    def put(self, namespace: str, key: str, entry: CachedResult, ttl_s: float):
+        payload_path, meta_path = self._paths(key)
+        payload_path.parent.mkdir(parents=True, exist_ok=True)
+        # Write-then-rename so readers never see a partial file; the metadata
+        # goes last because its presence marks the entry as complete
+        for path, data in (
+            (payload_path, entry.payload),
+            (meta_path, json.dumps({"meta": entry.meta, "created_at": entry.created_at}).encode("utf-8")),
+        ):
+            tmp_path = path.with_suffix(f"{path.suffix}.{os.getpid()}.tmp")
+            tmp_path.write_bytes(data)
+            os.replace(tmp_path, path)
+
+    def delete(self, namespace: str, key: str):
+        for path in self._paths(key):
+            path.unlink(missing_ok=True)
+
+    def stats(self) -> dict:
+        return {"kind": self.kind, "directory": str(self.directory)}
+
+
+class SQLiteResultStore:
+    """All caches' entries in one WAL-mode SQLite table, bounded in total bytes"""
+
+    kind = "sqlite"
+
+    SCHEMA = (
+        "CREATE TABLE IF NOT EXISTS results (cache TEXT NOT NULL, key TEXT NOT NULL, payload BLOB NOT NULL, "
+        "meta TEXT NOT NULL, created_at REAL NOT NULL, expires_at REAL NOT NULL, accessed_at REAL NOT NULL, "
+        "size INTEGER NOT NULL, PRIMARY KEY (cache, key))",
+        "CREATE INDEX IF NOT EXISTS results_accessed ON results (accessed_at)",
+        "CREATE INDEX IF NOT EXISTS results_expires ON results (expires_at)",
+        # Running totals kept by triggers, so checking the bound is one row read
+        "CREATE TABLE IF NOT EXISTS usage (id INTEGER PRIMARY KEY CHECK (id = 0), "
+        "bytes INTEGER NOT NULL, entries INTEGER NOT NULL)",
+        "INSERT OR IGNORE INTO usage VALUES (0, 0, 0)",
+        "CREATE TRIGGER IF NOT EXISTS results_inserted AFTER INSERT ON results BEGIN "
+        "UPDATE usage SET bytes = bytes + NEW.size, entries = entries + 1; END",
+        "CREATE TRIGGER IF NOT EXISTS results_deleted AFTER DELETE ON results BEGIN "
+        "UPDATE usage SET bytes = bytes - OLD.size, entries = entries - 1; END",
+        "CREATE TRIGGER IF NOT EXISTS results_resized AFTER UPDATE OF size ON results BEGIN "
+        "UPDATE usage SET bytes = bytes + NEW.size - OLD.size; END",
+    )
+
+    def __init__(self, path: str | Path, max_bytes: int = MAX_BYTES, low_water: float = LOW_WATER):
+        self.path = Path(path)
+        self.max_bytes = max_bytes
+        self.low_water = low_water
+        self._db: sqlite3.Connection | None = None
+        self._pid = 0
+        self._lock = threading.Lock()
+        self.evicted = 0
+        # Last (bytes, entries) read from the usage table, for stats() without I/O
+        self.usage: tuple[int, int] | None = None
+        self.usage_error: str | None = None
+
+    def _connection(self) -> sqlite3.Connection:
+        # Opened on first use in each process, so workers forked after
+        # import never share a connection
+        if self._db is None or self._pid != os.getpid():
+            self.path.parent.mkdir(parents=True, exist_ok=True)
+            db = sqlite3.connect(str(self.path), timeout=10, isolation_level=None, check_same_thread=False)
+            db.execute("PRAGMA journal_mode=WAL")
+            db.execute("PRAGMA synchronous=NORMAL")
+            db.execute("BEGIN IMMEDIATE")
+            try:
+                for statement in self.SCHEMA:
+                    db.execute(statement)
+                db.execute("COMMIT")
+            except sqlite3.Error:
+                db.execute("ROLLBACK")
+                raise
+            self._db, self._pid = db, os.getpid()
+        return self._db
+
+    def get(self, namespace: str, key: str) -> CachedResult | None:
+        now = time.time()
+        with self._lock:
+            db = self._connection()
+            row = db.execute(
+                "SELECT payload, meta, created_at, expires_at, accessed_at FROM results WHERE cache = ? AND key = ?",
+                (namespace, key),
+            ).fetchone()
+            if row is None:
+                return None
+            payload, meta, created_at, expires_at, accessed_at = row
+            if expires_at < now:
+                db.execute("DELETE FROM results WHERE cache = ? AND key = ?", (namespace, key))
+                return None
+            if now - accessed_at > ACCESS_RESOLUTION_S:
+                db.execute("UPDATE results SET accessed_at = ? WHERE cache = ? AND key = ?", (now, namespace, key))
+        return CachedResult(payload, json.loads(meta), created_at)
+
+    def put(self, namespace: str, key: str, entry: CachedResult, ttl_s: float):
+        now = time.time()
+        with self._lock:
+            db = self._connection()
+            db.execute("BEGIN IMMEDIATE")
+            try:
+                db.execute(
+                    "INSERT INTO results (cache, key, payload, meta, created_at, expires_at, accessed_at, size) "
+                    "VALUES (?, ?, ?, ?, ?, ?, ?, ?) ON CONFLICT (cache, key) DO UPDATE SET "
+                    "payload = excluded.payload, meta = excluded.meta, created_at = excluded.created_at, "
+                    "expires_at = excluded.expires_at, accessed_at = excluded.accessed_at, size = excluded.size",
+                    (namespace, key, entry.payload, json.dumps(entry.meta), entry.created_at,
+                     entry.created_at + ttl_s, now, len(entry.payload)),
+                )
+                usage = db.execute("SELECT bytes, entries FROM usage").fetchone()
+                if usage[0] > self.max_bytes:
+                    self._evict(db, now)
+                    usage = db.execute("SELECT bytes, entries FROM usage").fetchone()
+                db.execute("COMMIT")
+            except BaseException:
+                db.execute("ROLLBACK")
+                raise
+            self.usage = usage
+
+    def _evict(self, db: sqlite3.Connection, now: float):
+        """Delete expired entries, then the least recently used, down to the low-water mark"""
+        evicted = db.execute("DELETE FROM results WHERE expires_at < ?", (now,)).rowcount
+        target = int(self.max_bytes * self.low_water)
+        excess = db.execute("SELECT bytes FROM usage").fetchone()[0] - target
+        while excess > 0:
+            victims = db.execute("SELECT rowid, size FROM results ORDER BY accessed_at LIMIT 64").fetchall()
+            if not victims:
+                break
+            chosen = []
+            for rowid, size in victims:
+                chosen.append(rowid)
+                excess -= size
+                if excess <= 0:
+                    break
+            db.execute(f"DELETE FROM results WHERE rowid IN ({', '.join('?' for _ in chosen)})", chosen)
+            evicted += len(chosen)
+        self.evicted += evicted
+
+    def delete(self, namespace: str, key: str):
+        with self._lock:
+            self._connection().execute("DELETE FROM results WHERE cache = ? AND key = ?", (namespace, key))
+
+    def refresh_usage(self):
+        """Re-read the host-wide totals; blocks on the store, so call it from a worker thread"""
+        try:
+            with self._lock:
+                self.usage = tuple(self._connection().execute("SELECT bytes, entries FROM usage").fetchone())
+            self.usage_error = None
+        except sqlite3.Error as e:
+            self.usage_error = str(e)
+
+    def stats(self) -> dict:
+        """Counters as of the last put() or refresh_usage(); never touches the database"""
+        stats = {"kind": self.kind, "path": str(self.path), "max_bytes": self.max_bytes, "evicted": self.evicted}
+        if self.usage is not None:
+            stats["bytes"], stats["entries"] = self.usage
+        if self.usage_error:
+            stats["error"] = self.usage_error
+        return stats
+
+
+_shared: SQLiteResultStore | None = None
+
+
+def shared_store() -> SQLiteResultStore | None:
+    """The host-wide SQLite store when RESULT_STORE=sqlite, otherwise None"""
+    global _shared
+    if RESULT_STORE != "sqlite":
+        return None
+    if _shared is None:
+        _shared = SQLiteResultStore(RESULT_DB_PATH)
+    return _shared
+
+
+def store_for(directory: Path | None):
+    """Second tier for a ResultCache whose disk directory is ``directory`` (None: memory only)"""
+    if directory is None:
+        return None
+    return shared_store() or DiskResultStore(directory)
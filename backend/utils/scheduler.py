@@ -0,0 +1,239 @@
+"""Shared scheduler for upstream model calls: token buckets and priority classes.
+
+Every Gemini call takes a slot from its model's queue before it starts. Each
+model has a cap on calls in flight and, optionally, a token bucket refilled
+at its requests-per-minute quota. Waiting calls are granted in priority
+order:
+
+- INTERACTIVE: a user is waiting on this exact result (the default)
+- PAIRING: suggestion thumbnails, which have placeholders to fall back on
+- BACKGROUND: cache refreshes and precomputation
+
+Each class step counts as ``SCHEDULER_PRIORITY_STEP_S`` seconds of waiting.
+Under load, lower classes are delayed but never starved. Within a class,
+calls are served first come, first served.
+
+A call whose estimated wait already exceeds its deadline is rejected right
+away with QueueTimeout. When a model answers 429, its queue pauses and its
+bucket is emptied, so queued calls wait instead of adding more 429s.
+
+Per-model settings use the model name upper-cased, with dashes and dots
+replaced by underscores:
+
+    GEMINI_CONCURRENCY_GEMINI_2_0_FLASH_EXP_IMAGE_GENERATION=8
+    GEMINI_RPM_GEMINI_2_0_FLASH_EXP_IMAGE_GENERATION=10
+    GEMINI_BURST_GEMINI_2_0_FLASH_EXP_IMAGE_GENERATION=3
+"""
+import asyncio
+import os
+import time
+from collections import deque
+from contextlib import asynccontextmanager, contextmanager
+from contextvars import ContextVar
+
+from utils.metrics import UPSTREAM_QUEUE_WAIT, UPSTREAM_THROTTLED
+from utils.resilience import QueueTimeout, time_left
+
+INTERACTIVE = 0
+PAIRING = 1
+BACKGROUND = 2
+PRIORITY_NAMES = {INTERACTIVE: "interactive", PAIRING: "pairing", BACKGROUND: "background"}
+
+# Defaults for models without their own setting; an RPM of 0 means no rate limit
+DEFAULT_CONCURRENCY = int(os.getenv("GEMINI_MAX_CONCURRENCY", "32"))
+DEFAULT_RPM = float(os.getenv("GEMINI_DEFAULT_RPM", "0"))
+PRIORITY_STEP_S = float(os.getenv("SCHEDULER_PRIORITY_STEP_S", "10"))
+# How long a model's queue pauses after a 429
+RATE_LIMIT_PAUSE_S = float(os.getenv("GEMINI_RATE_LIMIT_PAUSE_S", "2"))
+
+_priority: ContextVar[int] = ContextVar("upstream_priority", default=INTERACTIVE)
+
+
+@contextmanager
+def priority(level: int):
+    """Schedule every upstream call inside the block at ``level``"""
+    token = _priority.set(level)
+    try:
+        yield
+    finally:
+        _priority.reset(token)
+
+
+def current_priority() -> int:
+    return _priority.get()
+
+
+def model_setting(prefix: str, model: str, default: float) -> float:
+    """Read ``<prefix>_<MODEL>`` from the environment"""
+    env_name = f"{prefix}_" + model.upper().replace("-", "_").replace(".", "_")
+    return float(os.getenv(env_name, default))
+
+
+class _Waiter:
+    __slots__ = ("level", "enqueued_at", "future")
+
+    def __init__(self, level: int, future: asyncio.Future):
+        self.level = level
+        self.enqueued_at = time.monotonic()
+        self.future = future
+
+
+class ModelQueue:
+    def __init__(self, name: str, max_in_flight: int, rpm: float = 0, burst: float | None = None):
+        self.name = name
+        self.max_in_flight = max_in_flight
+        self.rate = rpm / 60  # tokens per second; 0 disables the bucket
+        self.capacity = max(1.0, burst if burst is not None else self.rate * 10)
+        self.tokens = self.capacity
+        self.refilled_at = time.monotonic()
+        self.paused_until = 0.0
+        self.in_flight = 0
+        self.waiting = {level: deque() for level in PRIORITY_NAMES}
+        self._timer: asyncio.TimerHandle | None = None
+        self.granted = {level: 0 for level in PRIORITY_NAMES}
+        self.rejected = 0
+        self.throttled = 0
+
+    def _refill(self, now: float):
+        if self.rate:
+            self.tokens = min(self.capacity, self.tokens + (now - self.refilled_at) * self.rate)
+        self.refilled_at = now
+
+    def _next_waiter(self) -> _Waiter | None:
+        """The waiter with the earliest priority-adjusted arrival, dropping abandoned ones"""
+        best = None
+        for level, queue in self.waiting.items():
+            while queue and queue[0].future.done():
+                queue.popleft()
+            if queue and (best is None or queue[0].enqueued_at + level * PRIORITY_STEP_S
+                          < best.enqueued_at + best.level * PRIORITY_STEP_S):
+                best = queue[0]
+        return best
+
+    def _can_start(self, now: float) -> bool:
+        """True if a call may start now; otherwise arm a timer for when one can"""
+        self._refill(now)
+        if self.in_flight >= self.max_in_flight:
+            return False  # release() dispatches again
+        wake_in = self.paused_until - now
+        if self.rate and self.tokens < 1:
+            wake_in = max(wake_in, (1 - self.tokens) / self.rate)
+        if wake_in <= 0:
+            return True
+        if self._timer is None:
+            self._timer = asyncio.get_running_loop().call_later(wake_in, self._wake)
+        return False
+
+    def _take(self):
+        if self.rate:
+            self.tokens -= 1
+        self.in_flight += 1
+
+    def _wake(self):
+        self._timer = None
+        self._dispatch()
+
+    def _dispatch(self):
+        while (waiter := self._next_waiter()) is not None and self._can_start(time.monotonic()):
+            self.waiting[waiter.level].popleft()
+            self._take()
+            waiter.future.set_result(None)
+
+    def queued(self) -> int:
+        return sum(1 for queue in self.waiting.values() for waiter in queue if not waiter.future.done())
+
+    def estimated_wait(self, level: int) -> float:
+        """Seconds until a call at ``level`` would get a token, from the bucket and the calls ahead"""
+        now = time.monotonic()
+        self._refill(now)
+        wait = max(0.0, self.paused_until - now)
+        if self.rate:
+            ahead = sum(1 for queue_level, queue in self.waiting.items() if queue_level <= level
+                        for waiter in queue if not waiter.future.done())
+            wait = max(wait, (ahead + 1 - self.tokens) / self.rate)
+        return wait
+
+    async def acquire(self, level: int, timeout: float):
+        """Wait for a slot, raising QueueTimeout if it cannot come within ``timeout``"""
+        if self._next_waiter() is None and self._can_start(time.monotonic()):
+            self._take()
+            self.granted[level] += 1
+            UPSTREAM_QUEUE_WAIT.observe(self.name, PRIORITY_NAMES[level], value=0)
+            return
+        if self.estimated_wait(level) > timeout:
+            self.rejected += 1
+            raise QueueTimeout(f"{self.name} is at its rate limit; the wait would exceed the deadline")
+
+        waiter = _Waiter(level, asyncio.get_running_loop().create_future())
+        self.waiting[level].append(waiter)
+        self._dispatch()
+        try:
+            await asyncio.wait_for(asyncio.shield(waiter.future), timeout)
+        except (asyncio.CancelledError, TimeoutError) as e:
+            if waiter.future.done() and not waiter.future.cancelled():
+                # Granted just as the caller gave up; hand the slot on
+                self.release()
+            else:
+                waiter.future.cancel()
+            if isinstance(e, TimeoutError):
+                self.rejected += 1
+                raise QueueTimeout(f"Timed out waiting for a {self.name} slot") from e
+            raise
+        self.granted[level] += 1
+        UPSTREAM_QUEUE_WAIT.observe(self.name, PRIORITY_NAMES[level], value=time.monotonic() - waiter.enqueued_at)
+
+    def release(self):
+        self.in_flight -= 1
+        self._dispatch()
+
+    def throttle(self, pause_s: float = RATE_LIMIT_PAUSE_S):
+        """The upstream said 429: stop starting calls for a while and empty the bucket"""
+        self.throttled += 1
+        UPSTREAM_THROTTLED.inc(self.name)
+        self.paused_until = max(self.paused_until, time.monotonic() + pause_s)
+        self.tokens = 0
+
+    def stats(self) -> dict:
+        return {
+            "in_flight": self.in_flight,
+            "max_in_flight": self.max_in_flight,
+            "rpm": self.rate * 60,
+            "tokens": round(self.tokens, 2),
+            "queued": {PRIORITY_NAMES[level]: sum(1 for w in queue if not w.future.done())
+                       for level, queue in self.waiting.items()},
+            "granted": {PRIORITY_NAMES[level]: count for level, count in self.granted.items()},
+            "rejected": self.rejected,
+            "throttled": self.throttled,
+        }
+
+
+class UpstreamScheduler:
+    def __init__(self):
+        self.queues: dict[str, ModelQueue] = {}
+
+    def queue(self, model: str) -> ModelQueue:
+        queue = self.queues.get(model)
+        if queue is None:
+            rpm = model_setting("GEMINI_RPM", model, DEFAULT_RPM)
+            burst = model_setting("GEMINI_BURST", model, 0) or None
+            queue = self.queues[model] = ModelQueue(
+                model, int(model_setting("GEMINI_CONCURRENCY", model, DEFAULT_CONCURRENCY)), rpm, burst
+            )
+        return queue
+
+    @asynccontextmanager
+    async def slot(self, model: str):
+        """Hold one of ``model``'s slots, waiting at the current priority and deadline"""
+        queue = self.queue(model)
+        await queue.acquire(_priority.get(), time_left())
+        try:
+            yield
+        except Exception as e:
+            if getattr(e, "code", None) == 429:
+                queue.throttle()
+            raise
+        finally:
+            queue.release()
+
+    def stats(self) -> dict:
+        return {model: queue.stats() for model, queue in self.queues.items()}
@@ -0,0 +1,148 @@
+"""In-process visual similarity engine built on compact NumPy image descriptors.
+
+Every image is reduced once to a handful of small descriptors:
+
+- a 64-bin RGB colour histogram,
+- a mean-centred 8x8 RGB thumbnail used as a dense embedding,
+- 64-bit perceptual (DCT) and difference hashes.
+
+Descriptors for many images are stacked into matrices so a reference can be
+scored against all targets in a single vectorised pass.
+
+Transparent pixels are flattened onto white the same way uploads are
+(``image_pipeline.to_rgb``), so a cutout product photo gets the same
+descriptors whether it was indexed or uploaded.
+"""
+from typing import NamedTuple
+
+import numpy as np
+from PIL import Image
+
+from utils.image_pipeline import to_rgb
+
+HIST_BINS = 4  # per channel, 4 ** 3 = 64 bins
+EMBED_SIZE = 8  # thumbnail edge, 8 * 8 * 3 = 192 dims
+PHASH_SIZE = 32  # DCT input edge; the low 8x8 frequencies form the hash
+HASH_BITS = 64
+# Bumped whenever descriptors change, so stored catalog features are re-extracted
+FEATURE_VERSION = 2
+
+# Relative weight of each descriptor in the combined score
+WEIGHTS = {"histogram": 0.35, "embedding": 0.35, "phash": 0.15, "dhash": 0.15}
+
+
+class Descriptors(NamedTuple):
+    """Descriptors for one image, or a batch of images stacked along axis 0"""
+    histogram: np.ndarray  # float32 (64,) or (n, 64), sums to 1
+    embedding: np.ndarray  # float32 (192,) or (n, 192), unit length
+    phash: np.ndarray  # uint64 () or (n,)
+    dhash: np.ndarray  # uint64 () or (n,)
+
+
+def _dct_matrix(n: int) -> np.ndarray:
+    k = np.arange(n)[:, None]
+    x = np.arange(n)[None, :]
+    matrix = np.cos(np.pi * (2 * x + 1) * k / (2 * n)) * np.sqrt(2 / n)
+    matrix[0] /= np.sqrt(2)
+    return matrix.astype(np.float32)
+
+
+_DCT = _dct_matrix(PHASH_SIZE)
+_BIT_WEIGHTS = (np.uint64(1) << np.arange(HASH_BITS, dtype=np.uint64))
+
+
+def _pack_bits(bits: np.ndarray) -> np.uint64:
+    return np.bitwise_or.reduce(_BIT_WEIGHTS[bits.ravel()], initial=np.uint64(0))
+
+
+def _small_rgb(image: Image.Image, size: int) -> Image.Image:
+    # Let the JPEG decoder downscale by a power of two before we resample
+    if image.format == "JPEG":
+        image.draft("RGB", (size * 2, size * 2))
+    return to_rgb(image).resize((size, size), Image.Resampling.BILINEAR)
+
+
+def phash(gray: np.ndarray) -> np.uint64:
+    """64-bit DCT perceptual hash of a 32x32 grayscale array"""
+    coefficients = _DCT @ gray @ _DCT.T
+    low = coefficients[:8, :8].ravel()
+    # The DC term only encodes overall brightness, so keep it out of the median
+    return _pack_bits(low > np.median(low[1:]))
+
+
+def dhash(gray: np.ndarray) -> np.uint64:
+    """64-bit horizontal difference hash of an 8-row, 9-column grayscale array"""
+    return _pack_bits(gray[:, 1:] > gray[:, :-1])
+
+
+def describe(image: Image.Image) -> Descriptors:
+    """Compute all descriptors for a decoded image"""
+    small = _small_rgb(image, PHASH_SIZE)
+    rgb = np.asarray(small, dtype=np.uint8)
+
+    quantised = rgb // (256 // HIST_BINS)
+    bins = (quantised[..., 0].astype(np.int32) * HIST_BINS + quantised[..., 1]) * HIST_BINS + quantised[..., 2]
+    histogram = np.bincount(bins.ravel(), minlength=HIST_BINS ** 3).astype(np.float32)
+    histogram /= histogram.sum()
+
+    thumb = np.asarray(small.resize((EMBED_SIZE, EMBED_SIZE), Image.Resampling.BOX), dtype=np.float32).ravel()
+    thumb -= thumb.mean()
+    embedding = thumb / (np.linalg.norm(thumb) or 1.0)
+
+    gray_image = small.convert("L")
+    gray = np.asarray(gray_image, dtype=np.float32)
+    gray_9x8 = np.asarray(gray_image.resize((9, 8), Image.Resampling.BOX), dtype=np.float32)
+
+    return Descriptors(histogram, embedding, phash(gray), dhash(gray_9x8))
+
+
+def stack(descriptors: list[Descriptors]) -> Descriptors:
+    """Stack per-image descriptors into one batch"""
+    if not descriptors:
+        return Descriptors(
+            np.empty((0, HIST_BINS ** 3), np.float32),
+            np.empty((0, EMBED_SIZE * EMBED_SIZE * 3), np.float32),
+            np.empty(0, np.uint64),
+            np.empty(0, np.uint64),
+        )
+    return Descriptors(*(np.stack(field) for field in zip(*descriptors)))
+
+
+def hamming(a: np.ndarray, b) -> np.ndarray:
+    """Bitwise Hamming distance between 64-bit hashes, broadcasting over a"""
+    xor = np.bitwise_xor(np.asarray(a, dtype=np.uint64), np.uint64(b))
+    return np.unpackbits(np.atleast_1d(xor).view(np.uint8).reshape(-1, 8), axis=1).sum(axis=1)
+
+
+def component_scores(reference: Descriptors, targets: Descriptors) -> dict[str, np.ndarray]:
+    """Per-descriptor similarities in [0, 1] for every target"""
+    return {
+        "histogram": np.minimum(targets.histogram, reference.histogram).sum(axis=1),
+        "embedding": (targets.embedding @ reference.embedding + 1.0) / 2.0,
+        "phash": 1.0 - hamming(targets.phash, reference.phash) / HASH_BITS,
+        "dhash": 1.0 - hamming(targets.dhash, reference.dhash) / HASH_BITS,
+    }
+
+
+def similarity_scores(reference: Descriptors, targets: Descriptors) -> np.ndarray:
+    """Weighted similarity of every target to the reference as percentages 0-100"""
+    components = component_scores(reference, targets)
+    combined = sum(WEIGHTS[name] * score for name, score in components.items())
+    return np.clip(np.rint(combined * 100), 0, 100).astype(np.int32)
+
+
+FEATURE_DIM = HIST_BINS ** 3 + EMBED_SIZE * EMBED_SIZE * 3
+
+
+def feature_vectors(descriptors: Descriptors) -> np.ndarray:
+    """Catalog search vectors whose inner product approximates the descriptor similarity.
+
+    The square-rooted histogram turns histogram overlap into a dot product
+    (the Bhattacharyya coefficient); it is joined with the thumbnail embedding
+    so catalog search can run as a single matrix multiply.
+    """
+    histogram = np.sqrt(np.atleast_2d(descriptors.histogram))
+    embedding = np.atleast_2d(descriptors.embedding)
+    vectors = np.hstack([histogram, embedding]).astype(np.float32)
+    vectors /= np.sqrt(2.0)
+    return vectors if np.ndim(descriptors.histogram) == 2 else vectors[0]
@@ -0,0 +1,70 @@
+"""Coalesce concurrent identical async calls into one in-flight call.
+
+The first caller for a key starts the call; callers arriving with the same
+key while it runs wait on the same task and get the same result or
+exception. A caller that goes away does not cancel the call for the others.
+The call is cancelled only once every waiter has gone.
+
+The shared task runs in the first caller's context. Callers that joined
+later can pass ``rerun_if`` to run the call again, as a new shared flight,
+when the first run failed for a reason that was the first caller's own
+(for example its deadline).
+"""
+import asyncio
+from typing import Awaitable, Callable
+
+
+class _Flight:
+    def __init__(self, task: asyncio.Task):
+        self.task = task
+        self.waiters = 0
+
+
+class SingleFlight:
+    def __init__(self, name: str):
+        self.name = name
+        self._flights: dict[str, _Flight] = {}
+        self.calls = 0
+        self.collapsed = 0
+        self.reruns = 0
+
+    def _forget(self, key: str, flight: _Flight):
+        if self._flights.get(key) is flight:
+            del self._flights[key]
+
+    async def do(self, key: str, call: Callable[[], Awaitable],
+                 rerun_if: Callable[[BaseException], bool] | None = None):
+        """Await ``call()``, sharing the run with any concurrent caller using the same key"""
+        self.calls += 1
+        flight = self._flights.get(key)
+        joined = flight is not None
+        if flight is None:
+            flight = _Flight(asyncio.ensure_future(call()))
+            self._flights[key] = flight
+            flight.task.add_done_callback(lambda _: self._forget(key, flight))
+        else:
+            self.collapsed += 1
+
+        flight.waiters += 1
+        try:
+            return await asyncio.shield(flight.task)
+        except Exception as e:
+            if not (joined and rerun_if is not None and rerun_if(e)):
+                raise
+        finally:
+            flight.waiters -= 1
+            if flight.waiters == 0 and not flight.task.done():
+                flight.task.cancel()
+        self._forget(key, flight)
+        self.reruns += 1
+        return await self.do(key, call, rerun_if)
+
+    def stats(self) -> dict:
+        return {
+            "calls": self.calls,
+            "collapsed": self.collapsed,
+            "upstream_calls": self.calls - self.collapsed,
+            "collapse_ratio": round(self.collapsed / self.calls, 4) if self.calls else 0.0,
+            "reruns": self.reruns,
+            "in_flight": len(self._flights),
+        }
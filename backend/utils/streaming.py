@@ -0,0 +1,41 @@
+"""Incremental response helpers for the streaming variants of the endpoints."""
+import json
+from typing import AsyncIterator
+
+from fastapi import Request
+from fastapi.responses import StreamingResponse
+
+NDJSON_MEDIA_TYPE = "application/x-ndjson"
+SSE_MEDIA_TYPE = "text/event-stream"
+
+
+def wants_sse(request: Request) -> bool:
+    """True when the client asked for server-sent events rather than NDJSON"""
+    return SSE_MEDIA_TYPE in request.headers.get("accept", "")
+
+
+def encode_event(event: str, data, sse: bool = False) -> bytes:
+    """Serialise one event as an NDJSON line or an SSE frame"""
+    if sse:
+        return f"event: {event}\ndata: {json.dumps(data)}\n\n".encode("utf-8")
+    return (json.dumps({"event": event, "data": data}) + "\n").encode("utf-8")
+
+
+def stream_events(request: Request, events: AsyncIterator[tuple[str, object]]) -> StreamingResponse:
+    """Stream (event, data) pairs to the client as soon as each one is produced.
+
+    NDJSON is the default; clients sending ``Accept: text/event-stream`` get
+    server-sent events with the same event names and payloads.
+    """
+    sse = wants_sse(request)
+
+    async def body():
+        async for event, data in events:
+            yield encode_event(event, data, sse)
+
+    return StreamingResponse(
+        body(),
+        media_type=SSE_MEDIA_TYPE if sse else NDJSON_MEDIA_TYPE,
+        # Stop reverse proxies from buffering the stream
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"},
+    )
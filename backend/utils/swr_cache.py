@@ -0,0 +1,160 @@
+"""Stale-while-revalidate cache for model answers that depend only on small inputs.
+
+A fresh entry is served as-is. A stale entry is still served immediately,
+and one background refresh replaces it. Only entries past their stale
+window (or never seen) make the caller wait for the model.
+
+With RESULT_STORE=sqlite, entries are also written to the host-wide result
+store, so a worker that misses locally picks up answers other workers
+already have, and a refresh finished by one worker is adopted by the rest
+instead of being repeated.
+"""
+import asyncio
+import hashlib
+import json
+import os
+import sqlite3
+import time
+from collections import OrderedDict
+from typing import Awaitable, Callable
+
+from utils.result_cache import CACHES
+from utils.result_store import CachedResult, shared_store
+from utils.scheduler import BACKGROUND, priority
+
+DEFAULT_FRESH_TTL_S = float(os.getenv("TEXT_CACHE_TTL_S", "3600"))
+DEFAULT_STALE_TTL_S = float(os.getenv("TEXT_CACHE_STALE_S", "86400"))
+DEFAULT_MAX_ENTRIES = int(os.getenv("TEXT_CACHE_MAX_ENTRIES", "1000"))
+
+
+def _normalise(value):
+    if isinstance(value, str):
+        return " ".join(value.split()).lower()
+    if isinstance(value, dict):
+        return {str(k).strip().lower(): _normalise(v) for k, v in value.items()}
+    if isinstance(value, (list, tuple)):
+        return [_normalise(v) for v in value]
+    return value
+
+
+def request_key(*values) -> str:
+    """Cache key for request parameters, ignoring case, spacing and dict order"""
+    canonical = json.dumps(_normalise(values), sort_keys=True, default=str)
+    return hashlib.sha256(canonical.encode("utf-8")).hexdigest()
+
+
+class StaleWhileRevalidateCache:
+    def __init__(self, name: str, fresh_ttl_s: float = DEFAULT_FRESH_TTL_S,
+                 stale_ttl_s: float = DEFAULT_STALE_TTL_S, max_entries: int = DEFAULT_MAX_ENTRIES):
+        self.name = name
+        self.fresh_ttl_s = fresh_ttl_s
+        self.stale_ttl_s = stale_ttl_s
+        self.max_entries = max_entries
+        self._entries: OrderedDict[str, tuple[float, object]] = OrderedDict()
+        self._refreshing: dict[str, asyncio.Task] = {}
+        self.shared = shared_store()
+        self.hits = 0
+        self.stale_hits = 0
+        self.shared_hits = 0
+        self.misses = 0
+        self.refresh_failures = 0
+        CACHES[name] = self
+
+    def _remember(self, key: str, value, created_at: float):
+        self._entries[key] = (created_at, value)
+        self._entries.move_to_end(key)
+        while len(self._entries) > self.max_entries:
+            self._entries.popitem(last=False)
+
+    def _read_shared(self, key: str) -> tuple[float, object] | None:
+        try:
+            entry = self.shared.get(self.name, key)
+            return (entry.created_at, json.loads(entry.payload)) if entry else None
+        except (sqlite3.Error, ValueError) as e:
+            print(f"Could not read {self.name} cache entry from the shared store: {e}")
+            return None
+
+    def _write_shared(self, key: str, value, created_at: float):
+        entry = CachedResult(json.dumps(value).encode("utf-8"), {}, created_at)
+        try:
+            self.shared.put(self.name, key, entry, self.fresh_ttl_s + self.stale_ttl_s)
+        except sqlite3.Error as e:
+            print(f"Could not write {self.name} cache entry to the shared store: {e}")
+
+    async def put(self, key: str, value):
+        """Insert or replace an entry, evicting the least recently used"""
+        created_at = time.time()
+        self._remember(key, value, created_at)
+        if self.shared is not None:
+            await asyncio.to_thread(self._write_shared, key, value, created_at)
+
+    async def lookup(self, key: str, refresh: Callable[[], Awaitable] | None = None):
+        """Return the cached value or None; a stale hit schedules ``refresh`` in the background"""
+        entry = self._entries.get(key)
+        if entry is None and self.shared is not None:
+            entry = await asyncio.to_thread(self._read_shared, key)
+            if entry is not None:
+                self.shared_hits += 1
+                self._remember(key, entry[1], entry[0])
+        if entry is None:
+            self.misses += 1
+            return None
+
+        created_at, value = entry
+        age = time.time() - created_at
+        if age > self.fresh_ttl_s + self.stale_ttl_s:
+            del self._entries[key]
+            self.misses += 1
+            return None
+
+        self._entries.move_to_end(key)
+        if age <= self.fresh_ttl_s:
+            self.hits += 1
+        else:
+            self.stale_hits += 1
+            if refresh is not None and key not in self._refreshing:
+                task = asyncio.create_task(self._refresh(key, refresh))
+                self._refreshing[key] = task
+        return value
+
+    async def _refresh(self, key: str, refresh: Callable[[], Awaitable]):
+        try:
+            if self.shared is not None:
+                # Another worker may have refreshed this entry already
+                entry = await asyncio.to_thread(self._read_shared, key)
+                if entry is not None and time.time() - entry[0] <= self.fresh_ttl_s:
+                    self._remember(key, entry[1], entry[0])
+                    return
+            # Nobody is waiting on a refresh, so it yields to live requests
+            with priority(BACKGROUND):
+                value = await refresh()
+            if value is not None:
+                await self.put(key, value)
+        except Exception as e:
+            # Keep serving the stale value; the next stale hit retries
+            self.refresh_failures += 1
+            print(f"Background refresh for {self.name} cache failed: {e}")
+        finally:
+            self._refreshing.pop(key, None)
+
+    async def get_or_compute(self, key: str, compute: Callable[[], Awaitable]):
+        """Serve from cache (refreshing stale entries in the background) or compute and store"""
+        value = await self.lookup(key, compute)
+        if value is None:
+            value = await compute()
+            if value is not None:
+                await self.put(key, value)
+        return value
+
+    def stats(self) -> dict:
+        lookups = self.hits + self.stale_hits + self.misses
+        return {
+            "hits": self.hits,
+            "stale_hits": self.stale_hits,
+            "shared_hits": self.shared_hits,
+            "misses": self.misses,
+            "hit_ratio": round((self.hits + self.stale_hits) / lookups, 4) if lookups else 0.0,
+            "refreshing": len(self._refreshing),
+            "refresh_failures": self.refresh_failures,
+            "entries": len(self._entries),
+        }
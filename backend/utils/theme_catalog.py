@@ -0,0 +1,145 @@
+"""Outfit themes and occasion tips for /occasion-styling, loaded from a JSON file.
+
+``data/outfit_themes.json`` (or ``OUTFIT_THEMES_PATH``) holds:
+
+- ``themes``: outfit records with display fields (``title``, ``description``,
+  ``image``, ``pieces``, ``tips``, ``confidence``, ``versatility``). Each also
+  has the ``occasions``, ``styles`` and ``genders`` it suits; a gender of
+  ``unisex`` suits everyone.
+- ``tips``: general tips per occasion.
+- ``default_occasion``: used for occasions the file does not know.
+
+On load, the themes for every (occasion, style, gender) combination are
+ranked once. A lookup is then a dict access. Themes made for the occasion
+come first, ordered by style match, then by exact gender match. Themes from
+other occasions that match the style fill any remaining slots, so a result
+never repeats a theme. The file's modification time is checked at most every
+``OUTFIT_THEMES_CHECK_S`` seconds, and the catalog is rebuilt when it
+changes. No restart is needed.
+"""
+import json
+import os
+import time
+from pathlib import Path
+
+THEMES_PATH = Path(os.getenv("OUTFIT_THEMES_PATH", "data/outfit_themes.json"))
+RELOAD_CHECK_S = float(os.getenv("OUTFIT_THEMES_CHECK_S", "2"))
+THEMES_PER_RESPONSE = 6
+
+UNISEX = "unisex"
+# Outfit fields in the response, by theme field
+OUTFIT_FIELDS = {
+    "title": "title",
+    "description": "description",
+    "image": "image",
+    "pieces": "pieces",
+    "tips": "styling_tips",
+    "confidence": "confidence_boost",
+    "versatility": "versatility",
+}
+
+
+class ThemeCatalog:
+    def __init__(self, themes: list[dict], tips: dict[str, list[str]], default_occasion: str):
+        self.default_occasion = default_occasion
+        self.tips = tips
+        self.occasions = sorted({occasion for theme in themes for occasion in theme["occasions"]})
+        if default_occasion not in self.occasions:
+            raise ValueError(f"Default occasion {default_occasion!r} has no themes")
+        self.styles = sorted({style for theme in themes for style in theme["styles"]})
+        self.outfits = [
+            {field: theme[source] for source, field in OUTFIT_FIELDS.items()}
+            for theme in themes
+        ]
+
+        # Unknown styles rank as "" (no style preference); unisex requests see every theme
+        self._index: dict[tuple[str, str, str], tuple[dict, ...]] = {}
+        for occasion in self.occasions:
+            for style in [*self.styles, ""]:
+                for gender in ("female", "male", UNISEX):
+                    self._index[occasion, style, gender] = self._rank(themes, occasion, style, gender)
+
+    def _rank(self, themes: list[dict], occasion: str, style: str, gender: str) -> tuple[dict, ...]:
+        def score(i: int):
+            theme = themes[i]
+            return (
+                occasion not in theme["occasions"],
+                style not in theme["styles"],
+                gender not in theme["genders"],
+                i,
+            )
+
+        suits = [
+            i for i, theme in enumerate(themes)
+            if gender == UNISEX or gender in theme["genders"] or UNISEX in theme["genders"]
+        ]
+        for_occasion = [i for i in suits if occasion in themes[i]["occasions"]]
+        if len(for_occasion) < THEMES_PER_RESPONSE:
+            # Top up only with other occasions' themes that share the style
+            for_occasion += [i for i in suits if occasion not in themes[i]["occasions"]
+                             and (not style or style in themes[i]["styles"])]
+        return tuple(self.outfits[i] for i in sorted(for_occasion, key=score)[:THEMES_PER_RESPONSE])
+
+    def _occasion(self, occasion: str) -> str:
+        occasion = (occasion or "").strip().lower()
+        return occasion if occasion in self.occasions else self.default_occasion
+
+    def themes_for(self, occasion: str, style: str, gender: str) -> tuple[dict, ...]:
+        """The outfit themes for a request; treat the returned dicts as read-only"""
+        style = (style or "").strip().lower()
+        gender = (gender or "").strip().lower()
+        return self._index[
+            self._occasion(occasion),
+            style if style in self.styles else "",
+            gender if gender in ("female", "male") else UNISEX,
+        ]
+
+    def tips_for(self, occasion: str) -> list[str]:
+        return self.tips.get(self._occasion(occasion), self.tips.get(self.default_occasion, []))
+
+
+def read_theme_catalog(path: Path) -> ThemeCatalog:
+    with open(path, encoding="utf-8") as f:
+        data = json.load(f)
+    return ThemeCatalog(data["themes"], data.get("tips", {}), data.get("default_occasion", "casual"))
+
+
+_catalog: ThemeCatalog | None = None
+_loaded_mtime = 0.0
+_checked_at = 0.0
+
+
+def load_theme_catalog(path: Path = THEMES_PATH) -> ThemeCatalog | None:
+    """Load (or reload) the catalog; a broken file keeps the previous catalog serving"""
+    global _catalog, _loaded_mtime, _checked_at
+    _checked_at = time.monotonic()
+    try:
+        # Recorded before parsing, so a broken file is reported once per change
+        _loaded_mtime = path.stat().st_mtime
+        started = time.perf_counter()
+        _catalog = read_theme_catalog(path)
+        print(f"Loaded {len(_catalog.outfits)} outfit themes from {path} in "
+              f"{(time.perf_counter() - started) * 1000:.1f}ms")
+    except (OSError, ValueError, KeyError, TypeError) as e:
+        print(f"Could not load outfit themes from {path}: {e!r}")
+    return _catalog
+
+
+def is_loaded() -> bool:
+    return _catalog is not None
+
+
+def get_theme_catalog(path: Path = THEMES_PATH) -> ThemeCatalog:
+    """The current catalog, reloaded first if the file changed"""
+    global _checked_at
+    if _catalog is None or time.monotonic() - _checked_at >= RELOAD_CHECK_S:
+        _checked_at = time.monotonic()
+        try:
+            changed = path.stat().st_mtime != _loaded_mtime
+        except OSError:
+            changed = False
+        if _catalog is None or changed:
+            load_theme_catalog(path)
+    if _catalog is None:
+        raise RuntimeError(f"No outfit themes available from {path}")
+    return _catalog
@@ -0,0 +1,118 @@
+"""Per-request stage timings, reported in a Server-Timing header.
+
+``ServerTimingMiddleware`` starts a timing record for each request in a
+context variable. Code anywhere below it, including tasks and worker threads
+started from the request, wraps work in ``stage("name")``. The recorded
+spans are sent as a ``Server-Timing`` header, which browser devtools show
+in the network panel. A sampled share of requests is also logged as one
+JSON line.
+
+Only spans finished before the response headers are sent can be included in
+the header. For streamed responses, the full breakdown is in the log line.
+"""
+import json
+import os
+import random
+import re
+import threading
+import time
+from contextlib import contextmanager
+from contextvars import ContextVar
+
+SERVER_TIMING_ENABLED = os.getenv("SERVER_TIMING", "true").lower() in ("1", "true", "yes")
+# Share of requests (0-1) whose stage breakdown is logged
+TIMING_LOG_SAMPLE_RATE = float(os.getenv("TIMING_LOG_SAMPLE_RATE", "0"))
+
+_TOKEN_UNSAFE = re.compile(r"[^A-Za-z0-9_.-]")
+
+
+class RequestTimings:
+    def __init__(self):
+        self.start = time.perf_counter()
+        self.spans: list[tuple[str, float, str]] = []  # (name, milliseconds, description)
+        self._names: dict[str, int] = {}
+        # Stages also finish in worker threads, concurrently with the loop
+        self._lock = threading.Lock()
+
+    def record(self, name: str, duration_s: float, description: str = ""):
+        """Add a span; repeated names get a numeric suffix so each stays visible"""
+        name = _TOKEN_UNSAFE.sub("_", name)
+        with self._lock:
+            seen = self._names.get(name, 0) + 1
+            self._names[name] = seen
+            if seen > 1:
+                name = f"{name}_{seen}"
+            self.spans.append((name, duration_s * 1000, description.replace('"', "'")))
+
+    def elapsed_ms(self) -> float:
+        return (time.perf_counter() - self.start) * 1000
+
+    def header(self) -> str:
+        entries = [f"{name};dur={ms:.1f}" + (f';desc="{desc}"' if desc else "") for name, ms, desc in self.spans]
+        entries.append(f"total;dur={self.elapsed_ms():.1f}")
+        return ", ".join(entries)
+
+
+_current: ContextVar[RequestTimings | None] = ContextVar("request_timings", default=None)
+
+
+def current_timings() -> RequestTimings | None:
+    return _current.get()
+
+
+@contextmanager
+def stage(name: str, description: str = ""):
+    """Time the enclosed block as a named span of the current request, if any"""
+    timings = _current.get()
+    if timings is None:
+        yield
+        return
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        timings.record(name, time.perf_counter() - start, description)
+
+
+async def timed(name: str, awaitable, description: str = ""):
+    """Await ``awaitable`` as a named span of the current request"""
+    with stage(name, description):
+        return await awaitable
+
+
+class ServerTimingMiddleware:
+    def __init__(self, app, sample_rate: float = TIMING_LOG_SAMPLE_RATE, header: bool = SERVER_TIMING_ENABLED):
+        self.app = app
+        self.sample_rate = sample_rate
+        self.header = header
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            return await self.app(scope, receive, send)
+
+        timings = RequestTimings()
+        token = _current.set(timings)
+        status = 500
+
+        async def timed_send(message):
+            nonlocal status
+            if message["type"] == "http.response.start":
+                status = message["status"]
+                if self.header:
+                    message["headers"] = [*message.get("headers", []),
+                                          (b"server-timing", timings.header().encode("latin-1"))]
+            await send(message)
+
+        try:
+            await self.app(scope, receive, timed_send)
+        finally:
+            _current.reset(token)
+            if self.sample_rate and random.random() < self.sample_rate:
+                print(json.dumps({
+                    "event": "request_timing",
+                    "method": scope["method"],
+                    "path": scope["path"],
+                    "status": status,
+                    "total_ms": round(timings.elapsed_ms(), 1),
+                    "stages": {name: round(ms, 1) for name, ms, _ in timings.spans},
+                }))
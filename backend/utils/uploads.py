@@ -0,0 +1,159 @@
+"""Bounded ingestion of uploaded images.
+
+Two layers keep per-request memory bounded regardless of what clients send:
+
+- ``BodySizeLimitMiddleware`` rejects requests whose declared or streamed
+  body exceeds ``MAX_REQUEST_BODY_BYTES`` before the multipart parser has
+  spooled them.
+- ``UploadBudget`` reads each file in chunks and enforces per-file,
+  per-request and file-count limits, rejecting a file from its reported
+  size before reading it. The real image type is sniffed from the
+  leading bytes instead of trusting the client's ``content_type``.
+"""
+import os
+from typing import NamedTuple
+
+from fastapi import HTTPException, UploadFile
+from fastapi.responses import JSONResponse
+
+from utils.timing import stage
+
+MAX_FILE_BYTES = int(float(os.getenv("MAX_IMAGE_SIZE_MB", "10")) * 1024 * 1024)
+MAX_TOTAL_BYTES = int(float(os.getenv("MAX_UPLOAD_TOTAL_MB", "50")) * 1024 * 1024)
+MAX_FILES = int(os.getenv("MAX_UPLOAD_FILES", "21"))
+# Room for form fields and multipart framing on top of the file bytes
+MAX_REQUEST_BODY_BYTES = MAX_TOTAL_BYTES + 1024 * 1024
+CHUNK_SIZE = 64 * 1024
+
+HEIF_BRANDS = {b"heic": "image/heic", b"heix": "image/heic", b"hevc": "image/heic",
+               b"heim": "image/heic", b"heis": "image/heic", b"mif1": "image/heif", b"msf1": "image/heif"}
+
+
+def sniff_image_type(head: bytes) -> str | None:
+    """MIME type from an image's magic bytes, or None if it is not a supported image"""
+    if head.startswith(b"\xff\xd8\xff"):
+        return "image/jpeg"
+    if head.startswith(b"\x89PNG\r\n\x1a\n"):
+        return "image/png"
+    if head[:4] == b"RIFF" and head[8:12] == b"WEBP":
+        return "image/webp"
+    if head[4:8] == b"ftyp":
+        return HEIF_BRANDS.get(head[8:12])
+    return None
+
+
+class IngestedUpload(NamedTuple):
+    data: bytes
+    mime_type: str  # sniffed, not client-declared
+    filename: str | None
+
+
+def _too_large(detail: str) -> HTTPException:
+    return HTTPException(status_code=413, detail=detail)
+
+
+class UploadBudget:
+    """Limits shared by every file read while handling one request"""
+
+    def __init__(self, max_file_bytes: int = MAX_FILE_BYTES, max_total_bytes: int = MAX_TOTAL_BYTES,
+                 max_files: int = MAX_FILES):
+        self.max_file_bytes = max_file_bytes
+        self.max_total_bytes = max_total_bytes
+        self.max_files = max_files
+        self.files = 0
+        self.total_bytes = 0
+
+    def check_count(self, count: int):
+        """Reject up front when a request carries more files than allowed"""
+        if self.files + count > self.max_files:
+            raise _too_large(f"Too many files: at most {self.max_files} images per request")
+
+    async def read(self, upload: UploadFile, field: str) -> IngestedUpload:
+        """Read one upload in chunks, enforcing the limits and sniffing its type"""
+        with stage("upload_read", field):
+            return await self._read(upload, field)
+
+    async def _read(self, upload: UploadFile, field: str) -> IngestedUpload:
+        self.check_count(1)
+        self.files += 1
+        limit = min(self.max_file_bytes, self.max_total_bytes - self.total_bytes)
+        if upload.size is not None and upload.size > limit:
+            raise self._over_limit(field)
+
+        chunks = []
+        size = 0
+        while chunk := await upload.read(CHUNK_SIZE):
+            if not chunks:
+                mime_type = sniff_image_type(chunk)
+                if mime_type is None:
+                    raise HTTPException(status_code=415, detail=f"Unsupported file type for {field}")
+            size += len(chunk)
+            if size > limit:
+                raise self._over_limit(field)
+            chunks.append(chunk)
+
+        if not chunks:
+            raise HTTPException(status_code=400, detail=f"Empty file for {field}")
+        self.total_bytes += size
+        return IngestedUpload(b"".join(chunks), mime_type, upload.filename)
+
+    def _over_limit(self, field: str) -> HTTPException:
+        """413 naming whichever limit the current file ran into"""
+        if self.max_total_bytes - self.total_bytes < self.max_file_bytes:
+            total_mb = self.max_total_bytes // (1024 * 1024)
+            return _too_large(f"Uploads exceed the {total_mb}MB total limit per request at {field}")
+        return _too_large(f"Image exceeds {self.max_file_bytes // (1024 * 1024)}MB size limit for {field}")
+
+
+class _BodyTooLarge(Exception):
+    pass
+
+
+class BodySizeLimitMiddleware:
+    """Reject request bodies over ``max_bytes`` by header or while they stream in"""
+
+    def __init__(self, app, max_bytes: int = MAX_REQUEST_BODY_BYTES):
+        self.app = app
+        self.max_bytes = max_bytes
+
+    async def _reject(self, scope, receive, send):
+        response = JSONResponse(status_code=413, content={"detail": "Request body too large"})
+        await response(scope, receive, send)
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            return await self.app(scope, receive, send)
+
+        declared = dict(scope["headers"]).get(b"content-length")
+        if declared is not None and declared.isdigit() and int(declared) > self.max_bytes:
+            return await self._reject(scope, receive, send)
+
+        received = 0
+        too_large = False
+        response_started = False
+
+        async def limited_receive():
+            nonlocal received, too_large
+            message = await receive()
+            if message["type"] == "http.request":
+                received += len(message.get("body", b""))
+                if received > self.max_bytes:
+                    too_large = True
+                    raise _BodyTooLarge()
+            return message
+
+        async def guarded_send(message):
+            nonlocal response_started
+            # Once the body overflowed, the app's own error response is replaced by a 413
+            if too_large:
+                return
+            if message["type"] == "http.response.start":
+                response_started = True
+            await send(message)
+
+        try:
+            await self.app(scope, limited_receive, guarded_send)
+        except _BodyTooLarge:
+            pass
+        if too_large and not response_started:
+            await self._reject(scope, receive, send)